@@ -2,14 +2,15 @@
 Wrapper around
 """
 
-import json
 import logging
 
 import flask
 import requests
 
 import registry.harbor
-from registry.util import get_admin_harbor_api, get_harbor_api, is_soteria_admin
+import registry.harbor_proxy
+from registry.clients import get_admin_harbor_api, get_harbor_api
+from registry.util import is_soteria_admin, stream_json_array
 
 __all__ = ["bp"]
 
@@ -32,13 +33,7 @@ def get_api() -> registry.harbor.HarborAPI:
 @bp.route("/get/", defaults={"path": ""}, methods=["GET"])
 @bp.route("/get/<path:path>")
 def catch_all(path):
-    response = requests.get(
-        "{0}/{1}".format(flask.current_app.config["HARBOR_API_URL"], path),
-        params=flask.request.args,
-    )
-    headers = {k: v for k, v in response.headers.items() if k in HEADERS_TO_PASS}
-
-    return flask.make_response((response.content, response.status_code, headers))
+    return registry.harbor_proxy.get(path)
 
 
 @bp.route("/users", methods=["GET"])
@@ -57,5 +52,14 @@ def audit_logs():
 
 @bp.route("/scanners/all", methods=["GET"])
 def scanners_all():
-    response = get_api().get_all_scanners(**flask.request.args)
-    return flask.Response(json.dumps([*response]), mimetype="application/json")
+    try:
+        return stream_json_array(get_api().get_all_scanners(**flask.request.args))
+    except requests.HTTPError as exn:
+        response = exn.response
+        headers = {k: v for k, v in response.headers.items() if k in HEADERS_TO_PASS}
+        return flask.make_response((response.content, response.status_code, headers))
+    except requests.RequestException:
+        flask.current_app.logger.warning("Failed to get all scanners", exc_info=True)
+        return flask.make_response(
+            {"errors": [{"code": "BAD_GATEWAY", "message": "Harbor is unavailable"}]}, 502
+        )
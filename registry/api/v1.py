@@ -3,14 +3,16 @@ SOTERIA API version 1.
 """
 
 import dataclasses
-import json
 from typing import Any, Dict, List, Optional, Union
 
 import flask
 from typing_extensions import Literal
 
+import registry.catalog
 import registry.database
+import registry.metrics
 import registry.util
+import registry.webhooks
 from registry.cache import cache
 from registry.database import Source
 
@@ -18,6 +20,9 @@ __all__ = ["bp"]
 
 bp = flask.Blueprint("api_v1", __name__)
 
+# The largest page of results that the catalog's endpoints will return.
+CATALOG_MAX_PAGE_SIZE = 100
+
 
 @dataclasses.dataclass
 class UserObject:
@@ -102,6 +107,85 @@ def version() -> flask.Response:
     return make_ok_response({"version": version_string})
 
 
+@bp.route("/metrics")
+def metrics() -> flask.Response:
+    """
+    Reports this process's internal metrics to administrators, along with
+    the counters that all processes share via the database.
+    """
+    if not registry.util.is_soteria_admin():
+        return make_error_response(403, "Forbidden")
+
+    return make_ok_response(
+        {**registry.metrics.snapshot(), "shared_counters": registry.database.get_counters()}
+    )
+
+
+def make_page_response(items: List[Dict[str, Any]], total: int) -> flask.Response:
+    """
+    Returns one page of a collection, in the same format as Harbor's API.
+    """
+    response = flask.make_response(flask.jsonify(items))
+    response.headers["X-Total-Count"] = str(total)
+    return response
+
+
+def get_page_args() -> Dict[str, Any]:
+    """
+    Returns the Harbor-style paging and sort parameters of a request.
+    """
+    args = flask.request.args
+
+    return {
+        "page": max(1, args.get("page", 1, type=int)),
+        "page_size": min(max(1, args.get("page_size", 10, type=int)), CATALOG_MAX_PAGE_SIZE),
+        "sort": args.get("sort"),
+    }
+
+
+@bp.route("/catalog/projects")
+def catalog_projects() -> flask.Response:
+    """
+    Lists public projects from the local catalog.
+    """
+    items, total = registry.catalog.list_projects(
+        q=flask.request.args.get("q"), **get_page_args()
+    )
+    return make_page_response(items, total)
+
+
+@bp.route("/catalog/projects/<project>/repositories")
+def catalog_repositories(project: str) -> flask.Response:
+    """
+    Lists a public project's repositories from the local catalog.
+    """
+    items, total = registry.catalog.list_repositories(
+        project, q=flask.request.args.get("q"), **get_page_args()
+    )
+    return make_page_response(items, total)
+
+
+@bp.route("/catalog/projects/<project>/repositories/<path:repository>/artifacts")
+def catalog_artifacts(project: str, repository: str) -> flask.Response:
+    """
+    Lists a public repository's artifacts from the local catalog.
+    """
+    items, total = registry.catalog.list_artifacts(project, repository, **get_page_args())
+    return make_page_response(items, total)
+
+
+@bp.route("/catalog/search")
+def catalog_search() -> flask.Response:
+    """
+    Searches the local catalog's public repositories, best matches first.
+    """
+    args = get_page_args()
+    items, total = registry.catalog.search(
+        flask.request.args.get("q", ""), page=args["page"], page_size=args["page_size"]
+    )
+    return make_page_response(items, total)
+
+
 @bp.route("/users/<user_id>")
 def get_user(user_id: str) -> flask.Response:
     if user_id != "current":
@@ -144,6 +228,7 @@ def check_user_harbor_id(user_id: str):
     flask.current_app.logger.info(registry.util.get_subiss())
 
     cache.delete_memoized(registry.util.get_harbor_user_by_subiss, registry.util.get_subiss())
+    registry.util.forget_harbor_user()
     harbor_user = registry.util.get_harbor_user()
 
     username = harbor_user["username"] if harbor_user else None
@@ -197,10 +282,9 @@ def webhook_for_harbor():
         and auth.token == flask.current_app.config["WEBHOOKS_HARBOR_BEARER_TOKEN"]
     ):
         payload = flask.request.get_json()
-        payload_as_text = json.dumps(payload, indent=2)
 
-        flask.current_app.logger.info(f"Webhook called from Harbor:\n{payload_as_text}")
-        registry.database.insert_new_payload(payload, Source.harbor)
+        registry.webhooks.log_payload(payload, Source.harbor)
+        registry.webhooks.ingest_payload(payload, Source.harbor)
         return make_ok_response({"message": "webhook completed succesfully"})
 
     return make_error_response(401, "Unauthorized")
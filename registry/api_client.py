@@ -2,13 +2,20 @@
 Base class for a wrapper around a REST API.
 """
 
+import http.cookiejar
 import logging
 from typing import Optional
 
 import requests
+import requests.adapters
+import urllib3.util.retry
 
 __all__ = ["GenericAPI"]
 
+# Defaults for the HTTP connection pool used by each wrapper.
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_MAX_RETRIES = 3
+
 
 class GenericAPI:
     # pylint: disable=too-few-public-methods
@@ -22,29 +29,46 @@ class GenericAPI:
         self,
         api_base_url: str,
         basic_auth: Optional[tuple[str, str]] = None,
+        *,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        max_retries: int = DEFAULT_MAX_RETRIES,
     ):
         """
         Construct a wrapper that uses the provided credentials.
 
         If a username and password are provided via `basic_auth`, API calls
         will be made using Basic authentication.
+
+        Connections are kept alive and reused, with up to `pool_maxsize`
+        connections per host. Idempotent requests that fail to connect or
+        that receive a 502, 503, or 504 are retried up to `max_retries` times.
         """
         self._api_base_url = api_base_url
         self._basic_auth = basic_auth
 
         self._session = requests.Session()
 
+        # Every request is authenticated on its own, so there is no need for
+        # session cookies. Refusing them also means that Harbor never expects
+        # an XSRF token to accompany a mutating request.
+
+        self._session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+        adapter = requests.adapters.HTTPAdapter(
+            pool_maxsize=pool_maxsize,
+            max_retries=urllib3.util.retry.Retry(
+                total=max_retries,
+                backoff_factor=0.5,
+                status_forcelist=[502, 503, 504],
+                raise_on_status=False,
+            ),
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
         self._log = logging.getLogger(self.__class__.__name__)
         self._log.addHandler(logging.NullHandler())
 
-    def _renew_session(self) -> None:
-        """
-        Hack for avoiding tracking XSRF tokens.
-        """
-        if self._session:
-            self._session.close()
-        self._session = requests.Session()
-
     def _request(self, method: str, url: str, **kwargs) -> requests.Response:
         """
         Log and send an HTTP request.
@@ -80,7 +104,6 @@ class GenericAPI:
         """
         Log and send an HTTP DELETE request for the given route.
         """
-        self._renew_session()
         return self._request("DELETE", f"{self._api_base_url}{route}", **kwargs)
 
     def _get(self, route: str, **kwargs) -> requests.Response:
@@ -99,12 +122,10 @@ class GenericAPI:
         """
         Log and send an HTTP PATCH request for the given route.
         """
-        self._renew_session()
         return self._request("PATCH", f"{self._api_base_url}{route}", **kwargs)
 
     def _post(self, route: str, **kwargs) -> requests.Response:
         """
         Log and send an HTTP POST request for the given route.
         """
-        self._renew_session()
         return self._request("POST", f"{self._api_base_url}{route}", **kwargs)
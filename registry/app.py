@@ -12,12 +12,13 @@ import flask_assets  # type: ignore[import-untyped]
 import registry.api.debug
 import registry.api.harbor
 import registry.api.v1
+import registry.cache
+import registry.catalog
 import registry.cli
 import registry.database
 import registry.public
 import registry.util
 import registry.website
-from registry.cache import cache
 
 __all__ = ["create_app"]
 
@@ -137,7 +138,8 @@ def create_app() -> flask.Flask:
     add_context_processor(app)
 
     registry.database.init(app)
-    cache.init_app(app)
+    registry.catalog.init(app)
+    registry.cache.init(app)
 
     app.logger.info("Created and configured app!")
 
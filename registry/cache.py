@@ -1,9 +1,212 @@
 """
-Use a local Python dictionary as a cache.
+Configure the web application's cache.
+
+By default, each process uses a local Python dictionary as its cache. When
+the web application runs as several processes, set `CACHE_TYPE` to
+"registry.cache.SQLiteCache" so that all processes share one cache stored
+in the data directory, and so that invalidations reach every process.
 """
 
+import itertools
+import os
+import pathlib
+import pickle  # nosec B403
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+import flask
 import flask_caching
+from flask_caching.backends.base import BaseCache
+
+__all__ = ["SQLiteCache", "cache", "init"]
+
+# Path to the shared cache's database file, relative to the data directory.
+CACHE_DB_FILE = "cache/cache.sqlite"
+
+# Granularity (in seconds) with which entries' last access times are tracked.
+ACCESS_RESOLUTION = 1.0
+
+# Number of writes by a process between checks of the cache's size.
+PRUNE_INTERVAL = 100
+
+cache = flask_caching.Cache()
+
+
+class SQLiteCache(BaseCache):
+    """
+    A cache that is shared among processes via an SQLite database.
+
+    The cache holds about `threshold` entries. Every `PRUNE_INTERVAL`
+    writes, if it has grown larger, expired entries are removed first, then
+    the least recently used ones.
+    """
+
+    def __init__(
+        self,
+        path: os.PathLike,
+        default_timeout: int = 300,
+        threshold: int = 500,
+        **_: Any,
+    ):
+        super().__init__(default_timeout=default_timeout)
+
+        self._path = pathlib.Path(path)
+        self._threshold = threshold
+        self._local = threading.local()
+        self._writes = itertools.count(1)
+
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self._conn() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cache
+                (
+                  key TEXT PRIMARY KEY
+                , value BLOB
+                , expires REAL
+                , accessed REAL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS cache_accessed_index
+                ON cache (accessed)
+                """
+            )
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        path = config.get("CACHE_SQLITE_FILE")
+        path = (
+            pathlib.Path(path) if path else pathlib.Path(app.config["DATA_DIR"]) / CACHE_DB_FILE
+        )
+        kwargs.update(threshold=config["CACHE_THRESHOLD"])
+        return cls(path, *args, **kwargs)
+
+    def _conn(self) -> sqlite3.Connection:
+        """
+        Return this thread's connection to the cache's database.
+        """
+        conn: Optional[sqlite3.Connection] = getattr(self._local, "conn", None)
+
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+
+        return conn
+
+    def _expires(self, timeout: Optional[int]) -> float:
+        if timeout is None:
+            timeout = self.default_timeout
+        return time.time() + timeout if timeout > 0 else 0
+
+    def _prune(self, conn: sqlite3.Connection) -> None:
+        (count,) = conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+
+        if count <= self._threshold:
+            return
+
+        conn.execute(
+            "DELETE FROM cache WHERE expires != 0 AND expires <= :now",
+            {"now": time.time()},
+        )
+        conn.execute(
+            """
+            DELETE FROM cache
+            WHERE key IN (
+              SELECT key FROM cache
+              ORDER BY accessed ASC
+              LIMIT MAX(0, (SELECT COUNT(*) FROM cache) - :threshold)
+            )
+            """,
+            {"threshold": self._threshold},
+        )
+
+    def get(self, key: str) -> Any:
+        conn = self._conn()
+        now = time.time()
+
+        row = conn.execute(
+            "SELECT value, expires, accessed FROM cache WHERE key = :key",
+            {"key": key},
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        value, expires, accessed = row
+
+        if expires != 0 and expires <= now:
+            conn.execute("DELETE FROM cache WHERE key = :key", {"key": key})
+            return None
+
+        if now - accessed > ACCESS_RESOLUTION:
+            conn.execute(
+                "UPDATE cache SET accessed = :now WHERE key = :key",
+                {"key": key, "now": now},
+            )
+
+        return pickle.loads(value)  # nosec B301
+
+    def set(self, key: str, value: Any, timeout: Optional[int] = None) -> Optional[bool]:
+        conn = self._conn()
+
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO cache ( key, value, expires, accessed )
+                VALUES ( :key, :value, :expires, :accessed )
+                """,
+                {
+                    "key": key,
+                    "value": pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                    "expires": self._expires(timeout),
+                    "accessed": time.time(),
+                },
+            )
+            if next(self._writes) % PRUNE_INTERVAL == 0:
+                self._prune(conn)
+
+        return True
+
+    def add(self, key: str, value: Any, timeout: Optional[int] = None) -> bool:
+        if self.has(key):
+            return False
+        self.set(key, value, timeout)
+        return True
+
+    def delete(self, key: str) -> bool:
+        cursor = self._conn().execute("DELETE FROM cache WHERE key = :key", {"key": key})
+        return cursor.rowcount > 0
+
+    def has(self, key: str) -> bool:
+        row = (
+            self._conn()
+            .execute(
+                "SELECT expires FROM cache WHERE key = :key",
+                {"key": key},
+            )
+            .fetchone()
+        )
+        return row is not None and (row[0] == 0 or row[0] > time.time())
+
+    def clear(self) -> bool:
+        self._conn().execute("DELETE FROM cache")
+        return True
+
 
-__all__ = ["cache"]
+def init(app: flask.Flask) -> None:
+    """
+    Configure the cache for the given application.
+    """
+    app.config.setdefault("CACHE_TYPE", "SimpleCache")
 
-cache = flask_caching.Cache(config={"CACHE_TYPE": "SimpleCache"})
+    cache.init_app(app)
@@ -0,0 +1,701 @@
+"""
+Maintain a local catalog of Harbor's public projects, repositories, and artifacts.
+
+The public pages of the web application are served from this catalog, so
+that browsing does not require any requests to Harbor. The catalog is
+populated by a full sync (`flask soteria sync-catalog`) and is kept current
+by the PUSH_ARTIFACT and DELETE_ARTIFACT webhooks that Harbor sends. Since
+no webhook reports a project being made private or deleted, the polling
+loop also repeats the full sync every `CATALOG_SYNC_INTERVAL` seconds.
+
+Each item is stored with the JSON object that Harbor's API returns for it,
+so that the catalog's endpoints can return the same objects as Harbor.
+
+Repositories with tagged artifacts are also indexed for full-text search by
+their project, name, tags, and descriptions. The index is updated along
+with the catalog, so searches reflect webhooks as soon as they are ingested.
+"""
+
+import datetime
+import json
+import re
+import sqlite3
+import time
+import urllib.parse
+from collections.abc import Iterable
+from typing import Any, Optional
+
+import flask
+
+import registry.clients
+import registry.database
+import registry.util
+
+__all__ = [
+    "apply_webhooks",
+    "init",
+    "list_artifacts",
+    "list_projects",
+    "list_repositories",
+    "search",
+    "sync",
+    "sync_if_due",
+]
+
+# Default for the `CATALOG_SYNC_INTERVAL` configuration key.
+DEFAULT_SYNC_INTERVAL = 3600
+
+# Key in the database's metadata table for the time of the last full sync.
+SYNCED_ON_KEY = "catalog_synced_on"
+
+# Columns by which each collection can be sorted, keyed by the name of the
+# corresponding attribute in Harbor's API.
+PROJECT_SORTS = {"name": "name", "creation_time": "creation_time", "update_time": "update_time"}
+REPOSITORY_SORTS = PROJECT_SORTS
+ARTIFACT_SORTS = {"push_time": "push_time", "update_time": "push_time", "size": "size"}
+
+# Relative weights of the search index's columns (project, repository, tags,
+# and description) when ranking search results.
+SEARCH_WEIGHTS = (4.0, 8.0, 2.0, 1.0)
+
+# The largest number of tags to return for each search result.
+SEARCH_MAX_TAGS = 10
+
+# Computes the search index's columns for the repositories in `r`.
+SEARCH_INDEX_QUERY = """
+INSERT INTO catalog_search ( rowid, project, repository, tags, description )
+SELECT
+  r.rowid
+, r.project
+, substr(r.name, length(r.project) + 2)
+, (SELECT group_concat(t.tag, ' ') FROM catalog_tags AS t WHERE t.repository = r.name)
+, trim(
+    COALESCE(json_extract(r.data, '$.description'), '')
+    || ' '
+    || COALESCE(
+      (
+        SELECT group_concat(DISTINCT json_extract(
+          a.data, '$.annotations."org.opencontainers.image.description"'
+        ))
+        FROM catalog_artifacts AS a
+        WHERE a.repository = r.name
+      )
+    , ''
+    )
+  )
+FROM catalog_repositories AS r
+WHERE EXISTS ( SELECT 1 FROM catalog_tags AS t WHERE t.repository = r.name )
+"""
+
+
+def init(app: flask.Flask) -> None:
+    """
+    Ensure that the catalog's tables exist.
+    """
+    with registry.database.get_db_conn(app) as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS catalog_projects
+            (
+              name TEXT PRIMARY KEY
+            , creation_time TEXT
+            , update_time TEXT
+            , data TEXT
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS catalog_repositories
+            (
+              name TEXT PRIMARY KEY
+            , project TEXT
+            , creation_time TEXT
+            , update_time TEXT
+            , data TEXT
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS catalog_repositories_project_index
+            ON catalog_repositories (project, name)
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS catalog_artifacts
+            (
+              repository TEXT
+            , digest TEXT
+            , push_time TEXT
+            , size INT
+            , data TEXT
+            , PRIMARY KEY ( repository, digest )
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS catalog_tags
+            (
+              repository TEXT
+            , tag TEXT
+            , digest TEXT
+            , push_time TEXT
+            , PRIMARY KEY ( repository, tag )
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS catalog_tags_digest_index
+            ON catalog_tags (repository, digest)
+            """
+        )
+        conn.execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS catalog_search
+            USING fts5 ( project, repository, tags, description, prefix = '1 2 3' )
+            """
+        )
+        conn.commit()
+
+        (indexed,) = conn.execute("SELECT COUNT(*) FROM catalog_search").fetchone()
+        if not indexed:
+            rebuild_search_index(conn)
+            conn.commit()
+
+
+# --------------------------------------------------------------------------
+
+
+def is_public_project(project: dict[str, Any]) -> bool:
+    """
+    Determine whether a project, as returned by Harbor's API, is public.
+    """
+    return str(project.get("metadata", {}).get("public", "")).lower() == "true"
+
+
+def sync() -> tuple[int, int, int]:
+    """
+    Replace the catalog with the current contents of Harbor's public projects.
+
+    Returns the number of projects, repositories, and artifacts.
+    """
+    api = registry.clients.get_admin_harbor_api()
+
+    projects = [p for p in api.get_all_projects() if is_public_project(p)]
+    repositories = [
+        r
+        for rs in registry.util.map_concurrently(
+            lambda p: list(api.get_all_repositories(p["name"])), projects
+        )
+        for r in rs
+    ]
+    artifacts = registry.util.map_concurrently(
+        lambda r: list(
+            api.get_all_artifacts(
+                *r["name"].split("/", 1), params={"with_tag": "true", "with_label": "false"}
+            )
+        ),
+        repositories,
+    )
+
+    with registry.database.get_db_conn() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for table in [
+            "catalog_projects",
+            "catalog_repositories",
+            "catalog_artifacts",
+            "catalog_tags",
+        ]:
+            conn.execute(f"DELETE FROM {table}")  # nosec B608
+
+        conn.executemany(
+            """
+            INSERT INTO catalog_projects ( name, creation_time, update_time, data )
+            VALUES ( :name, :creation_time, :update_time, :data )
+            """,
+            [
+                {
+                    "name": p["name"],
+                    "creation_time": p.get("creation_time"),
+                    "update_time": p.get("update_time"),
+                    "data": json.dumps(p),
+                }
+                for p in projects
+            ],
+        )
+        conn.executemany(
+            """
+            INSERT INTO catalog_repositories ( name, project, creation_time, update_time, data )
+            VALUES ( :name, :project, :creation_time, :update_time, :data )
+            """,
+            [
+                {
+                    "name": r["name"],
+                    "project": r["name"].split("/", 1)[0],
+                    "creation_time": r.get("creation_time"),
+                    "update_time": r.get("update_time"),
+                    "data": json.dumps(r),
+                }
+                for r in repositories
+            ],
+        )
+        for repository, items in zip(repositories, artifacts):
+            for artifact in items:
+                put_artifact(conn, repository["name"], artifact)
+        rebuild_search_index(conn)
+        conn.commit()
+
+    registry.database.set_metadata(SYNCED_ON_KEY, str(int(time.time())))
+
+    return len(projects), len(repositories), sum(len(items) for items in artifacts)
+
+
+def sync_if_due() -> bool:
+    """
+    Sync the catalog if `CATALOG_SYNC_INTERVAL` seconds have passed since the
+    last sync by any process. Returns whether it was synced.
+    """
+    config = flask.current_app.config
+    interval = float(config.get("CATALOG_SYNC_INTERVAL", DEFAULT_SYNC_INTERVAL))
+    synced_on = float(registry.database.get_metadata(SYNCED_ON_KEY) or 0)
+
+    if interval <= 0 or time.time() - synced_on < interval:
+        return False
+
+    projects, repositories, artifacts = sync()
+    flask.current_app.logger.info(
+        "Synced the catalog: %s projects, %s repositories, %s artifacts",
+        projects,
+        repositories,
+        artifacts,
+    )
+    return True
+
+
+def put_artifact(conn: sqlite3.Connection, repository: str, artifact: dict[str, Any]) -> None:
+    """
+    Add or update an artifact, and point its tags at it.
+
+    The attributes of an existing artifact are merged with the given ones.
+    """
+    tags = artifact.pop("tags", None) or []
+    artifact = {k: v for k, v in artifact.items() if v is not None}
+
+    conn.execute(
+        """
+        INSERT INTO catalog_artifacts ( repository, digest, push_time, size, data )
+        VALUES ( :repository, :digest, :push_time, :size, :data )
+        ON CONFLICT ( repository, digest ) DO UPDATE SET
+          push_time = excluded.push_time
+        , size = COALESCE(excluded.size, size)
+        , data = json_patch(data, excluded.data)
+        """,
+        {
+            "repository": repository,
+            "digest": artifact["digest"],
+            "push_time": artifact.get("push_time"),
+            "size": artifact.get("size"),
+            "data": json.dumps(artifact),
+        },
+    )
+    conn.executemany(
+        """
+        INSERT INTO catalog_tags ( repository, tag, digest, push_time )
+        VALUES ( :repository, :tag, :digest, :push_time )
+        ON CONFLICT ( repository, tag ) DO UPDATE SET
+          digest = excluded.digest
+        , push_time = excluded.push_time
+        """,
+        [
+            {
+                "repository": repository,
+                "tag": tag["name"],
+                "digest": artifact["digest"],
+                "push_time": tag.get("push_time"),
+            }
+            for tag in tags
+        ],
+    )
+
+
+def index_repository(conn: sqlite3.Connection, repository: str) -> None:
+    """
+    Update a repository's entry in the search index.
+
+    Repositories without any tags are removed from the index.
+    """
+    conn.execute(
+        """
+        DELETE FROM catalog_search
+        WHERE rowid IN ( SELECT rowid FROM catalog_repositories WHERE name = ? )
+        """,
+        (repository,),
+    )
+    conn.execute(f"{SEARCH_INDEX_QUERY} AND r.name = ?", (repository,))  # nosec B608
+
+
+def rebuild_search_index(conn: sqlite3.Connection) -> None:
+    """
+    Replace the search index's entries with ones for every tagged repository.
+    """
+    conn.execute("DELETE FROM catalog_search")
+    conn.execute(SEARCH_INDEX_QUERY)
+
+
+# --------------------------------------------------------------------------
+
+
+def format_time(timestamp: Optional[int]) -> str:
+    """
+    Format a Unix timestamp the way that Harbor's API formats times.
+    """
+    if timestamp is None:
+        when = datetime.datetime.now(datetime.timezone.utc)
+    else:
+        when = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+    return when.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def apply_webhooks(
+    payloads: Iterable[dict[Any, Any]], app: Optional[flask.Flask] = None
+) -> None:
+    """
+    Update the catalog with the artifacts pushed or deleted in public repositories.
+    """
+    with registry.database.get_db_conn(app) as conn:
+        for payload in payloads:
+            event_data = payload.get("event_data", {})
+            repo = event_data.get("repository", {})
+
+            if repo.get("repo_type") != "public":
+                continue
+
+            project = repo["namespace"]
+            repository = repo.get("repo_full_name") or f"{project}/{repo['name']}"
+            now = format_time(payload.get("occur_at"))
+
+            if payload.get("type") == "PUSH_ARTIFACT":
+                for resource in event_data.get("resources", []):
+                    tag = resource.get("tag")
+                    artifact = {
+                        "digest": resource["digest"],
+                        "push_time": now,
+                        "size": resource.get("size"),
+                        "tags": [{"name": tag, "push_time": now}] if tag else None,
+                    }
+                    put_artifact(conn, repository, artifact)
+
+            elif payload.get("type") == "DELETE_ARTIFACT":
+                for resource in event_data.get("resources", []):
+                    params = {"repository": repository, "digest": resource["digest"]}
+                    conn.execute(
+                        """
+                        DELETE FROM catalog_artifacts
+                        WHERE repository = :repository AND digest = :digest
+                        """,
+                        params,
+                    )
+                    conn.execute(
+                        """
+                        DELETE FROM catalog_tags
+                        WHERE repository = :repository AND digest = :digest
+                        """,
+                        params,
+                    )
+
+            else:
+                continue
+
+            update_counts(conn, project, repository, now)
+
+        conn.commit()
+
+
+def update_counts(conn: sqlite3.Connection, project: str, repository: str, now: str) -> None:
+    """
+    Update a repository's and its project's counts and times after a change.
+
+    Repositories without artifacts are removed, as Harbor does.
+    """
+    (count,) = conn.execute(
+        "SELECT COUNT(*) FROM catalog_artifacts WHERE repository = ?", (repository,)
+    ).fetchone()
+
+    if count:
+        default = json.dumps({"name": repository, "creation_time": now})
+        conn.execute(
+            """
+            INSERT INTO catalog_repositories ( name, project, creation_time, update_time, data )
+            VALUES ( :name, :project, :now, :now, :default )
+            ON CONFLICT ( name ) DO NOTHING
+            """,
+            {"name": repository, "project": project, "now": now, "default": default},
+        )
+        conn.execute(
+            """
+            UPDATE catalog_repositories
+            SET update_time = :now
+              , data = json_set(data, '$.artifact_count', :count, '$.update_time', :now)
+            WHERE name = :name
+            """,
+            {"name": repository, "now": now, "count": count},
+        )
+        index_repository(conn, repository)
+    else:
+        index_repository(conn, repository)
+        conn.execute("DELETE FROM catalog_repositories WHERE name = ?", (repository,))
+
+    default = json.dumps({"name": project, "creation_time": now})
+    conn.execute(
+        """
+        INSERT INTO catalog_projects ( name, creation_time, update_time, data )
+        VALUES ( :name, :now, :now, :default )
+        ON CONFLICT ( name ) DO NOTHING
+        """,
+        {"name": project, "now": now, "default": default},
+    )
+    conn.execute(
+        """
+        UPDATE catalog_projects
+        SET update_time = :now
+          , data = json_set(
+              data
+            , '$.repo_count'
+            , (SELECT COUNT(*) FROM catalog_repositories WHERE project = :name)
+            , '$.update_time'
+            , :now
+            )
+        WHERE name = :name
+        """,
+        {"name": project, "now": now},
+    )
+
+
+# --------------------------------------------------------------------------
+
+
+def get_order_by(sort: Optional[str], columns: dict[str, str], default: str) -> str:
+    """
+    Translate a Harbor-style sort parameter (e.g., "-update_time") to SQL.
+    """
+    if sort and sort.lstrip("-") in columns:
+        direction = "DESC" if sort.startswith("-") else "ASC"
+        return f"{columns[sort.lstrip('-')]} {direction}, {default}"
+    return default
+
+
+def get_name_filter(q: Optional[str]) -> str:
+    """
+    Return the substring to match names against, given a Harbor-style query
+    (e.g., "name=~foo", which the public pages send percent-encoded).
+    """
+    q = urllib.parse.unquote(q or "")
+    if q.startswith("name=~"):
+        return q.removeprefix("name=~")
+    return ""
+
+
+def list_items(
+    table: str,
+    where: str,
+    params: dict[str, Any],
+    order_by: str,
+    page: int,
+    page_size: int,
+) -> tuple[list[dict[str, Any]], int]:
+    """
+    Return one page of a catalog table's items, and the total number of items.
+    """
+    params = {**params, "limit": page_size, "offset": (max(page, 1) - 1) * page_size}
+
+    with registry.database.get_db_conn() as conn:
+        (total,) = conn.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE {where}", params  # nosec B608
+        ).fetchone()
+        rows = conn.execute(
+            f"""
+            SELECT data FROM {table}
+            WHERE {where}
+            ORDER BY {order_by}
+            LIMIT :limit OFFSET :offset
+            """,  # nosec B608
+            params,
+        ).fetchall()
+
+    return [json.loads(data) for (data,) in rows], total
+
+
+def list_projects(
+    *, q: Optional[str] = None, sort: Optional[str] = None, page: int = 1, page_size: int = 10
+) -> tuple[list[dict[str, Any]], int]:
+    """
+    Return one page of public projects, and the total number of them.
+    """
+    return list_items(
+        "catalog_projects",
+        "instr(name, :name) > 0",
+        {"name": get_name_filter(q)},
+        get_order_by(sort, PROJECT_SORTS, "name ASC"),
+        page,
+        page_size,
+    )
+
+
+def list_repositories(
+    project: str,
+    *,
+    q: Optional[str] = None,
+    sort: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 10,
+) -> tuple[list[dict[str, Any]], int]:
+    """
+    Return one page of a public project's repositories, and the total number of them.
+    """
+    return list_items(
+        "catalog_repositories",
+        "project = :project AND instr(name, :name) > 0",
+        {"project": project, "name": get_name_filter(q)},
+        get_order_by(sort, REPOSITORY_SORTS, "name ASC"),
+        page,
+        page_size,
+    )
+
+
+def list_artifacts(
+    project: str,
+    repository: str,
+    *,
+    sort: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 10,
+) -> tuple[list[dict[str, Any]], int]:
+    """
+    Return one page of a public repository's artifacts, and the total number of them.
+    """
+    repository = f"{project}/{repository}"
+
+    artifacts, total = list_items(
+        "catalog_artifacts",
+        "repository = :repository",
+        {"repository": repository},
+        get_order_by(sort, ARTIFACT_SORTS, "push_time DESC, digest ASC"),
+        page,
+        page_size,
+    )
+
+    with registry.database.get_db_conn() as conn:
+        for artifact in artifacts:
+            rows = conn.execute(
+                """
+                SELECT tag, push_time FROM catalog_tags
+                WHERE repository = :repository AND digest = :digest
+                ORDER BY push_time DESC, tag ASC
+                """,
+                {"repository": repository, "digest": artifact["digest"]},
+            ).fetchall()
+            artifact["tags"] = [{"name": t, "push_time": p} for t, p in rows] or None
+
+    return artifacts, total
+
+
+# --------------------------------------------------------------------------
+
+
+def get_words(text: Optional[str]) -> list[str]:
+    """
+    Split text into lowercase words, as the search index's tokenizer does.
+    """
+    return re.findall(r"\w+", (text or "").lower())
+
+
+def get_matching_tags(
+    conn: sqlite3.Connection, repository: str, words: list[str], other_text: str
+) -> list[dict[str, Any]]:
+    """
+    Return a repository's most recently pushed tags that match some search words.
+
+    Words that match `other_text` (the repository's name and descriptions)
+    are ignored. If all of the words match it, any tag matches.
+    """
+    other_words = get_words(other_text)
+    tag_words = [w for w in words if not any(o.startswith(w) for o in other_words)]
+    tags = []
+
+    for tag, push_time in conn.execute(
+        """
+        SELECT tag, push_time FROM catalog_tags
+        WHERE repository = ?
+        ORDER BY push_time DESC, tag ASC
+        """,
+        (repository,),
+    ):
+        tag_words_of_tag = get_words(tag)
+        if all(any(t.startswith(w) for t in tag_words_of_tag) for w in tag_words):
+            tags.append({"name": tag, "push_time": push_time})
+            if len(tags) >= SEARCH_MAX_TAGS:
+                break
+
+    return tags
+
+
+def search(
+    text: str, *, page: int = 1, page_size: int = 10
+) -> tuple[list[dict[str, Any]], int]:
+    """
+    Return one page of the public repositories that best match some search
+    text, and the total number of matches.
+
+    Every word of the text must match the start of a word in a repository's
+    project, name, tags, or descriptions. Each repository has the same
+    attributes as in `list_repositories`, plus its "project", its
+    "repository" name within the project, its "description", and up to
+    `SEARCH_MAX_TAGS` of its matching "tags".
+    """
+    words = get_words(text)
+
+    if not words:
+        return [], 0
+
+    params = {
+        "match": " ".join(f'"{word}"*' for word in words),
+        "limit": page_size,
+        "offset": (max(page, 1) - 1) * page_size,
+    }
+    weights = ", ".join(str(w) for w in SEARCH_WEIGHTS)
+
+    with registry.database.get_db_conn() as conn:
+        (total,) = conn.execute(
+            "SELECT COUNT(*) FROM catalog_search WHERE catalog_search MATCH :match", params
+        ).fetchone()
+        rows = conn.execute(
+            f"""
+            SELECT rowid, project, repository, description FROM catalog_search
+            WHERE catalog_search MATCH :match
+            ORDER BY bm25(catalog_search, {weights})
+            LIMIT :limit OFFSET :offset
+            """,  # nosec B608
+            params,
+        ).fetchall()
+
+        results = []
+        for rowid, project, repository, description in rows:
+            name, data = conn.execute(
+                "SELECT name, data FROM catalog_repositories WHERE rowid = ?", (rowid,)
+            ).fetchone()
+            item = json.loads(data)
+            item.update(
+                project=project,
+                repository=repository,
+                description=description,
+                tags=get_matching_tags(
+                    conn, name, words, f"{project} {repository} {description}"
+                ),
+            )
+            results.append(item)
+
+    return results, total
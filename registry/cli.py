@@ -2,46 +2,94 @@
 SOTERIA's command-line interface.
 """
 
+import concurrent.futures
+import os
+import socket
 import time
+import uuid
+from collections.abc import Iterable
+from typing import Any, Optional
 
 import click
 import flask
 
+import registry.catalog
+import registry.clients
 import registry.database
 import registry.processing
 import registry.util
+import registry.wakeup
 
 __all__ = ["bp"]
 
 # Number of seconds to wait between iterations of the polling loop.
 LOOP_DELAY = 300
 
+# Minimum number of seconds to wait between iterations of the polling loop.
+MIN_LOOP_DELAY = 5
+
+# Number of seconds to wait between checks of the job event log, if any.
+EVENT_DELAY = 5
+
+# Number of threads with which the polling loop processes payloads.
+WORKERS = 1
+
+# Number of seconds for which the polling loop's claim on a payload lasts.
+LEASE = 900
+
+# Number of attempts to process a payload before it is marked as failed,
+# and the initial and maximum number of seconds to wait between attempts.
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 3600
+
 bp = flask.Blueprint("command_line_interface", __name__)
 
 
 # --------------------------------------------------------------------------
 
 
+def echo_json_array(items: Iterable[Any]) -> None:
+    """
+    Write items to standard output as a JSON array, as they are produced.
+    """
+    for chunk in registry.util.iter_json_array(items):
+        click.echo(chunk, nl=False)
+    click.echo()
+
+
 @bp.cli.command("list-all-projects")
-def list_all_projects() -> None:
-    api = registry.util.get_admin_harbor_api()
+@click.option("--json", "as_json", is_flag=True, help="Print the projects as a JSON array.")
+def list_all_projects(as_json: bool) -> None:
+    api = registry.clients.get_admin_harbor_api()
+
+    if as_json:
+        echo_json_array(api.get_all_projects())
+        return
 
     for p in api.get_all_projects():
         print(f'{p["project_id"]} {p["name"]}')
 
 
 @bp.cli.command("list-all-webhooks")
-def list_all_webhooks() -> None:
-    api = registry.util.get_admin_harbor_api()
+@click.option("--json", "as_json", is_flag=True, help="Print the webhooks as a JSON array.")
+def list_all_webhooks(as_json: bool) -> None:
+    api = registry.clients.get_admin_harbor_api()
+    webhooks = (
+        w for p in api.get_all_projects() for w in api.get_all_webhooks(p["project_id"])
+    )
 
-    for p in api.get_all_projects():
-        for w in api.get_all_webhooks(p["project_id"]):
-            print(w)
+    if as_json:
+        echo_json_array(webhooks)
+        return
+
+    for w in webhooks:
+        print(w)
 
 
 @bp.cli.command("delete-all-webhooks")
 def delete_all_webhooks() -> None:
-    api = registry.util.get_admin_harbor_api()
+    api = registry.clients.get_admin_harbor_api()
 
     for p in api.get_all_projects():
         api.delete_all_webhooks(p["project_id"])
@@ -50,23 +98,75 @@ def delete_all_webhooks() -> None:
 @bp.cli.command("set-project-webhooks")
 @click.argument("project_id")
 def set_project_webhooks(project_id) -> None:
-    api = registry.util.get_admin_harbor_api()
+    api = registry.clients.get_admin_harbor_api()
     harbor = registry.util.Harbor(harbor_api=api)
     harbor.set_webhooks(project_id)
 
 
 @bp.cli.command("set-all-project-webhooks")
 def set_all_project_webhooks() -> None:
-    api = registry.util.get_admin_harbor_api()
+    api = registry.clients.get_admin_harbor_api()
     harbor = registry.util.Harbor(harbor_api=api)
 
     for p in api.get_all_projects():
         harbor.set_webhooks(p["project_id"])
 
 
+@bp.cli.command("refresh-harbor-user-index")
+@click.option("--full", is_flag=True, help="Re-index every user, not only new ones.")
+def refresh_harbor_user_index(full: bool) -> None:
+    """
+    Update the local index of Harbor users by their OIDC "subiss".
+    """
+    count = registry.util.refresh_harbor_user_index(full=full)
+    print(f"Indexed {count} Harbor users")
+
+
+@bp.cli.command("sync-catalog")
+def sync_catalog() -> None:
+    """
+    Replace the local catalog of public projects with Harbor's current contents.
+    """
+    projects, repositories, artifacts = registry.catalog.sync()
+    print(f"Synced {projects} projects, {repositories} repositories, {artifacts} artifacts")
+
+
 # --------------------------------------------------------------------------
 
 
+@bp.cli.command("show-queue")
+def show_queue() -> None:
+    """
+    Show the number of queued and running payloads for each project, and
+    the counters shared by the polling loop.
+    """
+    weights = registry.database.get_project_weights()
+
+    print(f'{"PROJECT":<40} {"QUEUED":>8} {"RUNNING":>8} {"WEIGHT":>8}')
+    for project, queued, running in registry.database.get_queue_depths():
+        print(f"{project:<40} {queued:>8} {running:>8} {weights.get(project, 1.0):>8g}")
+
+    if counters := registry.database.get_counters():
+        print()
+        for name, value in counters.items():
+            print(f"{name:<40} {value:>8}")
+
+
+@bp.cli.command("set-project-weight")
+@click.argument("project")
+@click.argument("weight", type=float, required=False)
+def set_project_weight(project: str, weight: float) -> None:
+    """
+    Set a project's scheduling weight, or reset it if no weight is given.
+
+    Relative to a project with the default weight (1), a project with weight
+    2 has twice as many of its payloads processed when both have a backlog.
+    """
+    if weight is not None and weight <= 0:
+        raise click.BadParameter("must be positive", param_hint="WEIGHT")
+    registry.database.set_project_weight(project, weight)
+
+
 @bp.cli.command("reinitialize-database")
 def reinitialize_database() -> None:
     """
@@ -77,26 +177,195 @@ def reinitialize_database() -> None:
     testing.
     """
     registry.database.init(flask.current_app)
+    registry.catalog.init(flask.current_app)
 
 
 @bp.cli.command("run-polling-loop")
 def run_polling_loop() -> None:
     """
-    Periodically poll the web application's database.
+    Poll the web application's database whenever there might be new work.
+
+    The loop is woken up as soon as a new webhook payload is stored. When
+    an iteration finds nothing to do, the delay before the next one doubles,
+    up to a fixed maximum that serves as a safety net. If a job event log is
+    configured, it is checked for finished jobs every few seconds. Between
+    iterations, the catalog of public projects is re-synced with Harbor
+    every `CATALOG_SYNC_INTERVAL` seconds.
+
+    Payloads are claimed before they are processed, so several instances of
+    the loop can run at the same time. Within one instance, claimed payloads
+    are processed by a pool of `POLLING_LOOP_WORKERS` threads.
     """
     app = flask.current_app
     loop_delay = LOOP_DELAY if not app.config.get("SOTERIA_DEBUG") else 15
+    min_delay = min(loop_delay, float(app.config.get("POLLING_LOOP_MIN_DELAY", MIN_LOOP_DELAY)))
+    workers = max(1, int(app.config.get("POLLING_LOOP_WORKERS", WORKERS)))
+    tracker = registry.processing.get_job_event_tracker()
+    event_delay = float(app.config.get("HTCONDOR_EVENT_LOG_POLL_INTERVAL", EVENT_DELAY))
+    listener = registry.wakeup.Listener(registry.wakeup.get_socket_path(app))
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    delay = min_delay
+
+    app.logger.info("Starting polling loop %s with %s workers", worker_id, workers)
 
     try:
-        while True:
-            app.logger.debug("Starting iteration of polling loop")
-            for payload in registry.database.get_new_payloads():
-                if new_state := registry.processing.process(payload):
-                    registry.database.update_payload(payload.id_, new_state)
-                    if new_state in registry.database.FINAL_STATES:
-                        registry.processing.finalize(payload)
-
-            app.logger.debug("Finished iteration of polling loop")
-            time.sleep(loop_delay)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                try:
+                    busy = run_iteration(worker_id, executor)
+                except Exception:  # pylint: disable=broad-except
+                    app.logger.exception("Failed to complete iteration of polling loop")
+                    busy = False
+
+                if busy:
+                    delay = min_delay
+                else:
+                    delay = min(delay * 2, loop_delay)
+
+                try:
+                    registry.catalog.sync_if_due()
+                except Exception:  # pylint: disable=broad-except
+                    app.logger.exception("Failed to sync the catalog")
+
+                app.logger.debug("Waiting up to %s seconds for new work", delay)
+
+                wait_for_work(listener, tracker, delay, event_delay)
     except Exception:  # pylint: disable=broad-except
         app.logger.exception("Uncaught exception")
+    finally:
+        listener.close()
+
+
+def wait_for_work(
+    listener: registry.wakeup.Listener,
+    tracker: Optional[registry.processing.JobEventTracker],
+    delay: float,
+    event_delay: float,
+) -> None:
+    """
+    Wait up to `delay` seconds, or until woken up, handling job events meanwhile.
+    """
+    app = flask.current_app
+    next_iteration = time.monotonic() + delay
+
+    while (remaining := next_iteration - time.monotonic()) > 0:
+        woken = listener.wait(min(event_delay, remaining) if tracker else remaining)
+
+        if tracker:
+            try:
+                for payload, new_state in tracker.read():
+                    update_payload(payload, new_state)
+                tracker.commit()
+            except Exception:  # pylint: disable=broad-except
+                app.logger.exception("Failed to read the job event log")
+
+        if woken:
+            app.logger.debug("Woken up by a notification")
+            break
+
+
+def run_iteration(worker_id: str, executor: concurrent.futures.Executor) -> bool:
+    """
+    Perform one iteration of the polling loop.
+
+    Returns whether any payload changed state or had a job submitted for it.
+    """
+    app = flask.current_app._get_current_object()  # type: ignore[attr-defined]
+    lease = int(app.config.get("POLLING_LOOP_LEASE", LEASE))
+    changed = 0
+
+    app.logger.debug("Starting iteration of polling loop")
+
+    iteration = registry.processing.start_iteration()
+    small_image_size, small_image_boost = registry.processing.get_small_image_policy()
+    max_jobs, max_jobs_per_project = registry.processing.get_job_limits()
+
+    def call(payload: registry.database.WebhookPayload) -> bool:
+        with app.app_context():
+            return process_payload(payload, iteration)
+
+    try:
+        while payloads := registry.database.claim_new_payloads(
+            worker_id,
+            lease,
+            small_image_size=small_image_size,
+            small_image_boost=small_image_boost,
+            max_jobs=max_jobs,
+            max_jobs_per_project=max_jobs_per_project,
+        ):
+            changed += sum(executor.map(call, payloads))
+
+        try:
+            registry.processing.finish_iteration(iteration)
+        except Exception:  # pylint: disable=broad-except
+            app.logger.exception("Failed to submit %s payloads", len(iteration.pending))
+            for payload in iteration.pending:
+                retry_payload(payload)
+            changed += len(iteration.pending)
+            iteration.pending.clear()
+    finally:
+        registry.database.release_payloads(worker_id)
+
+    app.logger.debug("Finished iteration of polling loop")
+
+    return bool(changed or iteration.submitted)
+
+
+def process_payload(
+    payload: registry.database.WebhookPayload,
+    iteration: registry.processing.Iteration,
+) -> bool:
+    """
+    Process one payload, scheduling a retry if that fails.
+
+    Returns whether the payload's state changed.
+    """
+    try:
+        if new_state := registry.processing.process(payload, iteration):
+            update_payload(payload, new_state)
+            return True
+    except Exception:  # pylint: disable=broad-except
+        flask.current_app.logger.exception("Failed to process payload %s", payload.id_)
+        retry_payload(payload)
+        return True
+
+    return False
+
+
+def retry_payload(payload: registry.database.WebhookPayload) -> None:
+    """
+    Schedule another attempt to process a payload, or fail it if it has run
+    out of attempts.
+
+    The delay before each retry doubles, starting from `POLLING_LOOP_RETRY_DELAY`
+    seconds and up to `POLLING_LOOP_MAX_RETRY_DELAY` seconds.
+    """
+    app = flask.current_app
+    max_attempts = int(app.config.get("POLLING_LOOP_MAX_ATTEMPTS", MAX_ATTEMPTS))
+    retry_delay = int(app.config.get("POLLING_LOOP_RETRY_DELAY", RETRY_DELAY))
+    max_retry_delay = int(app.config.get("POLLING_LOOP_MAX_RETRY_DELAY", MAX_RETRY_DELAY))
+    attempts = payload.attempts + 1
+
+    if attempts >= max_attempts:
+        app.logger.error("Giving up on payload %s after %s attempts", payload.id_, attempts)
+        registry.database.set_payload_retry(payload.id_, attempts, 0)
+        update_payload(payload, registry.database.State.failed)
+        return
+
+    delay = min(retry_delay * 2 ** (attempts - 1), max_retry_delay)
+    app.logger.warning("Retrying payload %s in %s seconds", payload.id_, delay)
+    registry.database.set_payload_retry(payload.id_, attempts, int(time.time()) + delay)
+
+
+def update_payload(
+    payload: registry.database.WebhookPayload, new_state: registry.database.State
+) -> None:
+    """
+    Record a payload's new state, and finalize it (and any payloads coalesced
+    into it) if the state is final.
+    """
+    registry.database.update_payload(payload.id_, new_state)
+    if new_state in registry.database.FINAL_STATES:
+        registry.processing.finalize(payload, new_state)
+        for alias in registry.database.get_payload_aliases(payload.id_):
+            registry.processing.finalize(alias, new_state)
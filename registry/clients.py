@@ -0,0 +1,132 @@
+"""
+Long-lived clients for the APIs that the web application and its command-line
+interface use.
+
+Clients are stored on the current application, so that every request (or
+every iteration of the polling loop) reuses their pooled connections.
+"""
+
+import threading
+from collections.abc import Callable
+from typing import Any, TypeVar
+
+import flask
+
+import registry.api_client
+import registry.comanage
+import registry.freshdesk
+import registry.harbor
+
+__all__ = [
+    "get_admin_comanage_api",
+    "get_admin_harbor_api",
+    "get_api_client",
+    "get_freshdesk_api",
+    "get_harbor_api",
+]
+
+T = TypeVar("T")
+
+_api_clients_lock = threading.Lock()
+
+
+def get_api_client(name: str, factory: Callable[[], T]) -> T:
+    """
+    Returns the current application's long-lived API client with the given name.
+
+    Clients are created on first use and then reused by every request that
+    the process handles, so that their pooled connections are kept warm.
+    """
+    app = flask.current_app._get_current_object()  # type: ignore[attr-defined]
+    clients = app.extensions.setdefault("soteria_api_clients", {})
+
+    with _api_clients_lock:
+        if name not in clients:
+            clients[name] = factory()
+        client: T = clients[name]
+
+    return client
+
+
+def get_api_client_options() -> dict[str, Any]:
+    """
+    Returns the configured HTTP connection pool options for API clients.
+    """
+    config = flask.current_app.config
+
+    return {
+        "pool_maxsize": int(
+            config.get("HTTP_POOL_MAXSIZE", registry.api_client.DEFAULT_POOL_MAXSIZE)
+        ),
+        "max_retries": int(
+            config.get("HTTP_MAX_RETRIES", registry.api_client.DEFAULT_MAX_RETRIES)
+        ),
+    }
+
+
+def get_admin_harbor_api() -> registry.harbor.HarborAPI:
+    """
+    Returns a Harbor API instance authenticated as an admin.
+    """
+    return get_api_client(
+        "harbor_admin",
+        lambda: registry.harbor.HarborAPI(
+            flask.current_app.config["HARBOR_API_URL"],
+            basic_auth=(
+                flask.current_app.config["HARBOR_ADMIN_USERNAME"],
+                flask.current_app.config["HARBOR_ADMIN_PASSWORD"],
+            ),
+            **get_harbor_api_options(),
+        ),
+    )
+
+
+def get_harbor_api() -> registry.harbor.HarborAPI:
+    """Returns a Harbor API instance not authed"""
+    return get_api_client(
+        "harbor",
+        lambda: registry.harbor.HarborAPI(
+            flask.current_app.config["HARBOR_API_URL"],
+            **get_harbor_api_options(),
+        ),
+    )
+
+
+def get_harbor_api_options() -> dict[str, Any]:
+    """
+    Returns the configured options for Harbor API instances.
+    """
+    config = flask.current_app.config
+
+    return {
+        "page_size": int(config.get("HARBOR_API_PAGE_SIZE", registry.harbor.DEFAULT_PAGE_SIZE)),
+        "max_workers": int(
+            config.get("HARBOR_API_MAX_WORKERS", registry.harbor.DEFAULT_MAX_WORKERS)
+        ),
+        **get_api_client_options(),
+    }
+
+
+def get_admin_comanage_api():
+    """
+    Returns a Comanage API instance authenticated as an admin.
+    """
+    return get_api_client(
+        "comanage_admin",
+        lambda: registry.comanage.COmanageAPI(
+            flask.current_app.config["REGISTRY_API_URL"],
+            flask.current_app.config["REGISTRY_CO_ID"],
+            basic_auth=(
+                flask.current_app.config["REGISTRY_API_USERNAME"],
+                flask.current_app.config["REGISTRY_API_PASSWORD"],
+            ),
+            **get_api_client_options(),
+        ),
+    )
+
+
+def get_freshdesk_api() -> registry.freshdesk.FreshDeskAPI:
+    """
+    Returns a Freshdesk API instance.
+    """
+    return registry.freshdesk.FreshDeskAPI(flask.current_app.config["FRESHDESK_API_KEY"])
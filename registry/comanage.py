@@ -22,14 +22,16 @@ class COmanageAPI(registry.api_client.GenericAPI):
         api_base_url: str,
         co_id: int,
         basic_auth: Optional[Tuple[str, str]] = None,
+        **kwargs,
     ):
         """
         Constructs a wrapper that uses the provided credentials, if any.
 
         If a username and password are provided via `basic_auth`, API calls
-        will be made using Basic authentication.
+        will be made using Basic authentication. Other keyword arguments are
+        passed through to `GenericAPI`.
         """
-        super().__init__(api_base_url, basic_auth)
+        super().__init__(api_base_url, basic_auth, **kwargs)
 
         self._co_id = co_id
 
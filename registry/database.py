@@ -9,15 +9,19 @@ jobs that process those payloads.
 import dataclasses
 import enum
 import json
+import os
 import pathlib
 import sqlite3
+import threading
 import time
 import uuid
-from collections.abc import Generator
+from collections.abc import Iterable
 from typing import Any, Optional
 
 import flask
 
+import registry.metrics
+
 __all__ = [
     "AccessKind",
     "Source",
@@ -26,15 +30,61 @@ __all__ = [
     #
     "FINAL_STATES",
     #
-    "get_new_payloads",
+    "claim_new_payloads",
+    "get_payload",
+    "get_payload_aliases",
+    "get_payload_for_job",
     "init",
     "insert_new_payload",
+    "insert_new_payloads",
+    "release_payloads",
+    "set_payload_jobs",
+    "set_payload_resources",
+    "set_payload_retry",
     "update_payload",
+    #
+    "get_build_result",
+    "record_build_result",
+    #
+    "get_project_weight",
+    "get_project_weights",
+    "get_queue_depths",
+    "set_project_weight",
+    #
+    "get_counters",
+    "incr_counter",
+    #
+    "delete_harbor_user",
+    "get_harbor_user_id",
+    "get_metadata",
+    "set_metadata",
+    "upsert_harbor_users",
 ]
 
 # Path to the database file, relative to the web application's data directory.
 DB_FILE = "database/soteria.sqlite"
 
+# Number of seconds to wait for another connection's lock to be released.
+BUSY_TIMEOUT = 30
+
+# Each thread's connections to the database, keyed by the database's path.
+_local = threading.local()
+
+# Default number of rows to read from the database at a time.
+BATCH_SIZE = 500
+
+# Condition matching payloads whose resources are pending or being built.
+# Only one such payload may exist for each resource and for each digest.
+PENDING_BUILD_CONDITION = "state = 'new' AND access_kind = 'public+tagged'"
+
+# Columns to select for constructing a `WebhookPayload` without its payload.
+WEBHOOK_PAYLOAD_COLUMNS = """
+  id, resource, access_kind, state, NULL AS payload, source
+, project, repository, tag, created_on, updated_on
+, cluster_id, proc_id, attempts, digest
+, image_size, request_cpus, request_memory, request_disk
+"""
+
 
 class AccessKind(enum.Enum):
     """
@@ -60,6 +110,7 @@ class State(enum.Enum):
     """
 
     new = "new"
+    coalesced = "coalesced"  # shares the outcome of another payload
     completed = "completed"
     failed = "failed"
     skipped = "skipped"
@@ -82,13 +133,21 @@ class WebhookPayload:  # pylint: disable=too-many-instance-attributes
     resource: str
     access_kind: AccessKind
     state: State
-    payload: dict[Any, Any]
+    payload: Optional[dict[Any, Any]]  # None if not yet loaded
     source: Source
     project: str
     repository: str
     tag: str
     created_on: int
     updated_on: int
+    cluster_id: Optional[int] = None
+    proc_id: Optional[int] = None
+    attempts: int = 0
+    digest: Optional[str] = None
+    image_size: Optional[int] = None  # bytes, compressed
+    request_cpus: Optional[int] = None
+    request_memory: Optional[int] = None  # MiB
+    request_disk: Optional[int] = None  # MiB
 
     def __post_init__(self):
         """
@@ -100,6 +159,14 @@ class WebhookPayload:  # pylint: disable=too-many-instance-attributes
         self.state = State(self.state)
         self.source = Source(self.source)
 
+    def get_payload(self) -> dict[Any, Any]:
+        """
+        Return the full webhook payload, loading it from the database if needed.
+        """
+        if self.payload is None:
+            self.payload = get_payload_body(self.id_)
+        return self.payload
+
 
 # --------------------------------------------------------------------------
 
@@ -132,9 +199,92 @@ def get_db_file(app: Optional[flask.Flask] = None) -> pathlib.Path:
 
 def get_db_conn(app: Optional[flask.Flask] = None) -> sqlite3.Connection:
     """
-    Return a new connection object to the database.
+    Return this thread's connection object to the database.
+
+    Connections are opened on first use and then reused by the same thread,
+    which also lets `sqlite3` reuse its cache of prepared statements. The
+    database uses write-ahead logging, so that readers (e.g., the polling
+    loop) and writers (e.g., webhooks) do not block each other.
+    """
+    db_file = get_db_file(app)
+
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.conns = {}
+        _local.pid = os.getpid()
+
+    conn: Optional[sqlite3.Connection] = _local.conns.get(db_file)
+
+    if conn is None:
+        conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT, cached_statements=256)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT * 1000)}")
+        _local.conns[db_file] = conn
+
+    return conn
+
+
+def add_missing_columns(conn: sqlite3.Connection, table: str, columns: dict[str, str]) -> None:
+    """
+    Add the given columns (name -> type) to a table if they do not exist.
     """
-    return sqlite3.connect(get_db_file(app))
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+    for name, type_ in columns.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {type_}")
+
+
+def coalesce_existing_payloads(conn: sqlite3.Connection) -> None:
+    """
+    Coalesce pending payloads for the same resource that were stored before
+    payloads were coalesced on insertion.
+
+    Those payloads were stored without digests, so they are coalesced when
+    their resources match.
+    """
+    (has_index,) = conn.execute(
+        """
+        SELECT COUNT(*)
+        FROM sqlite_master
+        WHERE type = 'index' AND name = 'webhook_payloads_pending_digest_index'
+        """
+    ).fetchone()
+
+    if has_index:
+        return
+
+    primaries: dict[str, str] = {}
+    aliases = []
+
+    for id_, resource in conn.execute(
+        f"""
+        SELECT id, resource
+        FROM webhook_payloads
+        WHERE {PENDING_BUILD_CONDITION}
+        ORDER BY created_on ASC, id ASC
+        """  # nosec B608
+    ).fetchall():
+        if resource in primaries:
+            aliases.append({"alias_id": id_, "primary_id": primaries[resource]})
+        else:
+            primaries[resource] = id_
+
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO payload_aliases ( alias_id, primary_id )
+        VALUES ( :alias_id, :primary_id )
+        """,
+        aliases,
+    )
+    conn.executemany(
+        """
+        UPDATE webhook_payloads
+        SET state = 'coalesced'
+        WHERE id = :alias_id
+        """,
+        aliases,
+    )
 
 
 def init(app: flask.Flask) -> None:
@@ -165,11 +315,128 @@ def init(app: flask.Flask) -> None:
             )
             """,
         )
+        add_missing_columns(
+            conn,
+            "webhook_payloads",
+            {
+                "cluster_id": "INT",
+                "proc_id": "INT",
+                "claimed_by": "TEXT",
+                "lease_expires": "INT",
+                "attempts": "INT DEFAULT 0",
+                "next_attempt_on": "INT DEFAULT 0",
+                "digest": "TEXT",
+                "image_size": "INT",
+                "request_cpus": "INT",
+                "request_memory": "INT",
+                "request_disk": "INT",
+            },
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS payload_aliases
+            (
+              alias_id TEXT PRIMARY KEY
+            , primary_id TEXT
+            )
+            """,
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS payload_aliases_primary_index
+            ON payload_aliases (primary_id)
+            """
+        )
+        coalesce_existing_payloads(conn)
+        conn.execute(
+            f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS webhook_payloads_pending_digest_index
+            ON webhook_payloads (digest) WHERE {PENDING_BUILD_CONDITION}
+            """  # nosec B608
+        )
+        conn.execute(
+            """
+            DROP INDEX IF EXISTS webhook_payloads_pending_resource_index
+            """
+        )
+        conn.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS webhook_payloads_pending_resource_digest_index
+            ON webhook_payloads (resource, digest) WHERE {PENDING_BUILD_CONDITION}
+            """  # nosec B608
+        )
+        conn.execute(
+            """
+            DROP INDEX IF EXISTS webhook_payloads_state_index
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS webhook_payloads_state_created_on_index
+            ON webhook_payloads (state, created_on, id)
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS webhook_payloads_job_index
+            ON webhook_payloads (cluster_id, proc_id)
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS project_weights
+            (
+              project TEXT PRIMARY KEY
+            , weight REAL
+            )
+            """,
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS build_results
+            (
+              digest TEXT PRIMARY KEY
+            , resource TEXT
+            , payload_id TEXT
+            , created_on INT
+            , last_used_on INT
+            )
+            """,
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS build_results_last_used_on_index
+            ON build_results (last_used_on)
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS harbor_users
+            (
+              subiss TEXT PRIMARY KEY
+            , user_id INT
+            , username TEXT
+            , creation_time TEXT
+            )
+            """,
+        )
         conn.execute(
             """
-            CREATE INDEX IF NOT EXISTS webhook_payloads_state_index
-            ON webhook_payloads (state)
+            CREATE TABLE IF NOT EXISTS metadata
+            (
+              key TEXT PRIMARY KEY
+            , value TEXT
+            )
+            """,
+        )
+        conn.execute(
             """
+            CREATE TABLE IF NOT EXISTS counters
+            (
+              name TEXT PRIMARY KEY
+            , value INT
+            )
+            """,
         )
         conn.commit()
 
@@ -178,63 +445,376 @@ def insert_new_payload(payload: dict[Any, Any], source: Source) -> None:
     """
     Add a new webhook payload to the database.
     """
-    with get_db_conn() as conn:
-        for resource in payload["event_data"]["resources"]:
-            if is_public(payload):
-                if is_immutable_tag(resource["tag"]):
-                    access_kind = AccessKind.public_and_tagged
-                else:
-                    access_kind = AccessKind.public
+    insert_new_payloads([(payload, source)])
+
+
+def get_payload_rows(payload: dict[Any, Any], source: Source) -> list[dict[str, Any]]:
+    """
+    Return the database rows for each resource in a webhook payload.
+    """
+    payload_as_text = json.dumps(payload, separators=(",", ":"))
+    now = int(time.time())
+    rows = []
+
+    for resource in payload["event_data"]["resources"]:
+        if is_public(payload):
+            if is_immutable_tag(resource["tag"]):
+                access_kind = AccessKind.public_and_tagged
             else:
-                access_kind = AccessKind.private
+                access_kind = AccessKind.public
+        else:
+            access_kind = AccessKind.private
+
+        rows.append(
+            {
+                "id": str(uuid.uuid4()),
+                "resource": resource["resource_url"],
+                "access_kind": access_kind.value,
+                "state": State.new.value,
+                "payload": payload_as_text,
+                "source": source.value,
+                "project": payload["event_data"]["repository"]["namespace"],
+                "repository": payload["event_data"]["repository"]["name"],
+                "tag": resource["tag"],
+                "digest": resource.get("digest"),
+                "image_size": resource.get("size"),
+                "created_on": now,
+                "updated_on": now,
+            }
+        )
+
+    return rows
+
 
-            now = int(time.time())
+def insert_new_payloads(
+    payloads: Iterable[tuple[dict[Any, Any], Source]],
+    app: Optional[flask.Flask] = None,
+) -> None:
+    """
+    Add several new webhook payloads to the database in one transaction.
+
+    A resource whose digest is already pending or being built is not built
+    again. Its row is stored as "coalesced" and recorded as an alias of the
+    pending one, and it later receives the same final state. A resource
+    without a digest is coalesced with a pending one of the same name, but
+    a tag that was pushed again with a new digest is built again.
+    """
+    rows = [row for payload, source in payloads for row in get_payload_rows(payload, source)]
+    coalesced = 0
+
+    with get_db_conn(app) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+
+        for row in rows:
+            if row["access_kind"] == AccessKind.public_and_tagged.value:
+                primary = conn.execute(
+                    f"""
+                    SELECT id FROM webhook_payloads
+                    WHERE {PENDING_BUILD_CONDITION} AND digest = :digest
+                    UNION ALL
+                    SELECT id FROM webhook_payloads
+                    WHERE {PENDING_BUILD_CONDITION} AND resource = :resource
+                      AND :digest IS NULL
+                    LIMIT 1
+                    """,  # nosec B608
+                    row,
+                ).fetchone()
+
+                if primary:
+                    row["state"] = State.coalesced.value
+                    conn.execute(
+                        """
+                        INSERT INTO payload_aliases ( alias_id, primary_id )
+                        VALUES ( :alias_id, :primary_id )
+                        """,
+                        {"alias_id": row["id"], "primary_id": primary[0]},
+                    )
+                    coalesced += 1
 
             conn.execute(
                 """
                 INSERT INTO webhook_payloads
-                ( id, resource, access_kind, state, payload, source, project, repository, tag, created_on, updated_on )
+                ( id, resource, access_kind, state, payload, source, project, repository, tag, digest, image_size, created_on, updated_on )
                 VALUES
-                ( :id, :resource, :access_kind, :state, :payload, :source, :project, :repository, :tag, :created_on, :updated_on )
+                ( :id, :resource, :access_kind, :state, :payload, :source, :project, :repository, :tag, :digest, :image_size, :created_on, :updated_on )
                 """,
-                {
-                    "id": str(uuid.uuid4()),
-                    "resource": resource["resource_url"],
-                    "access_kind": access_kind.value,
-                    "state": State.new.value,
-                    "payload": json.dumps(payload, separators=(",", ":")),
-                    "source": source.value,
-                    "project": payload["event_data"]["repository"]["namespace"],
-                    "repository": payload["event_data"]["repository"]["name"],
-                    "tag": resource["tag"],
-                    "created_on": now,
-                    "updated_on": now,
-                },
+                row,
             )
+
         conn.commit()
 
+    if coalesced:
+        registry.metrics.incr("webhooks.coalesced", coalesced)
+
 
-def get_new_payloads() -> Generator[WebhookPayload, None, None]:
+def claim_new_payloads(
+    worker_id: str,
+    lease: int,
+    limit: int = BATCH_SIZE,
+    *,
+    small_image_size: Optional[int] = None,
+    small_image_boost: float = 1.0,
+    max_jobs: int = 0,
+    max_jobs_per_project: int = 0,
+) -> list[WebhookPayload]:
     """
-    Iterate over any "new" webhook payloads in the database.
+    Claim up to `limit` "new" webhook payloads for the given worker.
+
+    A payload can be claimed if it is not already claimed (or its claim's
+    lease has expired) and it is not waiting to be retried. The claims last
+    for `lease` seconds or until they are released, whichever comes first.
+
+    Payloads are claimed in weighted round-robin order across projects: a
+    payload's position in its project's queue is divided by its weight,
+    which is the project's weight, multiplied by `small_image_boost` if its
+    image is known to be at most `small_image_size` bytes.
+
+    Payloads that need a job submitted for them are claimed only while fewer
+    than `max_jobs` payloads in total, and fewer than `max_jobs_per_project`
+    payloads of the same project, have jobs or are claimed (0 means no
+    limit). The backlog therefore waits here, where the order above decides
+    which payload's job is submitted next, rather than in HTCondor's queue.
     """
+    now = int(time.time())
+
     with get_db_conn() as conn:
+        conn.execute("BEGIN IMMEDIATE")
         rows = conn.execute(
-            """
-            SELECT *
+            f"""
+            WITH in_flight AS (
+              SELECT project, COUNT(*) AS jobs
+              FROM webhook_payloads
+              WHERE {PENDING_BUILD_CONDITION}
+                AND (cluster_id IS NOT NULL OR lease_expires > :now)
+              GROUP BY project
+            )
+            , candidates AS (
+              SELECT
+                id
+              , created_on AS queued_on
+              , ROW_NUMBER() OVER (
+                  PARTITION BY project ORDER BY created_on ASC, id ASC
+                ) AS position
+              , COALESCE(project_weights.weight, 1.0)
+                * IIF(image_size <= :small_image_size, :small_image_boost, 1.0) AS weight
+              , access_kind = 'public+tagged' AND cluster_id IS NULL AS needs_job
+              , ROW_NUMBER() OVER (
+                  PARTITION BY project, access_kind = 'public+tagged' AND cluster_id IS NULL
+                  ORDER BY created_on ASC, id ASC
+                ) + COALESCE(in_flight.jobs, 0) AS project_jobs
+              FROM webhook_payloads
+              LEFT JOIN project_weights USING ( project )
+              LEFT JOIN in_flight USING ( project )
+              WHERE state = 'new'
+                AND next_attempt_on <= :now
+                AND (claimed_by IS NULL OR lease_expires <= :now)
+            )
+            , admitted AS (
+              SELECT id
+              FROM (
+                SELECT
+                  id
+                , ROW_NUMBER() OVER (
+                    ORDER BY position / weight ASC, queued_on ASC, id ASC
+                  ) AS rank
+                FROM candidates
+                WHERE needs_job
+                  AND (:max_jobs_per_project <= 0 OR project_jobs <= :max_jobs_per_project)
+              )
+              WHERE :max_jobs <= 0
+                OR rank <= :max_jobs - (SELECT COALESCE(SUM(jobs), 0) FROM in_flight)
+            )
+            SELECT {WEBHOOK_PAYLOAD_COLUMNS}
             FROM webhook_payloads
-            WHERE state = 'new'
-            ORDER BY created_on ASC
+            JOIN candidates USING ( id )
+            WHERE NOT candidates.needs_job OR id IN ( SELECT id FROM admitted )
+            ORDER BY position / candidates.weight ASC, queued_on ASC, id ASC
+            LIMIT :limit
+            """,  # nosec B608
+            {
+                "now": now,
+                "limit": limit,
+                "small_image_size": small_image_size,
+                "small_image_boost": small_image_boost,
+                "max_jobs": max_jobs,
+                "max_jobs_per_project": max_jobs_per_project,
+            },
+        ).fetchall()
+        payloads = [WebhookPayload(*row) for row in rows]
+        conn.executemany(
             """
+            UPDATE webhook_payloads
+            SET claimed_by = :claimed_by, lease_expires = :lease_expires
+            WHERE id = :id
+            """,
+            [
+                {"id": payload.id_, "claimed_by": worker_id, "lease_expires": now + lease}
+                for payload in payloads
+            ],
+        )
+        conn.commit()
+
+    return payloads
+
+
+def release_payloads(worker_id: str) -> None:
+    """
+    Release every claim held by the given worker.
+    """
+    with get_db_conn() as conn:
+        conn.execute(
+            """
+            UPDATE webhook_payloads
+            SET claimed_by = NULL, lease_expires = NULL
+            WHERE claimed_by = :claimed_by
+            """,
+            {"claimed_by": worker_id},
+        )
+        conn.commit()
+
+
+def set_payload_retry(id_: str, attempts: int, next_attempt_on: int) -> None:
+    """
+    Record a failed attempt to process a payload, and release its claim.
+    """
+    with get_db_conn() as conn:
+        conn.execute(
+            """
+            UPDATE webhook_payloads
+            SET attempts = :attempts
+              , next_attempt_on = :next_attempt_on
+              , claimed_by = NULL
+              , lease_expires = NULL
+            WHERE id = :id
+            """,
+            {"id": id_, "attempts": attempts, "next_attempt_on": next_attempt_on},
+        )
+        conn.commit()
+
+
+def get_payload(id_: str) -> Optional[WebhookPayload]:
+    """
+    Return the webhook payload with the given ID, without its JSON body.
+    """
+    with get_db_conn() as conn:
+        row = conn.execute(
+            f"""
+            SELECT {WEBHOOK_PAYLOAD_COLUMNS}
+            FROM webhook_payloads
+            WHERE id = :id
+            """,  # nosec B608
+            {"id": id_},
+        ).fetchone()
+    return WebhookPayload(*row) if row else None
+
+
+def get_payload_aliases(id_: str) -> list[WebhookPayload]:
+    """
+    Return the webhook payloads that were coalesced into the given one.
+    """
+    with get_db_conn() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT {WEBHOOK_PAYLOAD_COLUMNS}
+            FROM webhook_payloads
+            WHERE id IN (
+              SELECT alias_id FROM payload_aliases WHERE primary_id = :id
+            )
+            """,  # nosec B608
+            {"id": id_},
         ).fetchall()
-    for row in rows:
-        yield WebhookPayload(*row)
+    return [WebhookPayload(*row) for row in rows]
+
+
+def get_payload_for_job(cluster_id: int, proc_id: int) -> Optional[WebhookPayload]:
+    """
+    Return the webhook payload processed by the given HTCondor job.
+    """
+    with get_db_conn() as conn:
+        row = conn.execute(
+            f"""
+            SELECT {WEBHOOK_PAYLOAD_COLUMNS}
+            FROM webhook_payloads
+            WHERE cluster_id = :cluster_id AND proc_id = :proc_id
+            """,  # nosec B608
+            {"cluster_id": cluster_id, "proc_id": proc_id},
+        ).fetchone()
+    return WebhookPayload(*row) if row else None
+
+
+def set_payload_jobs(jobs: Iterable[tuple[str, Optional[int], Optional[int]]]) -> None:
+    """
+    Record the HTCondor job (ID, cluster ID, proc ID) processing each payload.
+    """
+    with get_db_conn() as conn:
+        conn.executemany(
+            """
+            UPDATE webhook_payloads
+            SET cluster_id = :cluster_id, proc_id = :proc_id
+            WHERE id = :id
+            """,
+            [
+                {"id": id_, "cluster_id": cluster_id, "proc_id": proc_id}
+                for id_, cluster_id, proc_id in jobs
+            ],
+        )
+        conn.commit()
+
+
+def set_payload_resources(payload: WebhookPayload) -> None:
+    """
+    Record the image size and resource requests chosen for a payload's job.
+    """
+    with get_db_conn() as conn:
+        conn.execute(
+            """
+            UPDATE webhook_payloads
+            SET image_size = :image_size
+              , request_cpus = :request_cpus
+              , request_memory = :request_memory
+              , request_disk = :request_disk
+            WHERE id = :id
+            """,
+            {
+                "id": payload.id_,
+                "image_size": payload.image_size,
+                "request_cpus": payload.request_cpus,
+                "request_memory": payload.request_memory,
+                "request_disk": payload.request_disk,
+            },
+        )
+        conn.commit()
+
+
+def get_payload_body(id_: str) -> dict[Any, Any]:
+    """
+    Return the full JSON body of a webhook payload.
+    """
+    with get_db_conn() as conn:
+        (payload,) = conn.execute(
+            """
+            SELECT payload
+            FROM webhook_payloads
+            WHERE id = :id
+            """,
+            {"id": id_},
+        ).fetchone()
+    body: dict[Any, Any] = json.loads(payload)
+    return body
 
 
 def update_payload(id_: str, state: State) -> None:
     """
     Update the state of a webhook payload.
+
+    A final state is also given to every payload coalesced into this one.
     """
+    params = {
+        "id": id_,
+        "state": state.value,
+        "updated_on": int(time.time()),
+    }
+
     with get_db_conn() as conn:
         conn.execute(
             """
@@ -242,10 +822,294 @@ def update_payload(id_: str, state: State) -> None:
             SET state = :state, updated_on = :updated_on
             WHERE id = :id
             """,
+            params,
+        )
+        if state in FINAL_STATES:
+            conn.execute(
+                """
+                UPDATE webhook_payloads
+                SET state = :state, updated_on = :updated_on
+                WHERE state = 'coalesced' AND id IN (
+                  SELECT alias_id FROM payload_aliases WHERE primary_id = :id
+                )
+                """,
+                params,
+            )
+        conn.commit()
+
+
+# --------------------------------------------------------------------------
+
+
+def get_project_weight(project: str) -> float:
+    """
+    Return a project's scheduling weight (1 unless set otherwise).
+    """
+    with get_db_conn() as conn:
+        row = conn.execute(
+            """
+            SELECT weight
+            FROM project_weights
+            WHERE project = :project
+            """,
+            {"project": project},
+        ).fetchone()
+    return float(row[0]) if row else 1.0
+
+
+def get_project_weights() -> dict[str, float]:
+    """
+    Return every project whose scheduling weight has been set.
+    """
+    with get_db_conn() as conn:
+        rows = conn.execute(
+            """
+            SELECT project, weight
+            FROM project_weights
+            ORDER BY project
+            """
+        ).fetchall()
+    return {project: float(weight) for project, weight in rows}
+
+
+def set_project_weight(project: str, weight: Optional[float]) -> None:
+    """
+    Set a project's scheduling weight, or reset it to 1 if `weight` is None.
+    """
+    with get_db_conn() as conn:
+        if weight is None:
+            conn.execute(
+                """
+                DELETE FROM project_weights
+                WHERE project = :project
+                """,
+                {"project": project},
+            )
+        else:
+            conn.execute(
+                """
+                INSERT INTO project_weights ( project, weight )
+                VALUES ( :project, :weight )
+                ON CONFLICT ( project ) DO UPDATE SET weight = excluded.weight
+                """,
+                {"project": project, "weight": weight},
+            )
+        conn.commit()
+
+
+def get_queue_depths() -> list[tuple[str, int, int]]:
+    """
+    Return the number of queued and running payloads for each project.
+
+    Queued payloads have no HTCondor job yet; running payloads do.
+    """
+    with get_db_conn() as conn:
+        rows = conn.execute(
+            """
+            SELECT
+              project
+            , SUM(cluster_id IS NULL) AS queued
+            , SUM(cluster_id IS NOT NULL) AS running
+            FROM webhook_payloads
+            WHERE state = 'new'
+            GROUP BY project
+            ORDER BY project
+            """
+        ).fetchall()
+    return [(project, int(queued), int(running)) for project, queued, running in rows]
+
+
+# --------------------------------------------------------------------------
+
+
+def get_build_result(digest: str, ttl: int) -> bool:
+    """
+    Determine whether an image with the given digest was built successfully
+    within the last `ttl` seconds, and if so, mark the result as used.
+    """
+    now = int(time.time())
+
+    with get_db_conn() as conn:
+        cursor = conn.execute(
+            """
+            UPDATE build_results
+            SET last_used_on = :now
+            WHERE digest = :digest AND created_on > :now - :ttl
+            """,
+            {"digest": digest, "now": now, "ttl": ttl},
+        )
+        conn.commit()
+
+    return cursor.rowcount > 0
+
+
+def record_build_result(payload: WebhookPayload, ttl: int, max_entries: int) -> None:
+    """
+    Record that the image for the given payload was built successfully by
+    the payload's own job. A digest that was built again is remembered as
+    built now.
+
+    Results older than `ttl` seconds are then removed, followed by the least
+    recently used results in excess of `max_entries`.
+    """
+    now = int(time.time())
+
+    with get_db_conn() as conn:
+        conn.execute(
+            """
+            INSERT INTO build_results
+            ( digest, resource, payload_id, created_on, last_used_on )
+            VALUES
+            ( :digest, :resource, :payload_id, :now, :now )
+            ON CONFLICT ( digest ) DO UPDATE SET
+              resource = excluded.resource
+            , payload_id = excluded.payload_id
+            , created_on = excluded.created_on
+            , last_used_on = excluded.last_used_on
+            """,
             {
-                "id": id_,
-                "state": state.value,
-                "updated_on": int(time.time()),
+                "digest": payload.digest,
+                "resource": payload.resource,
+                "payload_id": payload.id_,
+                "now": now,
             },
         )
+        conn.execute(
+            """
+            DELETE FROM build_results
+            WHERE created_on <= :now - :ttl
+            """,
+            {"now": now, "ttl": ttl},
+        )
+        conn.execute(
+            """
+            DELETE FROM build_results
+            WHERE digest IN (
+              SELECT digest FROM build_results
+              ORDER BY last_used_on DESC
+              LIMIT -1 OFFSET :max_entries
+            )
+            """,
+            {"max_entries": max_entries},
+        )
+        conn.commit()
+
+
+# --------------------------------------------------------------------------
+
+
+def incr_counter(name: str, value: int = 1, app: Optional[flask.Flask] = None) -> None:
+    """
+    Increment a counter that is shared among processes.
+
+    Unlike `registry.metrics`, these counters are visible to every process,
+    e.g., the web application can report the polling loop's counters.
+    """
+    with get_db_conn(app) as conn:
+        conn.execute(
+            """
+            INSERT INTO counters ( name, value )
+            VALUES ( :name, :value )
+            ON CONFLICT ( name ) DO UPDATE SET value = value + excluded.value
+            """,
+            {"name": name, "value": value},
+        )
+        conn.commit()
+
+
+def get_counters(app: Optional[flask.Flask] = None) -> dict[str, int]:
+    """
+    Return the current values of all shared counters.
+    """
+    with get_db_conn(app) as conn:
+        rows = conn.execute("SELECT name, value FROM counters ORDER BY name").fetchall()
+    return dict(rows)
+
+
+# --------------------------------------------------------------------------
+
+
+def get_metadata(key: str, app: Optional[flask.Flask] = None) -> Optional[str]:
+    """
+    Return the value of a piece of bookkeeping data, if it is set.
+    """
+    with get_db_conn(app) as conn:
+        row = conn.execute(
+            """
+            SELECT value
+            FROM metadata
+            WHERE key = :key
+            """,
+            {"key": key},
+        ).fetchone()
+    return row[0] if row else None
+
+
+def set_metadata(key: str, value: str, app: Optional[flask.Flask] = None) -> None:
+    """
+    Set the value of a piece of bookkeeping data.
+    """
+    with get_db_conn(app) as conn:
+        conn.execute(
+            """
+            INSERT INTO metadata ( key, value )
+            VALUES ( :key, :value )
+            ON CONFLICT ( key ) DO UPDATE SET value = excluded.value
+            """,
+            {"key": key, "value": value},
+        )
+        conn.commit()
+
+
+def get_harbor_user_id(subiss: str) -> Optional[int]:
+    """
+    Look up the ID of the Harbor user with the given "subiss".
+    """
+    with get_db_conn() as conn:
+        row = conn.execute(
+            """
+            SELECT user_id
+            FROM harbor_users
+            WHERE subiss = :subiss
+            """,
+            {"subiss": subiss},
+        ).fetchone()
+    return row[0] if row else None
+
+
+def upsert_harbor_users(users: Iterable[dict[str, Any]]) -> None:
+    """
+    Add or update entries in the index of Harbor users.
+
+    Each user must have the keys: subiss, user_id, username, creation_time.
+    """
+    with get_db_conn() as conn:
+        conn.executemany(
+            """
+            INSERT INTO harbor_users
+            ( subiss, user_id, username, creation_time )
+            VALUES
+            ( :subiss, :user_id, :username, :creation_time )
+            ON CONFLICT ( subiss ) DO UPDATE SET
+              user_id = excluded.user_id
+            , username = excluded.username
+            , creation_time = excluded.creation_time
+            """,
+            users,
+        )
+        conn.commit()
+
+
+def delete_harbor_user(subiss: str) -> None:
+    """
+    Remove an entry from the index of Harbor users.
+    """
+    with get_db_conn() as conn:
+        conn.execute(
+            """
+            DELETE FROM harbor_users
+            WHERE subiss = :subiss
+            """,
+            {"subiss": subiss},
+        )
         conn.commit()
@@ -24,11 +24,10 @@ from wtforms.validators import (
     ValidationError,
 )
 
+from registry.clients import get_admin_harbor_api, get_freshdesk_api
 from registry.util import (
     create_project,
     create_starter_project,
-    get_admin_harbor_api,
-    get_freshdesk_api,
     get_harbor_projects,
     get_harbor_user,
     has_starter_project,
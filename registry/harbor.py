@@ -2,11 +2,17 @@
 Wrapper for Harbor's API.
 """
 
+import collections
+import concurrent.futures
 import datetime
 import enum
+import itertools
+import math
 import secrets
+import threading
 import time
 import typing
+import urllib.parse
 from typing import List, Optional, Tuple, Union
 
 import flask
@@ -18,6 +24,13 @@ __all__ = ["HarborAPI", "HarborRoleID"]
 
 GIBIBYTE = 2**30
 
+# The largest page of results that Harbor will return.
+HARBOR_MAX_PAGE_SIZE = 100
+
+# Defaults for paginating through Harbor's collections.
+DEFAULT_PAGE_SIZE = HARBOR_MAX_PAGE_SIZE
+DEFAULT_MAX_WORKERS = 4
+
 
 class HarborRoleID(enum.IntEnum):
     PROJECT_ADMIN = 1
@@ -122,25 +135,104 @@ class HarborAPI(registry.api_client.GenericAPI):
     All calls will be made using the credentials provided to the constructor.
     """
 
+    def __init__(
+        self,
+        api_base_url: str,
+        basic_auth: Optional[Tuple[str, str]] = None,
+        *,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        **kwargs,
+    ):
+        """
+        Construct a wrapper that uses the provided credentials, if any.
+
+        Collections are retrieved `page_size` items at a time (at most
+        Harbor's maximum), using up to `max_workers` concurrent requests.
+        Other keyword arguments are passed through to `GenericAPI`.
+        """
+        super().__init__(api_base_url, basic_auth, **kwargs)
+
+        pool_maxsize = int(kwargs.get("pool_maxsize", registry.api_client.DEFAULT_POOL_MAXSIZE))
+
+        self._page_size = max(1, min(page_size, HARBOR_MAX_PAGE_SIZE))
+        self._max_workers = max(1, min(max_workers, pool_maxsize))
+
+        # Callers may iterate over several collections concurrently (e.g.,
+        # via `registry.util.map_concurrently`). Limit the total number of
+        # pages being fetched to the size of the connection pool, so that
+        # connections are reused instead of being opened and discarded.
+
+        self._page_slots = threading.BoundedSemaphore(max(1, pool_maxsize))
+
+    def _get_page(self, route, page: int, page_size: int, **kwargs) -> requests.Response:
+        """
+        Retrieves one page of the resources in a route.
+
+        The paging parameters are set after the caller's other parameters,
+        so that they cannot be overridden. Raises `requests.HTTPError` if
+        the request fails.
+        """
+        params = {**kwargs.get("params", {}), "page": page, "page_size": page_size}
+
+        with self._page_slots:
+            response = self._get(route, **{**kwargs, "params": params})
+
+        response.raise_for_status()
+        return response
+
     def _get_all(self, route, **kwargs) -> typing.Generator[dict, None, None]:
         """
         Iterates all pages and retrieves all resource in a route
+
+        A "page_size" in the caller's parameters sets the number of
+        resources per page (at most Harbor's maximum); a "page" is ignored.
+        The first page doubles as the probe for the total number of
+        resources. The remaining pages are fetched concurrently, a bounded
+        number at a time, but their resources are still yielded in order.
+        Raises `requests.HTTPError` if any page cannot be retrieved.
         """
-        PAGE_SIZE = 100
-
-        info_response = self._get(route, params={"page_size": 1})
-        number_of_pages = (int(info_response.headers.get("x-total-count")) // PAGE_SIZE) + 1
-
-        for i in range(1, number_of_pages + 1):
-            values = self._get(
-                route,
-                **{
-                    **kwargs,
-                    "params": {"page": i, "page_size": PAGE_SIZE, **kwargs.get("params", {})},
-                },
-            ).json()
-            for value in values:
-                yield value
+        page_size = int(kwargs.get("params", {}).get("page_size") or self._page_size)
+        page_size = max(1, min(page_size, HARBOR_MAX_PAGE_SIZE))
+        first_response = self._get_page(route, 1, page_size, **kwargs)
+
+        values = first_response.json()
+        yield from values
+
+        total_count = int(first_response.headers.get("x-total-count", len(values)))
+        pages = iter(range(2, math.ceil(total_count / page_size) + 1))
+
+        if self._max_workers == 1:
+            for page in pages:
+                yield from self._get_page(route, page, page_size, **kwargs).json()
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            pending = collections.deque(
+                executor.submit(self._get_page, route, page, page_size, **kwargs)
+                for page in itertools.islice(pages, self._max_workers)
+            )
+            try:
+                while pending:
+                    response = pending.popleft().result()
+
+                    for page in itertools.islice(pages, 1):
+                        pending.append(
+                            executor.submit(self._get_page, route, page, page_size, **kwargs)
+                        )
+
+                    yield from response.json()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def get_path(self, path: str, **kwargs) -> requests.Response:
+        """
+        Send a GET request for an arbitrary path under the API's base URL.
+
+        Keyword arguments are passed through unmodified to `requests`.
+        """
+        return self._get(f"/{path}", **kwargs)
 
     #
     # ----------------------------------------------------------------------
@@ -182,6 +274,37 @@ class HarborAPI(registry.api_client.GenericAPI):
 
         return self._get(f"/projects/{project_name}/repositories", params=params)
 
+    def get_artifact(self, project_name: str, repository_name: str, reference: str):
+        """
+        Get an artifact by its tag or digest.
+        """
+        # Harbor requires slashes in a repository's name to be double-encoded.
+        repository_name = urllib.parse.quote(urllib.parse.quote(repository_name, safe=""))
+
+        return self._get(
+            f"/projects/{project_name}/repositories/{repository_name}/artifacts/{reference}"
+        )
+
+    def get_all_repositories(
+        self, project_name: str, **kwargs
+    ) -> typing.Generator[dict, None, None]:
+        """
+        Get all repositories in a project.
+        """
+        return self._get_all(f"/projects/{project_name}/repositories", **kwargs)
+
+    def get_all_artifacts(
+        self, project_name: str, repository_name: str, **kwargs
+    ) -> typing.Generator[dict, None, None]:
+        """
+        Get all artifacts in a repository, given its name within the project.
+        """
+        repository_name = urllib.parse.quote(urllib.parse.quote(repository_name, safe=""))
+
+        return self._get_all(
+            f"/projects/{project_name}/repositories/{repository_name}/artifacts", **kwargs
+        )
+
     #
     # ----------------------------------------------------------------------
     #
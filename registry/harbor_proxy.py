@@ -0,0 +1,319 @@
+"""
+Serve read-only requests for Harbor's public API from a local cache.
+
+The public pages of the web application browse Harbor's projects,
+repositories, and artifacts through `/harbor/get/`. Responses of moderate
+size are kept in a cache in each process, which holds at most
+`HARBOR_PROXY_CACHE_MAX_BYTES` bytes of response bodies, for a time that
+depends on the route. Once that time has passed, the cached response is revalidated with
+Harbor using its ETag, and browsers can likewise revalidate their copies
+with `If-None-Match`. Other responses are streamed from Harbor to the
+client without being held in memory.
+"""
+
+import collections
+import dataclasses
+import hashlib
+import re
+import threading
+import time
+import urllib.parse
+from collections.abc import Iterator
+from typing import Optional, Union
+
+import flask
+import requests
+import werkzeug.http
+
+import registry.clients
+import registry.metrics
+
+__all__ = [
+    "CachedResponse",
+    "ResponseCache",
+    "get",
+]
+
+# Response headers that are passed through from Harbor.
+HEADERS_TO_PASS = ["Content-Type", "Date", "Link", "X-Total-Count", "X-Request-Id"]
+
+# Additional headers that are passed through when a response is streamed.
+HEADERS_TO_STREAM = HEADERS_TO_PASS + [
+    "Accept-Ranges",
+    "Content-Length",
+    "Content-Range",
+    "ETag",
+    "Last-Modified",
+]
+
+# Number of bytes to read from Harbor at a time.
+CHUNK_SIZE = 64 * 1024
+
+# Defaults for the corresponding `HARBOR_PROXY_*` configuration keys. The
+# TTLs are (regex, seconds) pairs; the first regex to match the requested
+# path determines how long its responses are served without revalidation.
+DEFAULT_TTLS = [
+    (r"^projects/?$", 60),
+    (r"^projects/[^/]+/repositories/?$", 60),
+    (r"^projects/[^/]+/repositories/.+/artifacts/?$", 30),
+]
+DEFAULT_TTL = 0
+DEFAULT_MAX_AGE = 24 * 60 * 60
+DEFAULT_TIMEOUT = 10
+DEFAULT_MAX_CACHED_SIZE = 1024 * 1024
+DEFAULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_response_cache_lock = threading.Lock()
+
+
+@dataclasses.dataclass
+class CachedResponse:
+    """
+    A response from Harbor, as stored in the cache.
+    """
+
+    status: int
+    body: bytes
+    headers: dict[str, str]
+    etag: str  # Harbor's ETag, or a hash of the body if it did not send one
+    upstream_etag: Optional[str]
+    stored_on: float
+
+
+class ResponseCache:
+    """
+    A cache of Harbor's responses, holding at most `max_bytes` bytes of
+    response bodies.
+
+    The least recently used responses are evicted first, and responses
+    expire `max_age` seconds after they were stored.
+    """
+
+    def __init__(self, max_bytes: int, max_age: float):
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._entries: collections.OrderedDict[str, CachedResponse] = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """
+        The number of bytes of response bodies in the cache.
+        """
+        return self._size
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry and time.time() - entry.stored_on >= self._max_age:
+                self._remove(key)
+                return None
+            if entry:
+                self._entries.move_to_end(key)
+
+            return entry
+
+    def set(self, key: str, entry: CachedResponse) -> None:
+        with self._lock:
+            self._remove(key)
+
+            if len(entry.body) > self._max_bytes:
+                return
+
+            self._entries[key] = entry
+            self._size += len(entry.body)
+
+            while self._size > self._max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        if entry := self._entries.pop(key, None):
+            self._size -= len(entry.body)
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    Return the current application's cache of Harbor's responses.
+    """
+    app = flask.current_app._get_current_object()  # type: ignore[attr-defined]
+
+    with _response_cache_lock:
+        if "soteria_harbor_proxy_cache" not in app.extensions:
+            app.extensions["soteria_harbor_proxy_cache"] = ResponseCache(
+                int(app.config.get("HARBOR_PROXY_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES)),
+                float(app.config.get("HARBOR_PROXY_MAX_AGE", DEFAULT_MAX_AGE)),
+            )
+        response_cache: ResponseCache = app.extensions["soteria_harbor_proxy_cache"]
+
+    return response_cache
+
+
+def get_ttl(path: str) -> float:
+    """
+    Return the number of seconds for which responses for a path are fresh.
+    """
+    config = flask.current_app.config
+
+    for pattern, ttl in config.get("HARBOR_PROXY_TTLS", DEFAULT_TTLS):
+        if re.search(pattern, path):
+            return float(ttl)
+    return float(config.get("HARBOR_PROXY_DEFAULT_TTL", DEFAULT_TTL))
+
+
+def get_cache_key(path: str, args: list[tuple[str, str]]) -> str:
+    """
+    Return the cache key for a path and its query, ignoring parameter order.
+    """
+    query = urllib.parse.urlencode(sorted(args))
+    return hashlib.sha256(f"{path.strip('/')}?{query}".encode()).hexdigest()
+
+
+def stream(
+    response: requests.Response,
+    chunks: list[bytes],
+    rest: Iterator[bytes],
+) -> flask.Response:
+    """
+    Pass an upstream response through to the client as it is received.
+
+    `chunks` are the parts of the body that have already been read, and
+    `rest` iterates over the remainder.
+    """
+    headers = {k: v for k, v in response.headers.items() if k in HEADERS_TO_STREAM}
+
+    # `iter_content` decodes the body, so its length may not match Harbor's.
+    if "Content-Encoding" in response.headers:
+        headers.pop("Content-Length", None)
+
+    def generate() -> Iterator[bytes]:
+        try:
+            yield from chunks
+            yield from rest
+        finally:
+            response.close()
+
+    registry.metrics.incr("harbor_proxy.streamed")
+
+    return flask.Response(generate(), status=response.status_code, headers=headers)
+
+
+def fetch(
+    path: str,
+    args: list[tuple[str, str]],
+    cached: Optional[CachedResponse],
+    cacheable: bool,
+) -> Union[CachedResponse, flask.Response]:
+    """
+    Request a path from Harbor, revalidating the cached response if there is one.
+
+    The body is read into memory only if the response can be cached and is
+    no larger than `HARBOR_PROXY_MAX_CACHED_SIZE`. Otherwise, the response
+    is streamed to the client.
+    """
+    config = flask.current_app.config
+    max_size = int(config.get("HARBOR_PROXY_MAX_CACHED_SIZE", DEFAULT_MAX_CACHED_SIZE))
+    headers = {}
+
+    if cached and cached.upstream_etag:
+        headers["If-None-Match"] = cached.upstream_etag
+
+    if "Range" in flask.request.headers:
+        headers["Range"] = flask.request.headers["Range"]
+        headers["Accept-Encoding"] = "identity"  # ranges refer to the raw bytes
+        if "If-Range" in flask.request.headers:
+            headers["If-Range"] = flask.request.headers["If-Range"]
+
+    response = registry.clients.get_harbor_api().get_path(
+        path,
+        params=args,
+        headers=headers,
+        timeout=float(config.get("HARBOR_PROXY_TIMEOUT", DEFAULT_TIMEOUT)),
+        stream=True,
+    )
+
+    if cached and response.status_code == 304:
+        response.close()
+        registry.metrics.incr("harbor_proxy.revalidated")
+        return dataclasses.replace(cached, stored_on=time.time())
+
+    registry.metrics.incr("harbor_proxy.misses")
+
+    chunks: list[bytes] = []
+    rest = response.iter_content(chunk_size=CHUNK_SIZE)
+
+    if not cacheable or response.status_code != 200:
+        return stream(response, chunks, rest)
+
+    size = 0
+
+    for chunk in rest:
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > max_size:
+            return stream(response, chunks, rest)
+
+    body = b"".join(chunks)
+    upstream_etag = response.headers.get("ETag")
+
+    return CachedResponse(
+        status=response.status_code,
+        body=body,
+        headers={k: v for k, v in response.headers.items() if k in HEADERS_TO_PASS},
+        etag=upstream_etag or f'"{hashlib.sha256(body).hexdigest()}"',
+        upstream_etag=upstream_etag,
+        stored_on=time.time(),
+    )
+
+
+def get(path: str) -> flask.Response:
+    """
+    Return the response to a GET request for the given Harbor API path.
+
+    The request's query string is passed along to Harbor. Requests for a
+    range of the body are passed along too, and are never cached.
+    """
+    args = list(flask.request.args.items(multi=True))
+    ttl = get_ttl(path)
+    key = get_cache_key(path, args)
+    cacheable = ttl > 0 and "Range" not in flask.request.headers
+    response_cache = get_response_cache()
+
+    cached = response_cache.get(key) if cacheable else None
+
+    if cached and time.time() - cached.stored_on < ttl:
+        registry.metrics.incr("harbor_proxy.hits")
+        entry = cached
+    else:
+        try:
+            result = fetch(path, args, cached, cacheable)
+        except requests.RequestException:
+            if not cached:
+                flask.current_app.logger.warning("Failed to get %s", path, exc_info=True)
+                return flask.make_response(
+                    {"errors": [{"code": "BAD_GATEWAY", "message": "Harbor is unavailable"}]},
+                    502,
+                )
+            flask.current_app.logger.warning(
+                "Serving stale response for %s", path, exc_info=True
+            )
+            result = cached
+
+        if isinstance(result, flask.Response):
+            return result
+
+        entry = result
+
+        if entry.status == 200:
+            response_cache.set(key, entry)
+
+    response = flask.make_response((entry.body, entry.status, entry.headers))
+
+    if entry.status == 200:
+        response.set_etag(*werkzeug.http.unquote_etag(entry.etag))
+        response.cache_control.public = True
+        response.cache_control.max_age = max(0, int(ttl - (time.time() - entry.stored_on)))
+        response.make_conditional(flask.request)
+
+    return response
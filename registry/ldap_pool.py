@@ -0,0 +1,225 @@
+"""
+Process-wide pool of LDAP connections.
+
+Binding a new connection requires a TCP and TLS handshake plus an LDAP bind.
+The pool keeps a small number of bound connections around so that queries
+made while handling a request can reuse them.
+"""
+
+import collections
+import contextlib
+import threading
+import time
+from collections.abc import Iterator
+from typing import Any, Optional
+
+import flask
+import ldap3  # type: ignore[import]
+import ldap3.core.exceptions  # type: ignore[import]
+import ldap3.core.results  # type: ignore[import]
+
+import registry.metrics
+
+__all__ = [
+    "LDAPConnectionPool",
+    "get_ldap_pool",
+]
+
+# Defaults for the corresponding `LDAP_POOL_*` configuration keys.
+DEFAULT_POOL_SIZE = 4
+DEFAULT_IDLE_TIMEOUT = 300
+DEFAULT_CHECKOUT_TIMEOUT = 30
+
+# Result codes with which a search succeeds, even if it finds no entries.
+SEARCH_OK_RESULTS = {
+    ldap3.core.results.RESULT_SUCCESS,
+    ldap3.core.results.RESULT_NO_SUCH_OBJECT,
+    ldap3.core.results.RESULT_SIZE_LIMIT_EXCEEDED,
+}
+
+EXTENSION_KEY = "soteria_ldap_pool"
+
+_extension_lock = threading.Lock()
+
+
+class LDAPConnectionPool:
+    """
+    A bounded pool of bound, synchronous LDAP connections.
+
+    At most `size` connections are open at any time. Connections that have
+    been idle for longer than `idle_timeout` seconds are closed instead of
+    being reused. Connections that fail are discarded, and the failed
+    operation is retried once using a freshly bound connection.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        username: str,
+        password: str,
+        *,
+        size: int = DEFAULT_POOL_SIZE,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+        checkout_timeout: float = DEFAULT_CHECKOUT_TIMEOUT,
+    ):
+        self._server = ldap3.Server(url, get_info=ldap3.NONE)
+        self._username = username
+        self._password = password
+
+        self._size = size
+        self._idle_timeout = idle_timeout
+        self._checkout_timeout = checkout_timeout
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle: collections.deque[tuple[ldap3.Connection, float]] = collections.deque()
+        self._open = 0
+
+    def _new_connection(self) -> ldap3.Connection:
+        conn = ldap3.Connection(
+            self._server,
+            self._username,
+            self._password,
+            auto_bind=True,
+            raise_exceptions=False,
+        )
+        with self._lock:
+            self._open += 1
+        registry.metrics.incr("ldap_pool.binds")
+        return conn
+
+    def _discard(self, conn: ldap3.Connection) -> None:
+        with self._lock:
+            self._open -= 1
+        try:
+            conn.unbind()
+        except ldap3.core.exceptions.LDAPException:
+            pass
+
+    def _update_gauges(self) -> None:
+        with self._lock:
+            open_, idle = self._open, len(self._idle)
+        registry.metrics.set_gauge("ldap_pool.open", open_)
+        registry.metrics.set_gauge("ldap_pool.idle", idle)
+        registry.metrics.set_gauge("ldap_pool.size", self._size)
+
+    def _checkout(self) -> ldap3.Connection:
+        start = time.monotonic()
+
+        if not self._slots.acquire(timeout=self._checkout_timeout):
+            raise TimeoutError("Timed out waiting for an LDAP connection")
+
+        try:
+            conn = None
+            now = time.monotonic()
+
+            while conn is None:
+                with self._lock:
+                    candidate = self._idle.pop() if self._idle else None
+                if candidate is None:
+                    conn = self._new_connection()
+                elif now - candidate[1] > self._idle_timeout or candidate[0].closed:
+                    self._discard(candidate[0])
+                else:
+                    conn = candidate[0]
+        except BaseException:
+            self._slots.release()
+            raise
+
+        registry.metrics.observe("ldap_pool.checkout_seconds", time.monotonic() - start)
+        self._update_gauges()
+
+        return conn
+
+    def _checkin(self, conn: ldap3.Connection, healthy: bool) -> None:
+        if healthy and not conn.closed:
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        else:
+            self._discard(conn)
+
+        self._slots.release()
+        self._update_gauges()
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[ldap3.Connection]:
+        """
+        Check out a connection for the duration of a `with` block.
+        """
+        conn = self._checkout()
+        healthy = False
+        try:
+            yield conn
+            healthy = True
+        finally:
+            self._checkin(conn, healthy)
+
+    def search(self, *args, **kwargs) -> list[Any]:
+        """
+        Perform a search and return the matching entries.
+
+        Arguments are passed through unmodified to `ldap3.Connection.search`.
+        Since connections do not raise exceptions for failed operations, a
+        search that fails with any other result than those in
+        `SEARCH_OK_RESULTS` raises one here, so that its connection is
+        discarded and the search is retried.
+        """
+        for attempt in (1, 2):
+            try:
+                with self.connection() as conn:
+                    if not conn.search(*args, **kwargs):
+                        result = conn.result or {}
+                        if result.get("result") not in SEARCH_OK_RESULTS:
+                            raise ldap3.core.exceptions.LDAPOperationResult(
+                                result=result.get("result"),
+                                description=result.get("description"),
+                                dn=result.get("dn"),
+                                message=result.get("message"),
+                                response_type=result.get("type"),
+                            )
+                    return list(conn.entries)
+            except ldap3.core.exceptions.LDAPException:
+                registry.metrics.incr("ldap_pool.failures")
+                if attempt == 2:
+                    raise
+                flask.current_app.logger.warning(
+                    "LDAP search failed, retrying with a new connection", exc_info=True
+                )
+        return []
+
+    def close(self) -> None:
+        """
+        Close all idle connections.
+        """
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            self._discard(conn)
+        self._update_gauges()
+
+
+def get_ldap_pool(app: Optional[flask.Flask] = None) -> LDAPConnectionPool:
+    """
+    Return the LDAP connection pool for the given (or current) application.
+    """
+    if not app:
+        app = flask.current_app._get_current_object()  # type: ignore[attr-defined]
+
+    with _extension_lock:
+        if EXTENSION_KEY not in app.extensions:
+            app.extensions[EXTENSION_KEY] = LDAPConnectionPool(
+                app.config["LDAP_URL"],
+                app.config["LDAP_USERNAME"],
+                app.config["LDAP_PASSWORD"],
+                size=int(app.config.get("LDAP_POOL_SIZE", DEFAULT_POOL_SIZE)),
+                idle_timeout=float(
+                    app.config.get("LDAP_POOL_IDLE_TIMEOUT", DEFAULT_IDLE_TIMEOUT)
+                ),
+                checkout_timeout=float(
+                    app.config.get("LDAP_POOL_CHECKOUT_TIMEOUT", DEFAULT_CHECKOUT_TIMEOUT)
+                ),
+            )
+        pool: LDAPConnectionPool = app.extensions[EXTENSION_KEY]
+
+    return pool
@@ -0,0 +1,83 @@
+"""
+Collect simple, in-process metrics.
+
+Metrics are kept per process. They are meant for spotting trends (e.g.,
+how long it takes to check out an LDAP connection), not for accounting.
+"""
+
+import dataclasses
+import threading
+from typing import Any, Union
+
+__all__ = [
+    "incr",
+    "observe",
+    "set_gauge",
+    "snapshot",
+]
+
+Number = Union[int, float]
+
+
+@dataclasses.dataclass
+class Timing:
+    """
+    Summarize a series of observed durations, in seconds.
+    """
+
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+
+_lock = threading.Lock()
+_counters: dict[str, Number] = {}
+_gauges: dict[str, Number] = {}
+_timings: dict[str, Timing] = {}
+
+
+def incr(name: str, value: Number = 1) -> None:
+    """
+    Increment a counter.
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: Number) -> None:
+    """
+    Record the current value of a gauge.
+    """
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, seconds: float) -> None:
+    """
+    Record one observed duration.
+    """
+    with _lock:
+        _timings.setdefault(name, Timing()).add(seconds)
+
+
+def snapshot() -> dict[str, Any]:
+    """
+    Return a copy of all metrics recorded so far by this process.
+    """
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "timings": {
+                name: {
+                    **dataclasses.asdict(t),
+                    "mean": (t.total / t.count) if t.count else 0.0,
+                }
+                for name, t in _timings.items()
+            },
+        }
@@ -2,41 +2,141 @@
 Process webhook payloads by submitting and monitoring HTCondor jobs.
 """
 
-import contextlib
+import dataclasses
+import math
 import os
 import pathlib
 import re
 import shlex
-import textwrap
-from typing import Optional, Union
+import threading
+from typing import Any, Optional, Union
 
 import classad  # type: ignore[import-not-found]  # pylint: disable=import-error
 import flask
 import htcondor  # type: ignore[import-not-found]  # pylint: disable=import-error
 
+import registry.clients
+import registry.database
 from registry.database import AccessKind, State, WebhookPayload
 
 __all__ = [
+    "Iteration",
+    "JobEventTracker",
+    #
     "finalize",
+    "finish_iteration",
+    "get_job_event_tracker",
     "process",
+    "start_iteration",
 ]
 
+# Expression for selecting every HTCondor job submitted for a payload.
+SOTERIA_JOBS_CONSTRAINT = "(FROM_SOTERIA =?= true)"
+
+# Job attributes needed to track the HTCondor job for a payload.
+JOB_PROJECTION = [
+    "ClusterId",
+    "ProcId",
+    "JobStatus",
+    "HoldReason",
+    "HoldReasonCode",
+    "HoldReasonSubCode",
+    "SOTERIA_ID",
+]
+
+# Apptainer command run by jobs, for each `APPTAINER_JOB_MODE`. "build"
+# converts the image to a SIF file without caching the result; "pull" also
+# stores the SIF file in Apptainer's cache, so it is reused across jobs.
+APPTAINER_COMMANDS = {
+    "build": "apptainer build",
+    "pull": "apptainer pull",
+}
+DEFAULT_APPTAINER_JOB_MODE = "build"
+
+# Defaults for the corresponding `HTCONDOR_REQUEST_*` configuration keys.
+DEFAULT_REQUEST_CPUS = "2"
+DEFAULT_REQUEST_MEMORY = "4G"
+DEFAULT_REQUEST_DISK = "50G"
+
+# Default for `HTCONDOR_SIZING_TIERS`. A job's resource requests come from
+# the first tier whose `max_image_size` is at least the image's compressed
+# size, or from the `HTCONDOR_REQUEST_*` keys if there is no such tier or
+# the size is not known.
+DEFAULT_SIZING_TIERS = [
+    {"max_image_size": "1G", "cpus": 1, "memory": "2G", "disk": "10G"},
+    {"max_image_size": "4G", "cpus": 2, "memory": "4G", "disk": "30G"},
+]
+
+# Defaults for escalating the memory request of jobs held for exceeding it.
+DEFAULT_MEMORY_ESCALATION_FACTOR = 2
+DEFAULT_MAX_REQUEST_MEMORY = "32G"
+
+# Defaults for the corresponding `SCHEDULER_*` configuration keys.
+DEFAULT_SMALL_IMAGE_SIZE = "1G"
+DEFAULT_SMALL_IMAGE_BOOST = 2.0
+DEFAULT_MAX_JOBS = 100
+DEFAULT_MAX_JOBS_PER_PROJECT = 0
+
+# HTCondor's hold reason code for a job that used more memory than requested.
+MEMORY_HOLD_REASON_CODE = 34
 
-@contextlib.contextmanager
-def local_chdir(path: Union[str, os.PathLike]):
+# Multipliers (relative to MiB) for the units accepted in resource requests.
+SIZE_UNITS = {"K": 2**-10, "M": 1, "G": 2**10, "T": 2**20}
+
+# Defaults for the corresponding `BUILD_CACHE_*` configuration keys.
+DEFAULT_BUILD_CACHE_TTL = 30 * 24 * 60 * 60
+DEFAULT_BUILD_CACHE_MAX_ENTRIES = 10000
+
+# Key in the database's metadata table for the job event log's read offset.
+EVENT_LOG_OFFSET_KEY = "htcondor.event_log.offset"
+
+
+@dataclasses.dataclass
+class Iteration:
     """
-    Temporarily change the current working directory.
+    State shared by all payloads processed in one iteration of the polling loop.
 
-    As a context manager: 'with local_chdir(path): ...'.
+    Payloads may be processed concurrently; `lock` guards `pending` and
+    `submitted`.
     """
-    oldcwd = os.getcwd()
-    try:
-        flask.current_app.logger.debug("os.chdir: %s", path)
-        os.chdir(path)
-        yield
-    finally:
-        flask.current_app.logger.debug("os.chdir: %s", oldcwd)
-        os.chdir(oldcwd)
+
+    schedd: htcondor.Schedd
+    jobs: dict[str, classad.ClassAd]  # keyed by SOTERIA_ID
+    pending: list[WebhookPayload] = dataclasses.field(default_factory=list)
+    submitted: int = 0  # number of jobs submitted
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+
+
+def start_iteration() -> Iteration:
+    """
+    Query the schedd once for every job that SOTERIA has submitted.
+    """
+    schedd = htcondor.Schedd()
+    ads = schedd.query(constraint=SOTERIA_JOBS_CONSTRAINT, projection=JOB_PROJECTION)
+    jobs = {
+        ad["SOTERIA_ID"]: ad
+        for ad in sorted(ads, key=lambda ad: (ad["ClusterId"], ad["ProcId"]))
+        if "SOTERIA_ID" in ad
+    }
+
+    flask.current_app.logger.debug("Found %s HTCondor jobs for SOTERIA", len(jobs))
+
+    return Iteration(schedd=schedd, jobs=jobs)
+
+
+def finish_iteration(iteration: Iteration) -> None:
+    """
+    Submit any jobs that were deferred until the end of the iteration.
+    """
+    if iteration.pending:
+        cluster_ad = submit_htcondor_jobs(iteration.pending, iteration.schedd)
+        flask.current_app.logger.info(
+            "Submitted HTCondor cluster for %s payloads:\n%s",
+            len(iteration.pending),
+            cluster_ad,
+        )
+        iteration.submitted += len(iteration.pending)
+        iteration.pending.clear()
 
 
 # --------------------------------------------------------------------------
@@ -69,6 +169,39 @@ def get_submit_dir(payload: WebhookPayload) -> pathlib.Path:
     return pathlib.Path(app.config["DATA_DIR"]) / "htcondor" / "jobs" / payload.id_
 
 
+def get_job_script(resource: str) -> str:
+    """
+    Return the contents of the executable script for an HTCondor job.
+
+    `resource` must already be quoted for the shell. The script's command
+    is chosen by `APPTAINER_JOB_MODE`, and it uses `APPTAINER_CACHEDIR` as
+    Apptainer's cache, if set. The cache directory is double-quoted, so that
+    shell variables in it are expanded on the execute node.
+    """
+    app = flask.current_app
+    mode = app.config.get("APPTAINER_JOB_MODE", DEFAULT_APPTAINER_JOB_MODE)
+    cache_dir = os.fspath(app.config.get("APPTAINER_CACHEDIR") or "")
+
+    if mode not in APPTAINER_COMMANDS:
+        raise ValueError(f"Invalid APPTAINER_JOB_MODE: {mode}")
+    if any(char in cache_dir for char in '"`\\'):
+        raise ValueError(f"Invalid APPTAINER_CACHEDIR: {cache_dir}")
+
+    lines = ["#!/bin/sh"]
+    if cache_dir:
+        lines += [
+            f'export APPTAINER_CACHEDIR="{cache_dir}"',
+            'mkdir -p "${APPTAINER_CACHEDIR}"',
+        ]
+    lines += [
+        f"{APPTAINER_COMMANDS[mode]} image.sif docker://{resource}",
+        "status=$?",
+        "rm -f image.sif",
+        "exit ${status}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
 def write_job_executable(
     payload: WebhookPayload,
     target_dir: pathlib.Path,
@@ -76,38 +209,263 @@ def write_job_executable(
     """
     Write the executable script for the given payload's HTCondor job.
     """
-    resource = shlex.quote(payload.resource)
     exe_file = target_dir / "run.sh"
-    with open(exe_file, mode="w", encoding="utf-8") as fp:
-        print(
-            textwrap.dedent(
-                f"""\
-                #!/bin/sh
-                apptainer build image.sif docker://{resource}
-                status=$?
-                rm -f image.sif
-                exit ${{status}}
-                """
-            ),
-            file=fp,
-        )
+    exe_file.write_text(get_job_script(shlex.quote(payload.resource)), encoding="utf-8")
     exe_file.chmod(0o755)
     return exe_file
 
 
+def write_shared_job_executable() -> pathlib.Path:
+    """
+    Write the executable script shared by jobs submitted in batches.
+
+    The script takes the resource to process as its only argument.
+    """
+    app = flask.current_app
+    exe_file = pathlib.Path(app.config["DATA_DIR"]) / "htcondor" / "run.sh"
+    contents = get_job_script('"$1"')
+    if not exe_file.exists() or exe_file.read_text(encoding="utf-8") != contents:
+        exe_file.parent.mkdir(parents=True, exist_ok=True)
+        exe_file.write_text(contents, encoding="utf-8")
+        exe_file.chmod(0o755)
+    return exe_file
+
+
+def get_job_attributes(exe_name: str) -> dict[str, Any]:
+    """
+    Return the submit commands common to every job.
+    """
+    return {
+        "leave_in_queue": "(JobStatus == 4) && ((StageOutFinish =?= UNDEFINED) || (StageOutFinish == 0))",
+        "on_exit_hold": "(ExitCode != 0)",
+        #
+        "log": f"{exe_name}.log",
+        "output": f"{exe_name}.out",
+        "error": f"{exe_name}.err",
+    }
+
+
+def parse_size(value: Union[int, str]) -> int:
+    """
+    Convert a size such as "4G" to MiB. Sizes without a unit are in MiB.
+    """
+    value = str(value).strip().upper().removesuffix("B").removesuffix("I")
+
+    if value and value[-1] in SIZE_UNITS:
+        return math.ceil(float(value[:-1]) * SIZE_UNITS[value[-1]])
+    return math.ceil(float(value))
+
+
+def get_image_size(payload: WebhookPayload) -> Optional[int]:
+    """
+    Return the compressed size (in bytes) of a payload's image, if known.
+
+    The size is taken from the webhook payload if it was included there, or
+    else from Harbor's artifact API.
+    """
+    if payload.image_size is not None:
+        return payload.image_size
+
+    app = flask.current_app
+    reference = payload.digest or payload.tag
+
+    try:
+        response = registry.clients.get_admin_harbor_api().get_artifact(
+            payload.project, payload.repository, reference
+        )
+        if response.ok:
+            size: Optional[int] = response.json().get("size")
+            return size
+        app.logger.warning("Failed to get artifact for %s: %s", payload.resource, response.text)
+    except Exception:  # pylint: disable=broad-except
+        app.logger.warning("Failed to get artifact for %s", payload.resource, exc_info=True)
+
+    return None
+
+
+def set_job_resources(payload: WebhookPayload) -> None:
+    """
+    Choose the resource requests for a payload's job, if not already chosen.
+
+    The requests are chosen from the image's size by the sizing policy and
+    are recorded in the database.
+    """
+    if payload.request_memory is not None:
+        return
+
+    app = flask.current_app
+    tiers = app.config.get("HTCONDOR_SIZING_TIERS", DEFAULT_SIZING_TIERS)
+    payload.image_size = get_image_size(payload)
+
+    resources = {
+        "cpus": app.config.get("HTCONDOR_REQUEST_CPUS", DEFAULT_REQUEST_CPUS),
+        "memory": app.config.get("HTCONDOR_REQUEST_MEMORY", DEFAULT_REQUEST_MEMORY),
+        "disk": app.config.get("HTCONDOR_REQUEST_DISK", DEFAULT_REQUEST_DISK),
+    }
+
+    if payload.image_size is not None:
+        size = payload.image_size / 2**20
+        for tier in tiers:
+            if size <= parse_size(tier["max_image_size"]):
+                resources = tier
+                break
+
+    payload.request_cpus = int(resources["cpus"])
+    payload.request_memory = parse_size(resources["memory"])
+    payload.request_disk = parse_size(resources["disk"])
+
+    registry.database.set_payload_resources(payload)
+
+
+def get_job_resources(payload: WebhookPayload) -> dict[str, str]:
+    """
+    Return the submit commands for a payload's resource requests.
+    """
+    set_job_resources(payload)
+
+    return {
+        "request_cpus": str(payload.request_cpus),
+        "request_memory": f"{payload.request_memory}M",
+        "request_disk": f"{payload.request_disk}M",
+    }
+
+
+def get_small_image_policy() -> tuple[int, float]:
+    """
+    Return the largest size (in bytes) of a "small" image, and the factor by
+    which small images' scheduling weights are multiplied.
+    """
+    app = flask.current_app
+    size = parse_size(app.config.get("SCHEDULER_SMALL_IMAGE_SIZE", DEFAULT_SMALL_IMAGE_SIZE))
+    boost = float(app.config.get("SCHEDULER_SMALL_IMAGE_BOOST", DEFAULT_SMALL_IMAGE_BOOST))
+    return size * 2**20, boost
+
+
+def get_job_limits() -> tuple[int, int]:
+    """
+    Return the largest number of payloads that may have jobs at once, in
+    total and for each project (0 means no limit).
+    """
+    app = flask.current_app
+    max_jobs = int(app.config.get("SCHEDULER_MAX_JOBS", DEFAULT_MAX_JOBS))
+    max_jobs_per_project = int(
+        app.config.get("SCHEDULER_MAX_JOBS_PER_PROJECT", DEFAULT_MAX_JOBS_PER_PROJECT)
+    )
+    return max_jobs, max_jobs_per_project
+
+
+def get_job_scheduling(payload: WebhookPayload) -> dict[str, str]:
+    """
+    Return the submit commands for a payload's priority and accounting group.
+
+    The job's priority is 10 * log2 of the payload's scheduling weight, so
+    payloads with the default weight have the default priority (0). If
+    `HTCONDOR_ACCOUNTING_GROUP` is set, each project is a separate user in
+    that group, so the negotiator shares the pool fairly among projects.
+    """
+    app = flask.current_app
+    small_image_size, small_image_boost = get_small_image_policy()
+    weight = registry.database.get_project_weight(payload.project)
+
+    if payload.image_size is not None and payload.image_size <= small_image_size:
+        weight *= small_image_boost
+
+    commands = {"priority": str(round(10 * math.log2(weight)) if weight > 0 else 0)}
+
+    if group := app.config.get("HTCONDOR_ACCOUNTING_GROUP"):
+        commands["accounting_group"] = group
+        commands["accounting_group_user"] = payload.project
+
+    return commands
+
+
+def escalate_job_resources(
+    payload: WebhookPayload,
+    job_ad: classad.ClassAd,
+    schedd: htcondor.Schedd,
+) -> bool:
+    """
+    Handle a job that was held for exceeding its memory request.
+
+    If the payload's memory request can still be raised, the job is removed,
+    the raised request is recorded, and True is returned so that the payload
+    is submitted again.
+    """
+    app = flask.current_app
+
+    if job_ad.get("JobStatus") != htcondor.JobStatus.HELD:
+        return False
+    if job_ad.get("HoldReasonCode") != MEMORY_HOLD_REASON_CODE:
+        return False
+
+    set_job_resources(payload)
+
+    factor = float(
+        app.config.get("HTCONDOR_MEMORY_ESCALATION_FACTOR", DEFAULT_MEMORY_ESCALATION_FACTOR)
+    )
+    limit = parse_size(
+        app.config.get("HTCONDOR_MAX_REQUEST_MEMORY", DEFAULT_MAX_REQUEST_MEMORY)
+    )
+    memory = payload.request_memory or 0
+
+    if memory >= limit or factor <= 1:
+        return False
+
+    payload.request_memory = min(math.ceil(memory * factor), limit)
+
+    schedd.act(htcondor.JobAction.Remove, get_job_constraint(job_ad))
+    registry.database.set_payload_jobs([(payload.id_, None, None)])
+    registry.database.set_payload_resources(payload)
+    registry.database.incr_counter("jobs.memory_escalations")
+
+    app.logger.info(
+        "Resubmitting %s with %s MiB of memory after job %s.%s was held",
+        payload.resource,
+        payload.request_memory,
+        job_ad["ClusterId"],
+        job_ad["ProcId"],
+    )
+
+    return True
+
+
 # --------------------------------------------------------------------------
 
 
-def get_htcondor_job(payload: WebhookPayload) -> Optional[classad.ClassAd]:
+def get_htcondor_job(
+    payload: WebhookPayload, iteration: Iteration
+) -> Optional[classad.ClassAd]:
     """
     Return the HTCondor job in the queue for the given payload.
+
+    If the payload has had a job submitted for it since the iteration began
+    (e.g., by another instance of the polling loop, or after its previous
+    job was removed), the schedd is queried for that job specifically.
     """
-    schedd = htcondor.Schedd()
-    ads = schedd.query(constraint=get_soteria_constraint(payload=payload))
+    job = iteration.jobs.get(payload.id_)
+
+    if payload.cluster_id is None:
+        return job
+    if job and (job["ClusterId"], job["ProcId"]) == (payload.cluster_id, payload.proc_id):
+        return job
+
+    ads = iteration.schedd.query(
+        constraint=get_job_constraint(
+            {"ClusterId": payload.cluster_id, "ProcId": payload.proc_id}
+        ),
+        projection=JOB_PROJECTION,
+    )
     return ads[0] if ads else None
 
 
-def submit_htcondor_job(payload: WebhookPayload) -> classad.ClassAd:
+def get_job_constraint(job_ad: classad.ClassAd) -> str:
+    """
+    Return the expression for selecting exactly the given HTCondor job.
+    """
+    return f"(ClusterId == {job_ad['ClusterId']}) && (ProcId == {job_ad['ProcId']})"
+
+
+def submit_htcondor_job(payload: WebhookPayload, schedd: htcondor.Schedd) -> classad.ClassAd:
     """
     Prepare and submit an HTCondor job for the given payload.
     """
@@ -115,10 +473,10 @@ def submit_htcondor_job(payload: WebhookPayload) -> classad.ClassAd:
     submit_dir.mkdir(parents=True, exist_ok=True)
     job_exe = write_job_executable(payload, submit_dir)
 
-    schedd = htcondor.Schedd()
     job = htcondor.Submit(
         {
-            "executable": job_exe.name,
+            "executable": os.fspath(job_exe),
+            "initialdir": os.fspath(submit_dir),
             #
             "My.FROM_SOTERIA": True,
             "My.SOTERIA_ID": classad.quote(payload.id_),
@@ -127,29 +485,93 @@ def submit_htcondor_job(payload: WebhookPayload) -> classad.ClassAd:
             "My.SOTERIA_REPOSITORY": classad.quote(payload.repository),
             "My.SOTERIA_TAG": classad.quote(payload.tag),
             #
-            "request_cpus": "2",
-            "request_memory": "4G",
-            "request_disk": "50G",
+            **get_job_resources(payload),
+            **get_job_scheduling(payload),
+            **get_job_attributes(job_exe.name),
+        }
+    )
+    result = schedd.submit(job, spool=True)
+    schedd.spool(list(job.jobs(clusterid=result.cluster())))
+    registry.database.set_payload_jobs([(payload.id_, result.cluster(), 0)])
+    return result.clusterad()
+
+
+def submit_htcondor_jobs(
+    payloads: list[WebhookPayload],
+    schedd: htcondor.Schedd,
+) -> classad.ClassAd:
+    """
+    Prepare and submit HTCondor jobs for the given payloads as one cluster.
+
+    Each payload becomes one proc of the cluster, with its own submit
+    directory and `SOTERIA_*` attributes. All procs share one executable,
+    and their input files are spooled in a single call.
+    """
+    app = flask.current_app
+    job_exe = write_shared_job_executable()
+
+    itemdata = []
+    for payload in payloads:
+        submit_dir = get_submit_dir(payload)
+        submit_dir.mkdir(parents=True, exist_ok=True)
+        resources = get_job_resources(payload)
+        scheduling = get_job_scheduling(payload)
+        itemdata.append(
+            {
+                "soteria_request_cpus": resources["request_cpus"],
+                "soteria_request_memory": resources["request_memory"],
+                "soteria_request_disk": resources["request_disk"],
+                "soteria_priority": scheduling["priority"],
+                "soteria_id": payload.id_,
+                "soteria_resource": payload.resource,
+                "soteria_project": payload.project,
+                "soteria_repository": payload.repository,
+                "soteria_tag": payload.tag,
+                "submit_dir": os.fspath(submit_dir),
+            }
+        )
+
+    accounting = {}
+    if group := app.config.get("HTCONDOR_ACCOUNTING_GROUP"):
+        accounting = {
+            "accounting_group": group,
+            "accounting_group_user": "$(soteria_project)",
+        }
+
+    job = htcondor.Submit(
+        {
+            "executable": os.fspath(job_exe),
+            "arguments": "$(soteria_resource)",
+            "initialdir": "$(submit_dir)",
+            #
+            "My.FROM_SOTERIA": True,
+            "My.SOTERIA_ID": '"$(soteria_id)"',
+            "My.SOTERIA_RESOURCE": '"$(soteria_resource)"',
+            "My.SOTERIA_PROJECT": '"$(soteria_project)"',
+            "My.SOTERIA_REPOSITORY": '"$(soteria_repository)"',
+            "My.SOTERIA_TAG": '"$(soteria_tag)"',
             #
-            "leave_in_queue": "(JobStatus == 4) && ((StageOutFinish =?= UNDEFINED) || (StageOutFinish == 0))",
-            "on_exit_hold": "(ExitCode != 0)",
+            "request_cpus": "$(soteria_request_cpus)",
+            "request_memory": "$(soteria_request_memory)",
+            "request_disk": "$(soteria_request_disk)",
+            "priority": "$(soteria_priority)",
+            **accounting,
             #
-            "log": f"{job_exe.name}.log",
-            "output": f"{job_exe.name}.out",
-            "error": f"{job_exe.name}.err",
+            **get_job_attributes(job_exe.name),
         }
     )
-    with local_chdir(submit_dir):
-        result = schedd.submit(job, spool=True)
-        schedd.spool(list(job.jobs(clusterid=result.cluster())))
+    result = schedd.submit(job, spool=True, itemdata=iter(itemdata))
+    schedd.spool(list(job.jobs(clusterid=result.cluster(), itemdata=iter(itemdata))))
+    registry.database.set_payload_jobs(
+        (payload.id_, result.cluster(), proc_id) for proc_id, payload in enumerate(payloads)
+    )
     return result.clusterad()
 
 
-def update_htcondor_job(job_ad: classad.ClassAd) -> Optional[State]:
+def update_htcondor_job(job_ad: classad.ClassAd, schedd: htcondor.Schedd) -> Optional[State]:
     """
     Determine the current state of the given HTCondor job.
     """
-    schedd = htcondor.Schedd()
     status = htcondor.JobStatus(job_ad["JobStatus"])
 
     if status in [htcondor.JobStatus.HELD, htcondor.JobStatus.REMOVED]:
@@ -162,15 +584,105 @@ def update_htcondor_job(job_ad: classad.ClassAd) -> Optional[State]:
     return None
 
 
+def get_event_state(event: htcondor.JobEvent) -> Optional[State]:
+    """
+    Determine the state of a payload implied by an event for its job.
+    """
+    if event.type == htcondor.JobEventType.JOB_TERMINATED:
+        if event.get("TerminatedNormally") and event.get("ReturnValue") == 0:
+            return State.completed
+
+        # Otherwise, the job's `on_exit_hold` expression will hold it.
+
+    if event.type == htcondor.JobEventType.JOB_HELD:
+        # The polling loop may resubmit the job with a larger memory request.
+        if event.get("HoldReasonCode") == MEMORY_HOLD_REASON_CODE:
+            return None
+        return State.failed
+
+    if event.type == htcondor.JobEventType.JOB_ABORTED:
+        return State.failed
+
+    return None
+
+
+class JobEventTracker:
+    """
+    Follow a job event log to learn when payloads' jobs finish.
+
+    The log is read incrementally, starting from the offset recorded in the
+    database by the previous call to `commit`.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        self._path = pathlib.Path(path)
+        self._offset: Optional[int] = None
+
+    def read(self) -> list[tuple[WebhookPayload, State]]:
+        """
+        Return the payloads whose states are changed by new events.
+
+        The output of completed jobs is retrieved from the schedd before
+        their payloads are returned.
+        """
+        if not self._path.exists():
+            return []
+
+        offset = int(registry.database.get_metadata(EVENT_LOG_OFFSET_KEY) or 0)
+
+        if offset > self._path.stat().st_size:  # the log has been rotated
+            offset = 0
+
+        updates = []
+        schedd = None
+
+        with htcondor.JobEventLog(os.fspath(self._path)) as jel:
+            jel.set_offset(offset)
+
+            for event in jel.events(stop_after=0):
+                if not (new_state := get_event_state(event)):
+                    continue
+
+                payload = registry.database.get_payload_for_job(event.cluster, event.proc)
+
+                if not payload or payload.state != State.new:
+                    continue
+
+                if new_state == State.completed:
+                    schedd = schedd or htcondor.Schedd()
+                    schedd.retrieve(get_soteria_constraint(payload=payload))
+
+                updates.append((payload, new_state))
+
+            self._offset = jel.get_offset()
+
+        return updates
+
+    def commit(self) -> None:
+        """
+        Record that the events returned by `read` have been handled.
+        """
+        if self._offset is not None:
+            registry.database.set_metadata(EVENT_LOG_OFFSET_KEY, str(self._offset))
+            self._offset = None
+
+
+def get_job_event_tracker() -> Optional[JobEventTracker]:
+    """
+    Return a tracker for the configured job event log, if there is one.
+    """
+    path = flask.current_app.config.get("HTCONDOR_EVENT_LOG")
+    return JobEventTracker(path) if path else None
+
+
 # --------------------------------------------------------------------------
 
 
-def process(payload: WebhookPayload) -> Optional[State]:
+def process(payload: WebhookPayload, iteration: Iteration) -> Optional[State]:
     """
     Determine what to do with a payload, and return its new state.
     """
     app = flask.current_app
-    new_state = None
 
     if payload.access_kind != AccessKind.public_and_tagged:
         return State.skipped
@@ -178,17 +690,63 @@ def process(payload: WebhookPayload) -> Optional[State]:
     if not re.match(app.config["WEBHOOKS_HARBOR_RESOURCE_REGEX"], payload.resource):
         return State.skipped
 
-    if job := get_htcondor_job(payload):
-        new_state = update_htcondor_job(job)
+    if job := get_htcondor_job(payload, iteration):
+        if not escalate_job_resources(payload, job, iteration.schedd):
+            return update_htcondor_job(job, iteration.schedd)
+    elif has_build_result(payload):
+        app.logger.info(
+            "Image for %s was already built as %s", payload.resource, payload.digest
+        )
+        if payload.cluster_id is not None:
+            # The payload's previous job has left the queue without building it.
+            registry.database.set_payload_jobs([(payload.id_, None, None)])
+            payload.cluster_id = payload.proc_id = None
+        return State.completed
+
+    if app.config.get("HTCONDOR_BATCH_SUBMIT"):
+        with iteration.lock:
+            iteration.pending.append(payload)
     else:
-        cluster_ad = submit_htcondor_job(payload)
+        cluster_ad = submit_htcondor_job(payload, iteration.schedd)
+        with iteration.lock:
+            iteration.submitted += 1
         app.logger.info(f"Submitted HTCondor cluster:\n{cluster_ad}")
 
-    return new_state
+    return None
 
 
-def finalize(_: WebhookPayload) -> None:
+def has_build_result(payload: WebhookPayload) -> bool:
     """
-    Perform any final actions for a 'completed' payload.
+    Determine whether the image for a payload's digest was already built.
     """
-    # NOTE (baydemir): Nothing to do, yet?
+    ttl = int(flask.current_app.config.get("BUILD_CACHE_TTL", DEFAULT_BUILD_CACHE_TTL))
+
+    if not payload.digest or ttl <= 0:
+        return False
+
+    if registry.database.get_build_result(payload.digest, ttl):
+        registry.database.incr_counter("build_cache.hits")
+        return True
+
+    registry.database.incr_counter("build_cache.misses")
+    return False
+
+
+def finalize(payload: WebhookPayload, state: State) -> None:
+    """
+    Perform any final actions for a payload that has reached a final state.
+
+    A build result is recorded only if the payload's own job built its
+    image, and not if it was completed by a build-cache hit or because it
+    was coalesced into another payload.
+    """
+    app = flask.current_app
+    ttl = int(app.config.get("BUILD_CACHE_TTL", DEFAULT_BUILD_CACHE_TTL))
+    built = state == State.completed and payload.cluster_id is not None
+
+    if built and payload.digest and ttl > 0:
+        registry.database.record_build_result(
+            payload,
+            ttl,
+            int(app.config.get("BUILD_CACHE_MAX_ENTRIES", DEFAULT_BUILD_CACHE_MAX_ENTRIES)),
+        )
@@ -16,14 +16,19 @@ def public_projects():
     return flask.render_template("/public/projects.html")
 
 
+@bp.route("/search")
+def public_search():
+    return flask.render_template("/public/search.html", q=flask.request.args.get("q", ""))
+
+
 @bp.route("/projects/<project>/repositories")
 def public_project_repositories(project: str):
     return flask.render_template("/public/repositories.html", project=project)
 
-@bp.route("/projects/<project>/repositories/<repository>/tags")
+@bp.route("/projects/<project>/repositories/<path:repository>/tags")
 def public_project_repository_tags(project: str, repository: str):
     return flask.render_template("/public/tags.html", project=project, repository=repository)
 
-@bp.route("/projects/<project>/repositories/<repository>/tags/<tag>")
+@bp.route("/projects/<project>/repositories/<path:repository>/tags/<tag>")
 def public_project_repository_image(project: str, repository: str, tag: str):
     return flask.render_template("/public/image.html", project=project, repository=repository, tag=tag)
\ No newline at end of file
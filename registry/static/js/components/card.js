@@ -272,3 +272,51 @@ export const TagCard = ({
         )
     )
 }
+
+export const SearchResultCard = ({
+  project,
+  repository,
+  description,
+  update_time,
+  tags
+}) => {
+    let localeUpdateTime = new Date(Date.parse(update_time)).toLocaleString("en-US")
+
+    // The repository's name within its project may itself contain "/".
+    let href = `/public/projects/${encodeURIComponent(project)}/repositories/${encodeURIComponent(repository)}/tags`
+
+    return (
+        h("a", {href: href, className:"text-decoration-none"},
+            h(
+                ImageCard,
+                {src: "/static/images/icons/Repo_Icon.svg", alt: "Repository Graphic", className: "project-card  mb-1 mb-sm-2 p-3 rounded bg-light"},
+                h("div", {className: "description"}, ...[
+                    h("div", {className: "row gx-2"}, ...[
+                        h("h4", {className: "col-12 col-md-auto fw-bold mb-1"}, `${project}/${repository}`),
+                    ]),
+                    ... description ? [h("div", {className: "row gx-2 text-truncate"}, ...[
+                        h("p", {className: "col-12 mb-1"}, description),
+                    ])] : [],
+                    h("div", {className: "row gx-2"}, ...[
+                        ... update_time ? [h(ImageTextRow, {
+                            className: "col-auto",
+                            src: "/static/images/icons/clock-history.svg",
+                            alt: "Clock Graphic",
+                            tag: "h6",
+                            text: `Updated ${localeUpdateTime}`
+                        })] : [],
+                    ]),
+                    h("div", {className: "row gx-2  text-truncate"}, ...[
+                        ... tags.length ? [h(ImageTextRow, {
+                            className: "col-auto",
+                            src: "/static/images/icons/tags.svg",
+                            alt: "Tags Graphic",
+                            tag: "h6",
+                            text: `Tags: ${tags.map(x => x.name).join(", ")}`
+                        })] : [],
+                    ])
+                ])
+            )
+        )
+    )
+}
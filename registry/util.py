@@ -2,21 +2,26 @@
 Assorted helper functions.
 """
 
+import concurrent.futures
+import dataclasses
 import datetime
+import itertools
+import json
 import logging
 import logging.config
 import logging.handlers
 import pathlib
 import re
-from typing import Any, Literal, Optional
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any, Literal, Optional, TypeVar
 
 import flask
-import ldap3  # type: ignore[import]
 
-import registry.comanage
-import registry.freshdesk
+import registry.database
 import registry.harbor
+import registry.ldap_pool
 from registry.cache import cache
+from registry.clients import get_admin_comanage_api, get_admin_harbor_api
 from registry.harbor import GIBIBYTE, Harbor, HarborRoleID
 
 __all__ = [
@@ -25,15 +30,13 @@ __all__ = [
     "get_comanage_groups",
     "get_harbor_user",
     "get_idp_name",
+    "get_ldap_identity",
     "get_orcid_id",
     "get_starter_project_name",
     "has_organizational_identity",
     "is_soteria_affiliate",
     "is_soteria_member",
     "is_soteria_researcher",
-    #
-    "get_admin_harbor_api",
-    "get_freshdesk_api",
 ]
 
 LOG_FORMAT = "[%(asctime)s] %(levelname)s %(module)s:%(lineno)d %(message)s"
@@ -41,6 +44,12 @@ LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 LOG_MAX_BYTES = 10 * 1024 * 1024
 LOG_BACKUP_COUNT = 4  # plus the current log file -> 50 MiB total, by default
 
+# Number of seconds for which a Harbor project's details may be cached.
+HARBOR_PROJECT_CACHE_TIMEOUT = 30
+
+T = TypeVar("T")
+R = TypeVar("R")
+
 
 def configure_logging(filename: pathlib.Path) -> None:
     filename.parent.mkdir(parents=True, exist_ok=True)
@@ -77,6 +86,61 @@ def configure_logging(filename: pathlib.Path) -> None:
     )
 
 
+def map_concurrently(fn: Callable[[T], R], items: Iterable[T]) -> list[R]:
+    """
+    Applies `fn` to each item using a bounded pool of threads.
+
+    Each call runs inside the current application's context. The results
+    are returned in the same order as the items.
+    """
+    app = flask.current_app._get_current_object()  # type: ignore[attr-defined]
+    max_workers = int(
+        app.config.get("HARBOR_API_MAX_WORKERS", registry.harbor.DEFAULT_MAX_WORKERS)
+    )
+
+    def call(item: T) -> R:
+        with app.app_context():
+            return fn(item)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        return list(executor.map(call, items))
+
+
+def iter_json_array(items: Iterable[Any]) -> Iterator[str]:
+    """
+    Serializes items as a JSON array, one item at a time.
+
+    Each item is encoded as soon as it is produced, so that a collection
+    (e.g., one of `HarborAPI`'s paginated generators) can be written out
+    without first being collected into a list.
+    """
+    separator = "["
+
+    for item in items:
+        yield separator + json.dumps(item)
+        separator = ","
+
+    yield "[]" if separator == "[" else "]"
+
+
+def stream_json_array(items: Iterable[Any]) -> flask.Response:
+    """
+    Returns a response that streams items to the client as a JSON array.
+
+    The first item is retrieved before the response is created, so that an
+    error in retrieving it (e.g., in requesting the first page of a Harbor
+    collection) is raised here, while a proper error response can still be
+    sent. An error after that aborts the response mid-stream.
+    """
+    items = iter(items)
+    first = list(itertools.islice(items, 1))
+
+    return flask.Response(
+        flask.stream_with_context(iter_json_array(itertools.chain(first, items))),
+        mimetype="application/json",
+    )
+
+
 #
 # --------------------------------------------------------------------------
 #
@@ -91,49 +155,74 @@ def update_request_environ() -> None:
         flask.request.environ.update(mock_oidc_claim)
 
 
-@cache.memoize(timeout=10)
-def get_comanage_groups():
+@dataclasses.dataclass
+class LDAPIdentity:
     """
-    Returns a list of the current user's groups in COmanage.
+    The current user's attributes, as recorded in LDAP.
+    """
+
+    groups: list[str] = dataclasses.field(default_factory=list)
+    orcid_id: Optional[str] = None
+
+
+def query_ldap_identity(sub: str) -> LDAPIdentity:
+    """
+    Queries LDAP for the attributes of the user with the given `sub`.
+    """
+    identity = LDAPIdentity()
+
+    entries = registry.ldap_pool.get_ldap_pool().search(
+        flask.current_app.config["LDAP_BASE_DN"],
+        f"(&(objectClass=inetOrgPerson)(uid={sub}))",
+        attributes=["isMemberOf", "eduPersonOrcid"],
+    )
+
+    if len(entries) == 1:
+        attrs = entries[0].entry_attributes_as_dict
+        orcid = attrs.get("eduPersonOrcid", [])
 
-    Queries LDAP to ensure that the list is up to date.
+        identity.groups = list(attrs.get("isMemberOf", []))
+        identity.orcid_id = orcid[0] if len(orcid) != 0 else None
+    else:
+        flask.current_app.logger.error(
+            "Found %s entries for the sub: %s",
+            len(entries),
+            sub,
+        )
+
+    return identity
+
+
+def get_ldap_identity() -> LDAPIdentity:
+    """
+    Returns the current user's attributes from LDAP.
+
+    LDAP is queried at most once per request. The result is stored on
+    `flask.g` so that every helper that needs it shares the same lookup.
     """
     update_request_environ()
 
-    groups = []
-    sub = flask.request.environ.get("OIDC_CLAIM_sub")
-
-    if sub:
-        ldap_url = flask.current_app.config["LDAP_URL"]
-        ldap_username = flask.current_app.config["LDAP_USERNAME"]
-        ldap_password = flask.current_app.config["LDAP_PASSWORD"]
-        ldap_base_dn = flask.current_app.config["LDAP_BASE_DN"]
-
-        server = ldap3.Server(ldap_url, get_info=ldap3.ALL)
-
-        with ldap3.Connection(server, ldap_username, ldap_password) as conn:
-            conn.search(
-                ldap_base_dn,
-                f"(&(objectClass=inetOrgPerson)(uid={sub}))",
-                attributes=["*"],
-            )
-
-            if len(conn.entries) == 1:
-                groups = conn.entries[0].entry_attributes_as_dict["isMemberOf"]
-            else:
-                flask.current_app.logger.error(
-                    "Found %s entries for the sub: %s",
-                    len(conn.entries),
-                    sub,
-                )
+    if "ldap_identity" not in flask.g:
+        sub = flask.request.environ.get("OIDC_CLAIM_sub")
 
-    flask.current_app.logger.debug(
-        "Found the following groups for %s: %s",
-        sub,
-        groups,
-    )
+        flask.g.ldap_identity = query_ldap_identity(sub) if sub else LDAPIdentity()
 
-    return groups
+        flask.current_app.logger.debug(
+            "Found the following groups for %s: %s",
+            sub,
+            flask.g.ldap_identity.groups,
+        )
+
+    return flask.g.ldap_identity
+
+
+def get_comanage_groups():
+    """
+    Returns a list of the current user's groups in COmanage.
+
+    Queries LDAP (once per request) to ensure that the list is up to date.
+    """
+    return get_ldap_identity().groups
 
 
 def get_coperson_id():
@@ -160,7 +249,11 @@ def get_subiss() -> Optional[str]:
 def get_harbor_user():
     """
     Returns the current user's Harbor account.
+
+    The result is stored on `flask.g` for the remainder of the request.
     """
+    if "harbor_user" in flask.g:
+        return flask.g.harbor_user
 
     harbor_user = None
 
@@ -180,22 +273,124 @@ def get_harbor_user():
     if not harbor_user and subiss:
         harbor_user = get_harbor_user_by_subiss(subiss)
 
+    flask.g.harbor_user = harbor_user
+
     return harbor_user
 
 
-@cache.memoize()
-def get_harbor_user_by_subiss(subiss: str) -> Any:
+def forget_harbor_user() -> None:
+    """
+    Discards the current request's copy of the user's Harbor account.
+    """
+    flask.g.pop("harbor_user", None)
+
+
+# Key in the database's metadata table for the newest indexed Harbor user.
+HARBOR_USERS_WATERMARK = "harbor_users.creation_time"
+
+
+def get_harbor_user_index_entry(user: dict[str, Any]) -> Optional[dict[str, Any]]:
+    """
+    Returns the row for the index of Harbor users for the given user.
+    """
+    subiss = user.get("oidc_user_meta", {}).get("subiss", "")
+
+    if not subiss:
+        return None
+
+    return {
+        "subiss": subiss,
+        "user_id": user["user_id"],
+        "username": user.get("username"),
+        "creation_time": user.get("creation_time"),
+    }
+
+
+def refresh_harbor_user_index(full: bool = False) -> int:
+    """
+    Adds Harbor users created since the last refresh to the local index.
+
+    Harbor's user list does not include the "subiss", so each user's full
+    profile is fetched. Only users created at or after the newest user seen
+    by the previous refresh are considered, unless `full` is set. Returns
+    the number of users that were (re)indexed.
+    """
+    api = get_admin_harbor_api()
+
+    # Harbor's timestamps have a variable number of fractional digits, so
+    # compare them only to the second. Users created in the same second as
+    # the watermark are simply indexed again.
+
+    watermark = None if full else registry.database.get_metadata(HARBOR_USERS_WATERMARK)
+    newest = watermark or ""
+    entries = []
+
+    for user in api.get_all_users(params={"sort": "-creation_time"}):
+        creation_time = (user.get("creation_time") or "")[:19]
+
+        if watermark and creation_time < watermark:
+            break
+
+        full_data = api.get_user(user["user_id"])
+
+        if entry := get_harbor_user_index_entry(full_data):
+            entries.append(entry)
+        newest = max(newest, creation_time)
+
+    registry.database.upsert_harbor_users(entries)
+
+    if newest:
+        registry.database.set_metadata(HARBOR_USERS_WATERMARK, newest)
+
+    flask.current_app.logger.debug("Indexed %s Harbor users", len(entries))
+
+    return len(entries)
+
+
+def scan_harbor_users_for_subiss(subiss: str) -> Any:
+    """
+    Returns the Harbor user with the given "subiss" by checking every user.
+
+    This requires one API call per user and should be used only when the
+    local index of Harbor users is known to be out of date.
+    """
     api = get_admin_harbor_api()
 
     for user in api.get_all_users(params={"sort": "-creation_time"}):
         full_data = api.get_user(user["user_id"])
 
         if full_data.get("oidc_user_meta", {}).get("subiss", "") == subiss:
+            if entry := get_harbor_user_index_entry(full_data):
+                registry.database.upsert_harbor_users([entry])
             return full_data
 
     return None
 
 
+@cache.memoize()
+def get_harbor_user_by_subiss(subiss: str) -> Any:
+    api = get_admin_harbor_api()
+
+    user_id = registry.database.get_harbor_user_id(subiss)
+
+    if user_id is None:
+        refresh_harbor_user_index()
+        user_id = registry.database.get_harbor_user_id(subiss)
+
+        if user_id is None:
+            return None
+
+    full_data = api.get_user(user_id)
+
+    if full_data.get("oidc_user_meta", {}).get("subiss", "") == subiss:
+        return full_data
+
+    flask.current_app.logger.warning("Index of Harbor users is stale for: %s", subiss)
+    registry.database.delete_harbor_user(subiss)
+
+    return scan_harbor_users_for_subiss(subiss)
+
+
 def get_harbor_projects(
     owner: bool = False,
     maintainer: bool = False,
@@ -206,7 +401,6 @@ def get_harbor_projects(
     """Returns the users harbor projects - O(n)"""
 
     comanage_api = registry.util.get_admin_comanage_api()
-    harbor_api = registry.util.get_admin_harbor_api()
 
     coperson_id = registry.util.get_coperson_id()
 
@@ -237,14 +431,21 @@ def get_harbor_projects(
                 project_names.add(pattern.match(group_name).group(1))
                 break
 
-    projects = []
-    for project_name in project_names:
-        data = harbor_api.get_project(project_name).json()
-        summary = harbor_api.get_project_summary(project_name).json()
-        data["quota"] = summary["quota"]
-        projects.append(data)
+    return map_concurrently(get_harbor_project_with_quota, sorted(project_names))
+
+
+@cache.memoize(timeout=HARBOR_PROJECT_CACHE_TIMEOUT)
+def get_harbor_project_with_quota(project_name: str) -> Any:
+    """
+    Returns a Harbor project's details, including its quota.
+    """
+    harbor_api = get_admin_harbor_api()
+
+    data = harbor_api.get_project(project_name).json()
+    summary = harbor_api.get_project_summary(project_name).json()
+    data["quota"] = summary["quota"]
 
-    return projects
+    return data
 
 
 def create_starter_project():
@@ -274,7 +475,7 @@ def create_starter_project():
     harbor_admin_username = flask.current_app.config["HARBOR_ADMIN_USERNAME"]
     harbor_api.delete_project_member(project["project_id"], harbor_admin_username)
 
-    cache.delete_memoized(has_starter_project)
+    cache.delete_memoized(has_harbor_project, projectname)
 
     return project
 
@@ -439,30 +640,7 @@ def get_orcid_id():
     """
     Returns the current user's ORCID iD.
     """
-    update_request_environ()
-
-    sub = flask.request.environ.get("OIDC_CLAIM_sub")
-
-    if sub:
-        ldap_url = flask.current_app.config["LDAP_URL"]
-        ldap_username = flask.current_app.config["LDAP_USERNAME"]
-        ldap_password = flask.current_app.config["LDAP_PASSWORD"]
-        ldap_base_dn = flask.current_app.config["LDAP_BASE_DN"]
-
-        server = ldap3.Server(ldap_url, get_info=ldap3.ALL)
-
-        with ldap3.Connection(server, ldap_username, ldap_password) as conn:
-            conn.search(
-                ldap_base_dn,
-                f"(&(objectClass=inetOrgPerson)(uid={sub}))",
-                attributes=["eduPersonOrcid"],
-            )
-
-            if len(conn.entries) == 1:
-                orcid = conn.entries[0].entry_attributes_as_dict["eduPersonOrcid"]
-                return orcid[0] if len(orcid) != 0 else None
-
-    return None
+    return get_ldap_identity().orcid_id
 
 
 #
@@ -479,15 +657,17 @@ def get_starter_project_name():
 
 
 @cache.memoize()
+def has_harbor_project(project_name: str) -> bool:
+    project = registry.util.get_admin_harbor_api().get_project(project_name).json()
+    return not ("errors" in project and project["errors"][0]["code"] == "NOT_FOUND")
+
+
 def has_starter_project():
-    starter_project = (
-        registry.util.get_admin_harbor_api()
-        .get_project(registry.util.get_starter_project_name())
-        .json()
-    )
-    return not (
-        "errors" in starter_project and starter_project["errors"][0]["code"] == "NOT_FOUND"
-    )
+    starter_project_name = registry.util.get_starter_project_name()
+
+    if not starter_project_name:
+        return False
+    return has_harbor_project(starter_project_name)
 
 
 def has_organizational_identity() -> bool:
@@ -533,47 +713,3 @@ def is_soteria_admin() -> bool:
     groups = get_comanage_groups()
 
     return "CO:COU:SOTERIA-Admins:members:active" in groups
-
-
-#
-# --------------------------------------------------------------------------
-#
-
-
-def get_admin_harbor_api() -> registry.harbor.HarborAPI:
-    """
-    Returns a Harbor API instance authenticated as an admin.
-    """
-    return registry.harbor.HarborAPI(
-        flask.current_app.config["HARBOR_API_URL"],
-        basic_auth=(
-            flask.current_app.config["HARBOR_ADMIN_USERNAME"],
-            flask.current_app.config["HARBOR_ADMIN_PASSWORD"],
-        ),
-    )
-
-
-def get_harbor_api() -> registry.harbor.HarborAPI:
-    """Returns a Harbor API instance not authed"""
-    return registry.harbor.HarborAPI(flask.current_app.config["HARBOR_API_URL"])
-
-
-def get_admin_comanage_api():
-    """
-    Returns a Comanage API instance authenticated as an admin.
-    """
-    return registry.comanage.COmanageAPI(
-        flask.current_app.config["REGISTRY_API_URL"],
-        flask.current_app.config["REGISTRY_CO_ID"],
-        basic_auth=(
-            flask.current_app.config["REGISTRY_API_USERNAME"],
-            flask.current_app.config["REGISTRY_API_PASSWORD"],
-        ),
-    )
-
-
-def get_freshdesk_api() -> registry.freshdesk.FreshDeskAPI:
-    """
-    Returns a Freshdesk API instance.
-    """
-    return registry.freshdesk.FreshDeskAPI(flask.current_app.config["FRESHDESK_API_KEY"])
@@ -0,0 +1,119 @@
+"""
+Wake up the polling loop when there is new work for it.
+
+The polling loop listens on a Unix datagram socket in the web application's
+data directory. Any process that adds work to the database (e.g., the web
+server handling a webhook) sends it a datagram. Notifications are best
+effort: if the loop is not listening, they are silently dropped and the
+loop finds the work on its next scheduled iteration.
+
+The socket is created with mode 0o660, so the processes that send
+notifications must run as the polling loop's user or group. Any other
+failure to send a notification (e.g., a permission error) is logged once
+per process.
+"""
+
+import os
+import pathlib
+import select
+import socket
+import time
+from typing import Optional
+
+import flask
+
+__all__ = [
+    "Listener",
+    "get_socket_path",
+    "notify",
+]
+
+# Path to the socket, relative to the web application's data directory.
+SOCKET_FILE = "run/polling-loop.sock"
+
+_warned = False
+
+
+def get_socket_path(app: Optional[flask.Flask] = None) -> pathlib.Path:
+    """
+    Return the path to the polling loop's socket.
+    """
+    if not app:
+        app = flask.current_app
+    return pathlib.Path(app.config["DATA_DIR"]) / SOCKET_FILE
+
+
+def notify(app: Optional[flask.Flask] = None) -> None:
+    """
+    Wake up the polling loop, if it is listening.
+    """
+    global _warned  # pylint: disable=global-statement
+
+    if not app:
+        app = flask.current_app._get_current_object()  # type: ignore[attr-defined]
+    path = get_socket_path(app)
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            sock.sendto(b"!", os.fspath(path))
+    except (FileNotFoundError, ConnectionRefusedError, BlockingIOError):
+        pass  # not listening, or already has a notification waiting
+    except OSError:
+        if not _warned:
+            _warned = True
+            app.logger.warning("Failed to notify the polling loop via %s", path, exc_info=True)
+
+
+class Listener:
+    """
+    The receiving end of the polling loop's socket.
+    """
+
+    def __init__(self, path: pathlib.Path, *, settle: float = 1.0):
+        """
+        Bind to the socket at `path`, replacing any stale one.
+
+        After being woken up, `wait` waits another `settle` seconds so that
+        a burst of notifications results in a single wake-up.
+        """
+        self._path = path
+        self._settle = settle
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.unlink(missing_ok=True)
+
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(os.fspath(path))
+        self._sock.setblocking(False)
+        path.chmod(0o660)
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait up to `timeout` seconds for a notification.
+
+        Returns whether a notification was received.
+        """
+        readable, _, _ = select.select([self._sock], [], [], max(0, timeout))
+
+        if not readable:
+            return False
+
+        time.sleep(self._settle)
+        self._drain()
+
+        return True
+
+    def _drain(self) -> None:
+        while True:
+            try:
+                self._sock.recv(64)
+            except BlockingIOError:
+                break
+
+    def close(self) -> None:
+        """
+        Stop listening and remove the socket.
+        """
+        self._sock.close()
+        self._path.unlink(missing_ok=True)
@@ -0,0 +1,211 @@
+"""
+Ingest webhook payloads into the web application's database.
+
+Payloads are normally written to the database while handling the request
+that delivered them. Optionally, they can instead be handed off to a
+background thread that writes them in batches, so that bursts of webhooks
+do not each wait on a separate database transaction.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Any, Optional
+
+import flask
+
+import registry.catalog
+import registry.database
+import registry.wakeup
+from registry.database import Source
+
+__all__ = [
+    "PayloadWriter",
+    "ingest_payload",
+    "log_payload",
+]
+
+# Defaults for the corresponding `WEBHOOKS_*` configuration keys.
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_BATCH_DELAY = 0.5
+DEFAULT_LOG_LEVEL = "INFO"
+DEFAULT_LOG_MAX_CHARS = 2000
+
+EXTENSION_KEY = "soteria_payload_writer"
+
+_extension_lock = threading.Lock()
+
+
+class PayloadWriter(threading.Thread):
+    """
+    Background thread that writes queued payloads to the database in batches.
+
+    A batch is written once it contains `batch_size` payloads or once its
+    oldest payload has waited for `batch_delay` seconds.
+    """
+
+    def __init__(
+        self,
+        app: flask.Flask,
+        *,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_delay: float = DEFAULT_BATCH_DELAY,
+    ):
+        super().__init__(name="soteria-payload-writer", daemon=True)
+
+        self._app = app
+        self._batch_size = max(1, batch_size)
+        self._batch_delay = batch_delay
+        self._queue: queue.Queue[Optional[tuple[dict[Any, Any], Source]]] = queue.Queue()
+
+    def submit(self, payload: dict[Any, Any], source: Source) -> None:
+        """
+        Queue a payload to be written to the database.
+        """
+        self._queue.put((payload, source))
+
+    def stop(self) -> None:
+        """
+        Write any queued payloads and stop the thread.
+        """
+        self._queue.put(None)
+        self.join()
+
+    def _next_batch(self) -> tuple[list[tuple[dict[Any, Any], Source]], bool]:
+        item = self._queue.get()
+
+        if item is None:
+            return [], True
+
+        batch = [item]
+        deadline = time.monotonic() + self._batch_delay
+
+        while len(batch) < self._batch_size:
+            try:
+                item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+
+        return batch, False
+
+    def run(self) -> None:
+        stopping = False
+
+        while not stopping:
+            batch, stopping = self._next_batch()
+
+            if not batch:
+                continue
+
+            batch = self._write(batch)
+
+            if batch:
+                registry.wakeup.notify(self._app)
+                update_catalog([payload for payload, _ in batch], self._app)
+
+    def _write(
+        self, batch: list[tuple[dict[Any, Any], Source]]
+    ) -> list[tuple[dict[Any, Any], Source]]:
+        """
+        Write a batch of payloads to the database, and return those written.
+
+        If the batch cannot be written in one transaction (e.g., because one
+        of its payloads is malformed), its payloads are written one at a
+        time, so that only the ones that fail are lost.
+        """
+        try:
+            registry.database.insert_new_payloads(batch, app=self._app)
+            return batch
+        except Exception:  # pylint: disable=broad-except
+            self._app.logger.warning(
+                "Failed to write %s webhook payloads, retrying one at a time",
+                len(batch),
+                exc_info=True,
+            )
+
+        written = []
+
+        for payload, source in batch:
+            try:
+                registry.database.insert_new_payloads([(payload, source)], app=self._app)
+            except Exception:  # pylint: disable=broad-except
+                self._app.logger.exception(
+                    "Skipping a webhook payload from %s that could not be written: %.200s",
+                    source.value,
+                    json.dumps(payload, separators=(",", ":")),
+                )
+            else:
+                written.append((payload, source))
+
+        return written
+
+
+def get_payload_writer(app: flask.Flask) -> PayloadWriter:
+    """
+    Return the application's background payload writer, starting it if needed.
+    """
+    with _extension_lock:
+        if EXTENSION_KEY not in app.extensions:
+            writer = PayloadWriter(
+                app,
+                batch_size=int(app.config.get("WEBHOOKS_BATCH_SIZE", DEFAULT_BATCH_SIZE)),
+                batch_delay=float(app.config.get("WEBHOOKS_BATCH_DELAY", DEFAULT_BATCH_DELAY)),
+            )
+            writer.start()
+            atexit.register(writer.stop)
+            app.extensions[EXTENSION_KEY] = writer
+        payload_writer: PayloadWriter = app.extensions[EXTENSION_KEY]
+
+    return payload_writer
+
+
+def ingest_payload(payload: dict[Any, Any], source: Source) -> None:
+    """
+    Store a webhook payload, either immediately or via the background writer.
+    """
+    app = flask.current_app._get_current_object()  # type: ignore[attr-defined]
+
+    if app.config.get("WEBHOOKS_ASYNC_INGEST"):
+        get_payload_writer(app).submit(payload, source)
+    else:
+        registry.database.insert_new_payload(payload, source)
+        registry.wakeup.notify(app)
+        update_catalog([payload], app)
+
+
+def update_catalog(payloads: list[dict[Any, Any]], app: flask.Flask) -> None:
+    """
+    Apply webhook payloads to the catalog of public projects.
+
+    Failures are logged rather than raised, since the catalog can always be
+    rebuilt by a full sync.
+    """
+    try:
+        registry.catalog.apply_webhooks(payloads, app=app)
+    except Exception:  # pylint: disable=broad-except
+        app.logger.exception("Failed to update the catalog from %s webhooks", len(payloads))
+
+
+def log_payload(payload: dict[Any, Any], source: Source) -> None:
+    """
+    Log a webhook payload at the configured level, truncated if necessary.
+    """
+    app = flask.current_app
+    level = logging.getLevelName(app.config.get("WEBHOOKS_LOG_LEVEL", DEFAULT_LOG_LEVEL))
+
+    if not isinstance(level, int) or not app.logger.isEnabledFor(level):
+        return
+
+    max_chars = int(app.config.get("WEBHOOKS_LOG_MAX_CHARS", DEFAULT_LOG_MAX_CHARS))
+    payload_as_text = json.dumps(payload, separators=(",", ":"))
+
+    if 0 < max_chars < len(payload_as_text):
+        payload_as_text = f"{payload_as_text[:max_chars]}... ({len(payload_as_text)} chars)"
+
+    app.logger.log(level, "Webhook called from %s: %s", source.value, payload_as_text)
@@ -13,12 +13,9 @@ import flask
 import jinja2
 
 import registry.util
+from registry.clients import get_admin_harbor_api
 from registry.security import registration_required, researcher_required
-from registry.util import (
-    get_admin_harbor_api,
-    has_organizational_identity,
-    is_soteria_affiliate,
-)
+from registry.util import has_organizational_identity, is_soteria_affiliate
 
 from .forms import (
     CreateProjectForm,
@@ -109,6 +109,198 @@ WEBHOOKS_HARBOR_RESOURCE_REGEX = r".*"
 # Optional Configuration
 # ======================
 
+#
+# The maximum number of pooled LDAP connections per process, how long (in
+# seconds) an idle connection may be kept for reuse, and how long to wait
+# for a connection when all of them are in use.
+#
+LDAP_POOL_SIZE = 4
+LDAP_POOL_IDLE_TIMEOUT = 300
+LDAP_POOL_CHECKOUT_TIMEOUT = 30
+
+#
+# How many items to request per page when listing Harbor's collections (at
+# most 100), and how many pages to request concurrently.
+#
+HARBOR_API_PAGE_SIZE = 100
+HARBOR_API_MAX_WORKERS = 4
+
+#
+# The maximum number of kept-alive connections per host for each API client,
+# and how many times to retry idempotent requests that fail to connect or that
+# receive a 502, 503, or 504 response. Each Harbor API client also fetches at
+# most HTTP_POOL_MAXSIZE pages at a time, across all of its collections.
+#
+HTTP_POOL_MAXSIZE = 10
+HTTP_MAX_RETRIES = 3
+
+#
+# The cache to use for memoized lookups. The default keeps a separate cache
+# in each process. "registry.cache.SQLiteCache" shares one cache among all
+# processes, stored in DATA_DIR (or in the file named by CACHE_SQLITE_FILE),
+# and evicts the least recently used entries beyond CACHE_THRESHOLD.
+#
+CACHE_TYPE = "SimpleCache"
+CACHE_THRESHOLD = 5000
+
+#
+# How long (in seconds) the public pages' requests to Harbor through
+# /harbor/get/ are answered from a cache, by route. The first regex
+# that matches the requested path applies; other paths use
+# HARBOR_PROXY_DEFAULT_TTL (0 means never cache). Stale responses are
+# revalidated with Harbor using their ETags, and are kept for up to
+# HARBOR_PROXY_MAX_AGE seconds. Requests to Harbor time out after
+# HARBOR_PROXY_TIMEOUT seconds. Responses larger than
+# HARBOR_PROXY_MAX_CACHED_SIZE bytes, and requests for a Range, are streamed
+# through without being cached. Each process keeps its own cache, which
+# holds at most HARBOR_PROXY_CACHE_MAX_BYTES bytes of responses and evicts
+# the least recently used ones first.
+#
+HARBOR_PROXY_TTLS = [
+    (r"^projects/?$", 60),
+    (r"^projects/[^/]+/repositories/?$", 60),
+    (r"^projects/[^/]+/repositories/.+/artifacts/?$", 30),
+]
+HARBOR_PROXY_DEFAULT_TTL = 0
+HARBOR_PROXY_MAX_AGE = 24 * 60 * 60
+HARBOR_PROXY_TIMEOUT = 10
+HARBOR_PROXY_MAX_CACHED_SIZE = 1024 * 1024
+HARBOR_PROXY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+#
+# The level at which to log incoming webhook payloads, and the number of
+# characters after which to truncate them (0 to never truncate).
+#
+WEBHOOKS_LOG_LEVEL = "INFO"
+WEBHOOKS_LOG_MAX_CHARS = 2000
+
+#
+# Controls whether webhook payloads are written to the database by a
+# background thread, in batches of up to WEBHOOKS_BATCH_SIZE payloads or
+# after WEBHOOKS_BATCH_DELAY seconds. Payloads that are still queued when a
+# process is killed are lost.
+#
+WEBHOOKS_ASYNC_INGEST = False
+WEBHOOKS_BATCH_SIZE = 100
+WEBHOOKS_BATCH_DELAY = 0.5
+
+#
+# The minimum number of seconds between iterations of the polling loop.
+# The loop is woken up whenever a new webhook payload is stored; when it
+# finds nothing to do, it waits twice as long each time, up to 300 seconds.
+#
+POLLING_LOOP_MIN_DELAY = 5
+
+#
+# How often (in seconds) the polling loop re-syncs the local catalog of
+# public projects with Harbor (0 to never). This removes projects that have
+# been made private or deleted, which no webhook reports.
+#
+CATALOG_SYNC_INTERVAL = 3600
+
+#
+# The number of threads with which the polling loop processes payloads.
+# Each instance of the loop claims the payloads that it processes for up to
+# POLLING_LOOP_LEASE seconds, so several instances can share a database.
+#
+POLLING_LOOP_WORKERS = 1
+POLLING_LOOP_LEASE = 900
+
+#
+# How many times the polling loop attempts to process a payload before
+# marking it as failed. The delay before each retry doubles, starting from
+# POLLING_LOOP_RETRY_DELAY seconds, up to POLLING_LOOP_MAX_RETRY_DELAY.
+#
+POLLING_LOOP_MAX_ATTEMPTS = 5
+POLLING_LOOP_RETRY_DELAY = 60
+POLLING_LOOP_MAX_RETRY_DELAY = 3600
+
+#
+# Controls whether the polling loop submits the HTCondor jobs for all of the
+# payloads that it finds in one iteration as a single cluster, rather than
+# one cluster per payload.
+#
+HTCONDOR_BATCH_SUBMIT = False
+
+#
+# A job event log that records the events of every job submitted by the
+# polling loop (e.g., the schedd's EVENT_LOG), and how often (in seconds) to
+# check it. When set, the polling loop learns about finished jobs from this
+# log instead of waiting for its next full iteration. The read offset is
+# saved in the database.
+#
+# HTCONDOR_EVENT_LOG = "/var/log/condor/EventLog"
+HTCONDOR_EVENT_LOG_POLL_INTERVAL = 5
+
+#
+# How the HTCondor jobs process each image: "build" runs `apptainer build`,
+# while "pull" runs `apptainer pull`, which also keeps the resulting SIF
+# file in Apptainer's cache. APPTAINER_CACHEDIR points the jobs' Apptainer
+# cache at a shared or node-local directory (shell variables such as
+# $_CONDOR_SCRATCH_DIR are expanded on the execute node, and it may not
+# contain ", `, or \), so that image layers are downloaded once rather than
+# once per job.
+#
+APPTAINER_JOB_MODE = "build"
+# APPTAINER_CACHEDIR = "/var/tmp/soteria-apptainer-cache"
+
+#
+# The resources requested by each HTCondor job, chosen by the compressed size
+# of its image (from the webhook payload or Harbor's artifact API). The first
+# tier whose max_image_size is at least the image's size is used. Images that
+# are larger than every tier, or whose size is unknown, get the resources
+# given by HTCONDOR_REQUEST_*. With a shared or node-local APPTAINER_CACHEDIR,
+# layers are not counted against the job's disk usage.
+#
+HTCONDOR_SIZING_TIERS = [
+    {"max_image_size": "1G", "cpus": 1, "memory": "2G", "disk": "10G"},
+    {"max_image_size": "4G", "cpus": 2, "memory": "4G", "disk": "30G"},
+]
+HTCONDOR_REQUEST_CPUS = "2"
+HTCONDOR_REQUEST_MEMORY = "4G"
+HTCONDOR_REQUEST_DISK = "50G"
+
+#
+# How the polling loop shares its capacity among projects. Payloads are
+# processed in weighted round-robin order across projects, with weights set
+# by `flask soteria set-project-weight`. Images that are known to be at most
+# SCHEDULER_SMALL_IMAGE_SIZE get their weight multiplied by
+# SCHEDULER_SMALL_IMAGE_BOOST. A job's HTCondor priority follows its weight.
+#
+SCHEDULER_SMALL_IMAGE_SIZE = "1G"
+SCHEDULER_SMALL_IMAGE_BOOST = 2.0
+
+#
+# The largest number of payloads that may have HTCondor jobs at once, in
+# total and for each project (0 means no limit). Other payloads wait in the
+# database, so that the order above decides whose job is submitted next.
+#
+SCHEDULER_MAX_JOBS = 100
+SCHEDULER_MAX_JOBS_PER_PROJECT = 0
+
+#
+# The HTCondor accounting group for jobs. When set, each project is a separate
+# accounting group user, so that the negotiator shares the pool among them.
+#
+# HTCONDOR_ACCOUNTING_GROUP = "group_soteria"
+
+#
+# A job that is held for using more memory than it requested is removed and
+# resubmitted with its memory request multiplied by the given factor, until
+# the request would exceed HTCONDOR_MAX_REQUEST_MEMORY.
+#
+HTCONDOR_MEMORY_ESCALATION_FACTOR = 2
+HTCONDOR_MAX_REQUEST_MEMORY = "32G"
+
+#
+# How long (in seconds) a successful build of an image digest is remembered,
+# and how many digests are remembered. A payload whose digest was already
+# built is marked as completed without submitting a job. Set the TTL to 0 to
+# build every payload.
+#
+BUILD_CACHE_TTL = 30 * 24 * 60 * 60
+BUILD_CACHE_MAX_ENTRIES = 10000
+
 #
 # Controls whether debugging functionality is enabled.
 #
@@ -0,0 +1,102 @@
+"""
+Benchmark webhook inserts while the polling loop reads the database.
+
+One thread inserts payloads one webhook at a time while another thread
+repeatedly claims the "new" payloads, marks some of them "completed", and
+releases the rest, as the polling loop does. The benchmark runs twice: once with a fresh
+connection per operation in rollback-journal mode (how the database used to
+be accessed) and once with `registry.database.get_db_conn`.
+
+Usage: python tests/benchmark_database.py [SECONDS]
+"""
+
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import flask
+
+import registry.database
+from registry.database import Source, State
+
+
+def make_payload(i: int) -> dict:
+    """
+    Return a payload for a new tag and digest, so that it is not coalesced
+    with any pending payload.
+    """
+    return {
+        "type": "PUSH_ARTIFACT",
+        "event_data": {
+            "resources": [
+                {
+                    "resource_url": f"harbor.example.com/project/repo:{i}.0",
+                    "tag": f"{i}.0",
+                    "digest": f"sha256:{i:064x}",
+                },
+            ],
+            "repository": {"namespace": "project", "name": "repo", "repo_type": "public"},
+        },
+    }
+
+
+def legacy_get_db_conn(app=None) -> sqlite3.Connection:
+    return sqlite3.connect(registry.database.get_db_file(app))
+
+
+def run(seconds: float) -> tuple[int, int]:
+    app = flask.Flask(__name__)
+    stop = threading.Event()
+    counts = {"inserts": 0, "polls": 0}
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        app.config["DATA_DIR"] = data_dir
+        registry.database.init(app)
+
+        def insert() -> None:
+            with app.app_context():
+                while not stop.is_set():
+                    registry.database.insert_new_payload(
+                        make_payload(counts["inserts"]), Source.harbor
+                    )
+                    counts["inserts"] += 1
+
+        def poll() -> None:
+            with app.app_context():
+                while not stop.is_set():
+                    payloads = registry.database.claim_new_payloads("benchmark", lease=60)
+                    for payload in payloads[::2]:
+                        registry.database.update_payload(payload.id_, State.completed)
+                    registry.database.release_payloads("benchmark")
+                    counts["polls"] += 1
+
+        threads = [threading.Thread(target=insert), threading.Thread(target=poll)]
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+
+    return counts["inserts"], counts["polls"]
+
+
+def main() -> None:
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+
+    with mock.patch.object(registry.database, "get_db_conn", legacy_get_db_conn):
+        before = run(seconds)
+    after = run(seconds)
+
+    for label, (inserts, polls) in [("before", before), ("after", after)]:
+        print(
+            f"{label:>6}: {inserts / seconds:8.1f} inserts/s"
+            f"  {polls / seconds:8.1f} polling passes/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark searches of the catalog's full-text index.
+
+The catalog is filled with ARTIFACTS tagged artifacts, ARTIFACTS_PER_REPOSITORY
+to a repository, spread across 200 projects. Then each query is run
+repeatedly through `registry.catalog.search` to measure its latency.
+
+Usage: python tests/benchmark_search.py [ARTIFACTS]
+"""
+
+import random
+import sys
+import tempfile
+import time
+
+import flask
+
+import registry.catalog
+import registry.database
+
+WORDS = [
+    "osg", "htcondor", "pytorch", "tensorflow", "cuda", "jupyter", "notebook",
+    "rstudio", "ubuntu", "rocky", "alma", "centos", "python", "conda", "gromacs",
+    "lammps", "openmpi", "root", "geant", "fastqc", "blast", "samtools", "julia",
+]  # fmt: skip
+
+QUERIES = ["osg", "py", "pytorch cuda", "jupyter note", "rocky 9", "1.2", "nomatch"]
+
+ARTIFACTS_PER_REPOSITORY = 25
+
+
+def fill(artifacts: int) -> None:
+    rng = random.Random(0)
+
+    with registry.database.get_db_conn() as conn:
+        for i in range(artifacts):
+            if i % ARTIFACTS_PER_REPOSITORY == 0:
+                project = f"{rng.choice(WORDS)}-{i % 200}"
+                repository = f"{project}/{rng.choice(WORDS)}-{rng.choice(WORDS)}-{i}"
+                conn.execute(
+                    "INSERT INTO catalog_repositories ( name, project, data ) "
+                    "VALUES ( ?, ?, json_object('description', ?) )",
+                    (repository, project, " ".join(rng.sample(WORDS, 5))),
+                )
+            tags = [f"{rng.randint(0, 9)}.{rng.randint(0, 9)}.{i}", f"{rng.choice(WORDS)}-{i}"]
+            registry.catalog.put_artifact(
+                conn,
+                repository,
+                {
+                    "digest": f"sha256:{i:064x}",
+                    "push_time": f"2024-01-01T00:00:{i % 60:02}.000Z",
+                    "tags": [{"name": tag} for tag in tags],
+                },
+            )
+        registry.catalog.rebuild_search_index(conn)
+        conn.commit()
+
+
+def main() -> None:
+    artifacts = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    app = flask.Flask(__name__)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        app.config["DATA_DIR"] = data_dir
+        registry.database.init(app)
+        registry.catalog.init(app)
+
+        with app.app_context():
+            fill(artifacts)
+
+            for query in QUERIES:
+                registry.catalog.search(query)  # warm up
+                runs = 50
+                start = time.perf_counter()
+                for _ in range(runs):
+                    _, total = registry.catalog.search(query)
+                elapsed = (time.perf_counter() - start) / runs * 1000
+                print(f"{query!r:>16}: {elapsed:6.2f} ms  ({total} matches)")
+
+
+if __name__ == "__main__":
+    main()
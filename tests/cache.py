@@ -0,0 +1,110 @@
+import time
+
+import flask
+import flask_caching
+import pytest
+
+import registry.cache
+from registry.cache import SQLiteCache
+
+
+def make_cache(path) -> flask_caching.Cache:
+    """
+    Return a cache for a new application, as if in a separate process.
+    """
+    app = flask.Flask(__name__)
+    app.config["DATA_DIR"] = "/nonexistent"
+    app.config["CACHE_TYPE"] = "registry.cache.SQLiteCache"
+    app.config["CACHE_SQLITE_FILE"] = str(path)
+
+    return flask_caching.Cache(app)
+
+
+def test_entries_are_shared_between_processes(tmp_path):
+    first = make_cache(tmp_path / "cache.sqlite")
+    second = make_cache(tmp_path / "cache.sqlite")
+
+    with first.app.app_context():
+        first.set("key", {"value": 1})
+    with second.app.app_context():
+        assert second.get("key") == {"value": 1}
+        second.delete("key")
+    with first.app.app_context():
+        assert first.get("key") is None
+
+
+def test_memoized_values_are_invalidated_in_every_process(tmp_path):
+    calls = []
+
+    def make_memoized(cache):
+        @cache.memoize()
+        def lookup(name):
+            calls.append(name)
+            return len(calls)
+
+        return lookup
+
+    first = make_cache(tmp_path / "cache.sqlite")
+    second = make_cache(tmp_path / "cache.sqlite")
+    lookup_first, lookup_second = make_memoized(first), make_memoized(second)
+
+    with first.app.app_context():
+        assert lookup_first("a") == 1
+    with second.app.app_context():
+        assert lookup_second("a") == 1
+        second.delete_memoized(lookup_second, "a")
+    with first.app.app_context():
+        assert lookup_first("a") == 2
+
+
+def test_entries_expire(tmp_path, monkeypatch):
+    cache = SQLiteCache(tmp_path / "cache.sqlite")
+    now = time.time()
+
+    cache.set("forever", 1, timeout=0)
+    cache.set("briefly", 2, timeout=10)
+
+    monkeypatch.setattr(time, "time", lambda: now + 20)
+
+    assert cache.get("forever") == 1
+    assert cache.get("briefly") is None
+    assert not cache.has("briefly")
+    assert cache.add("briefly", 3)
+    assert not cache.add("forever", 4)
+
+
+def test_least_recently_used_entries_are_pruned(tmp_path, monkeypatch):
+    monkeypatch.setattr(registry.cache, "PRUNE_INTERVAL", 5)
+    cache = SQLiteCache(tmp_path / "cache.sqlite", threshold=3)
+    now = time.time()
+
+    for i in range(4):
+        monkeypatch.setattr(time, "time", lambda i=i: now + 10 * i)
+        cache.set(f"key{i}", i)
+
+    monkeypatch.setattr(time, "time", lambda: now + 40)
+    assert cache.get("key0") == 0
+
+    # Not yet pruned, since it has been fewer than PRUNE_INTERVAL writes.
+    assert cache.has("key1")
+
+    monkeypatch.setattr(time, "time", lambda: now + 50)
+    cache.set("key4", 4)
+
+    assert [cache.has(f"key{i}") for i in range(5)] == [True, False, False, True, True]
+
+
+@pytest.mark.parametrize("configured", [True, False])
+def test_cache_file_can_be_configured(tmp_path, configured):
+    app = flask.Flask(__name__)
+    app.config["DATA_DIR"] = str(tmp_path / "data")
+    app.config["CACHE_TYPE"] = "registry.cache.SQLiteCache"
+    if configured:
+        app.config["CACHE_SQLITE_FILE"] = str(tmp_path / "elsewhere.sqlite")
+
+    flask_caching.Cache(app)
+
+    if configured:
+        assert (tmp_path / "elsewhere.sqlite").exists()
+    else:
+        assert (tmp_path / "data" / registry.cache.CACHE_DB_FILE).exists()
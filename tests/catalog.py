@@ -0,0 +1,230 @@
+import time
+
+import flask
+import pytest
+
+import registry.catalog
+import registry.clients
+import registry.database
+
+
+def make_webhook(
+    kind: str, repository: str, tag: str, digest: str, occur_at: int = 1000
+) -> dict:
+    project, name = repository.split("/", 1)
+    return {
+        "type": kind,
+        "occur_at": occur_at,
+        "event_data": {
+            "resources": [{"tag": tag, "digest": digest}],
+            "repository": {"namespace": project, "name": name, "repo_type": "public"},
+        },
+    }
+
+
+def push(repository: str, tag: str, digest: str, occur_at: int = 1000) -> None:
+    registry.catalog.apply_webhooks(
+        [make_webhook("PUSH_ARTIFACT", repository, tag, digest, occur_at)]
+    )
+
+
+def delete(repository: str, digest: str) -> None:
+    registry.catalog.apply_webhooks([make_webhook("DELETE_ARTIFACT", repository, "", digest)])
+
+
+def get_tags(artifacts: list) -> dict:
+    return {a["digest"]: [t["name"] for t in a["tags"] or []] for a in artifacts}
+
+
+class FakeHarborAPI:
+    """
+    Stands in for the admin Harbor API client during a catalog sync.
+    """
+
+    def __init__(self, projects: list, repositories: dict, artifacts: dict):
+        self.projects = projects
+        self.repositories = repositories
+        self.artifacts = artifacts
+
+    def get_all_projects(self):
+        return self.projects
+
+    def get_all_repositories(self, project, params=None):
+        return self.repositories.get(project, [])
+
+    def get_all_artifacts(self, project, repository, params=None):
+        return self.artifacts.get(f"{project}/{repository}", [])
+
+
+@pytest.fixture
+def app(tmp_path) -> flask.Flask:
+    app = flask.Flask(__name__)
+    app.config["DATA_DIR"] = str(tmp_path)
+    registry.database.init(app)
+    registry.catalog.init(app)
+
+    with app.app_context():
+        yield app
+
+
+def test_pushes_add_repositories_and_artifacts(app):
+    push("project/repo", "1.0", "sha256:a")
+    push("project/repo", "2.0", "sha256:b", occur_at=2000)
+
+    projects, total = registry.catalog.list_projects()
+    assert total == 1
+    assert projects[0]["name"] == "project"
+    assert projects[0]["repo_count"] == 1
+
+    repositories, total = registry.catalog.list_repositories("project")
+    assert total == 1
+    assert repositories[0]["artifact_count"] == 2
+
+    artifacts, total = registry.catalog.list_artifacts("project", "repo")
+    assert total == 2
+    assert get_tags(artifacts) == {"sha256:b": ["2.0"], "sha256:a": ["1.0"]}
+    assert [a["digest"] for a in artifacts] == ["sha256:b", "sha256:a"]
+
+
+def test_pushes_to_private_repositories_are_ignored(app):
+    webhook = make_webhook("PUSH_ARTIFACT", "project/repo", "1.0", "sha256:a")
+    webhook["event_data"]["repository"]["repo_type"] = "private"
+
+    registry.catalog.apply_webhooks([webhook])
+
+    assert registry.catalog.list_projects() == ([], 0)
+
+
+def test_pushed_tags_move_between_artifacts(app):
+    push("project/repo", "latest", "sha256:a")
+    push("project/repo", "latest", "sha256:b", occur_at=2000)
+
+    artifacts, _ = registry.catalog.list_artifacts("project", "repo")
+
+    assert get_tags(artifacts) == {"sha256:a": [], "sha256:b": ["latest"]}
+
+
+def test_deleting_the_last_artifact_removes_the_repository(app):
+    push("project/repo", "1.0", "sha256:a")
+    push("project/other", "1.0", "sha256:b")
+
+    delete("project/repo", "sha256:a")
+
+    repositories, total = registry.catalog.list_repositories("project")
+    assert total == 1
+    assert repositories[0]["name"] == "project/other"
+
+    projects, _ = registry.catalog.list_projects()
+    assert projects[0]["repo_count"] == 1
+
+    assert registry.catalog.search("repo")[1] == 0
+
+
+@pytest.mark.parametrize(
+    "q, expected",
+    [
+        (None, ""),
+        ("", ""),
+        ("name=~foo", "foo"),
+        ("name%3D~foo", "foo"),
+        ("name%3D~foo%2Fbar", "foo/bar"),
+        ("tags=foo", ""),
+    ],
+)
+def test_get_name_filter(q, expected):
+    assert registry.catalog.get_name_filter(q) == expected
+
+
+def test_names_are_filtered_by_an_encoded_query(app):
+    push("alpha/repo", "1.0", "sha256:a")
+    push("beta/repo", "1.0", "sha256:b")
+
+    projects, total = registry.catalog.list_projects(q="name%3D~alp")
+
+    assert total == 1
+    assert projects[0]["name"] == "alpha"
+
+
+def test_search_matches_word_prefixes(app):
+    push("physics/analysis-tools", "1.0", "sha256:a")
+    push("physics/simulation", "1.0", "sha256:b")
+
+    results, total = registry.catalog.search("anal")
+
+    assert total == 1
+    assert results[0]["project"] == "physics"
+    assert results[0]["repository"] == "analysis-tools"
+
+    assert registry.catalog.search("phys tools")[1] == 1
+    assert registry.catalog.search("phys")[1] == 2
+    assert registry.catalog.search("chemistry") == ([], 0)
+    assert registry.catalog.search("  ") == ([], 0)
+
+
+def test_search_ranks_repository_names_above_descriptions(app, monkeypatch):
+    api = FakeHarborAPI(
+        [{"name": "project", "metadata": {"public": "true"}}],
+        {"project": [{"name": "project/described"}, {"name": "project/notebook"}]},
+        {
+            "project/described": [
+                {
+                    "digest": "sha256:a",
+                    "annotations": {
+                        "org.opencontainers.image.description": "Tools for a notebook server"
+                    },
+                    "tags": [{"name": "1.0"}],
+                }
+            ],
+            "project/notebook": [{"digest": "sha256:b", "tags": [{"name": "1.0"}]}],
+        },
+    )
+    monkeypatch.setattr(registry.clients, "get_admin_harbor_api", lambda: api)
+    registry.catalog.sync()
+
+    results, total = registry.catalog.search("notebook")
+
+    assert total == 2
+    assert [r["repository"] for r in results] == ["notebook", "described"]
+    assert results[1]["description"] == "Tools for a notebook server"
+
+
+def test_search_returns_the_matching_tags(app):
+    push("project/repo", "1.0-cuda", "sha256:a", occur_at=1000)
+    push("project/repo", "2.0-cuda", "sha256:b", occur_at=2000)
+    push("project/repo", "2.0-cpu", "sha256:c", occur_at=3000)
+
+    results, _ = registry.catalog.search("repo cuda")
+    assert [t["name"] for t in results[0]["tags"]] == ["2.0-cuda", "1.0-cuda"]
+
+    # When every word matches the repository itself, any tag matches.
+    results, _ = registry.catalog.search("repo")
+    assert [t["name"] for t in results[0]["tags"]] == ["2.0-cpu", "2.0-cuda", "1.0-cuda"]
+
+
+def test_search_reflects_moved_and_deleted_tags(app):
+    push("project/repo", "nightly", "sha256:a")
+    push("project/repo", "stable", "sha256:b")
+
+    assert registry.catalog.search("nightly")[1] == 1
+
+    delete("project/repo", "sha256:a")
+
+    assert registry.catalog.search("nightly")[1] == 0
+    assert registry.catalog.search("stable")[1] == 1
+
+
+def test_sync_removes_projects_that_are_no_longer_public(app, monkeypatch):
+    push("project/repo", "1.0", "sha256:a")
+    api = FakeHarborAPI([{"name": "project", "metadata": {"public": "false"}}], {}, {})
+    monkeypatch.setattr(registry.clients, "get_admin_harbor_api", lambda: api)
+    app.config["CATALOG_SYNC_INTERVAL"] = 60
+
+    assert registry.catalog.sync_if_due()
+    assert registry.catalog.list_projects() == ([], 0)
+    assert registry.catalog.search("repo") == ([], 0)
+
+    # A sync by any process postpones the next one.
+    assert not registry.catalog.sync_if_due()
+    later = time.time() + 120
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert registry.catalog.sync_if_due()
@@ -0,0 +1,93 @@
+import concurrent.futures
+import email.message
+
+import flask
+import pytest
+import requests
+
+import registry.clients
+from registry.api_client import GenericAPI
+
+
+def make_app() -> flask.Flask:
+    app = flask.Flask(__name__)
+    app.config["HARBOR_API_URL"] = "https://harbor.example.org/api/v2.0"
+    app.config["HARBOR_ADMIN_USERNAME"] = "admin"
+    app.config["HARBOR_ADMIN_PASSWORD"] = "password"
+    app.config["HTTP_POOL_MAXSIZE"] = 7
+    app.config["HTTP_MAX_RETRIES"] = 2
+    app.config["HARBOR_API_PAGE_SIZE"] = 50
+
+    return app
+
+
+@pytest.fixture
+def app() -> flask.Flask:
+    app = make_app()
+
+    with app.app_context():
+        yield app
+
+
+def test_clients_are_reused_by_every_request(app):
+    first = registry.clients.get_admin_harbor_api()
+
+    with app.test_request_context():
+        assert registry.clients.get_admin_harbor_api() is first
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+
+        def get_client(_):
+            with app.app_context():
+                return registry.clients.get_admin_harbor_api()
+
+        assert set(executor.map(get_client, range(8))) == {first}
+
+    assert registry.clients.get_harbor_api() is not first
+
+
+def test_clients_are_created_once_under_contention(app):
+    created = []
+
+    def factory():
+        created.append(object())
+        return created[-1]
+
+    def get_client(_):
+        with app.app_context():
+            return registry.clients.get_api_client("example", factory)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        clients = set(executor.map(get_client, range(32)))
+
+    assert len(created) == 1
+    assert clients == {created[0]}
+
+
+def test_each_application_has_its_own_clients(app):
+    first = registry.clients.get_admin_harbor_api()
+
+    with make_app().app_context():
+        assert registry.clients.get_admin_harbor_api() is not first
+
+
+def test_clients_are_configured_from_the_application(app):
+    api = registry.clients.get_admin_harbor_api()
+    adapter = api._session.get_adapter(app.config["HARBOR_API_URL"])
+
+    assert adapter._pool_maxsize == 7
+    assert adapter.max_retries.total == 2
+    assert api._page_size == 50
+
+
+def test_sessions_refuse_cookies():
+    api = GenericAPI("https://harbor.example.org/api/v2.0")
+    headers = email.message.Message()
+    headers["Set-Cookie"] = "sid=1; Path=/"
+    request = requests.Request("GET", "https://harbor.example.org/api/v2.0/users")
+
+    api._session.cookies.extract_cookies(
+        requests.cookies.MockResponse(headers), requests.cookies.MockRequest(request)
+    )
+
+    assert not api._session.cookies
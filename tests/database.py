@@ -0,0 +1,300 @@
+import collections
+import concurrent.futures
+import time
+
+import flask
+import pytest
+
+import registry.database
+from registry.database import AccessKind, Source, State
+
+
+def make_payload(project: str, tag: str, digest: str = None) -> dict:
+    return {
+        "type": "PUSH_ARTIFACT",
+        "event_data": {
+            "resources": [
+                {
+                    "resource_url": f"harbor.example.com/{project}/repo:{tag}",
+                    "tag": tag,
+                    "digest": digest or f"sha256:{project}-{tag}",
+                },
+            ],
+            "repository": {"namespace": project, "name": "repo", "repo_type": "public"},
+        },
+    }
+
+
+def insert(*payloads: dict) -> None:
+    registry.database.insert_new_payloads([(p, Source.harbor) for p in payloads])
+
+
+def submit(payloads: list) -> None:
+    """
+    Record an HTCondor job for each payload, as the polling loop does.
+    """
+    registry.database.set_payload_jobs([(p.id_, 1, i) for i, p in enumerate(payloads)])
+
+
+@pytest.fixture
+def app(tmp_path) -> flask.Flask:
+    app = flask.Flask(__name__)
+    app.config["DATA_DIR"] = str(tmp_path)
+    registry.database.init(app)
+
+    with app.app_context():
+        yield app
+
+
+def test_database_uses_write_ahead_logging(app):
+    conn = registry.database.get_db_conn()
+
+    assert conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+
+def test_connections_are_reused_per_thread(app):
+    conn = registry.database.get_db_conn()
+
+    assert registry.database.get_db_conn() is conn
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        other = executor.submit(registry.database.get_db_conn, app).result()
+
+    assert other is not conn
+
+
+def test_threads_see_each_others_writes(app):
+    def insert_in_thread(tag: str) -> None:
+        registry.database.insert_new_payloads(
+            [(make_payload("project", tag), Source.harbor)], app=app
+        )
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(insert_in_thread, [f"{i}.0" for i in range(8)]))
+
+    (count,) = (
+        registry.database.get_db_conn()
+        .execute("SELECT COUNT(*) FROM webhook_payloads")
+        .fetchone()
+    )
+    assert count == 8
+
+
+def test_harbor_users_are_indexed_by_subiss(app):
+    registry.database.upsert_harbor_users(
+        [
+            {"subiss": "a", "user_id": 1, "username": "alice", "creation_time": "2024"},
+            {"subiss": "b", "user_id": 2, "username": "bob", "creation_time": "2024"},
+        ]
+    )
+    registry.database.upsert_harbor_users(
+        [{"subiss": "a", "user_id": 3, "username": "alice", "creation_time": "2025"}]
+    )
+
+    assert registry.database.get_harbor_user_id("a") == 3
+    assert registry.database.get_harbor_user_id("b") == 2
+    assert registry.database.get_harbor_user_id("c") is None
+
+    registry.database.delete_harbor_user("a")
+
+    assert registry.database.get_harbor_user_id("a") is None
+
+
+def test_metadata_can_be_replaced(app):
+    assert registry.database.get_metadata("key") is None
+
+    registry.database.set_metadata("key", "1")
+    registry.database.set_metadata("key", "2")
+
+    assert registry.database.get_metadata("key") == "2"
+
+
+def test_claims_are_exclusive_until_released(app):
+    insert(make_payload("project", "1.0"), make_payload("project", "2.0"))
+
+    claimed = registry.database.claim_new_payloads("worker-1", lease=60)
+
+    assert len(claimed) == 2
+    assert registry.database.claim_new_payloads("worker-2", lease=60) == []
+
+    registry.database.release_payloads("worker-1")
+
+    assert len(registry.database.claim_new_payloads("worker-2", lease=60)) == 2
+
+
+def test_expired_leases_can_be_claimed(app):
+    insert(make_payload("project", "1.0"))
+
+    registry.database.claim_new_payloads("worker-1", lease=-1)
+
+    assert len(registry.database.claim_new_payloads("worker-2", lease=60)) == 1
+
+
+def test_retries_wait_until_their_next_attempt(app):
+    insert(make_payload("project", "1.0"))
+    (payload,) = registry.database.claim_new_payloads("worker", lease=60)
+
+    registry.database.set_payload_retry(payload.id_, 1, int(time.time()) + 3600)
+
+    assert registry.database.claim_new_payloads("worker", lease=60) == []
+    assert registry.database.get_payload(payload.id_).attempts == 1
+
+    registry.database.set_payload_retry(payload.id_, 2, 0)
+
+    assert len(registry.database.claim_new_payloads("worker", lease=60)) == 1
+
+
+def test_pending_digests_are_coalesced(app):
+    insert(make_payload("project", "1.0", digest="sha256:a"))
+    insert(
+        make_payload("project", "2.0", digest="sha256:a"),  # same digest
+        make_payload("project", "3.0", digest="sha256:c"),
+    )
+
+    claimed = registry.database.claim_new_payloads("worker", lease=60)
+    primary = next(p for p in claimed if p.tag == "1.0")
+
+    assert sorted(p.tag for p in claimed) == ["1.0", "3.0"]
+    assert [p.tag for p in registry.database.get_payload_aliases(primary.id_)] == ["2.0"]
+
+    registry.database.update_payload(primary.id_, State.completed)
+
+    for alias in registry.database.get_payload_aliases(primary.id_):
+        assert registry.database.get_payload(alias.id_).state == State.completed
+
+
+def test_tags_pushed_with_a_new_digest_are_not_coalesced(app):
+    insert(make_payload("project", "1.0", digest="sha256:a"))
+    insert(make_payload("project", "1.0", digest="sha256:b"))
+
+    claimed = registry.database.claim_new_payloads("worker", lease=60)
+
+    assert sorted(p.digest for p in claimed) == ["sha256:a", "sha256:b"]
+    assert not any(registry.database.get_payload_aliases(p.id_) for p in claimed)
+
+
+def test_resources_without_digests_are_coalesced_by_name(app):
+    payload = make_payload("project", "1.0")
+    del payload["event_data"]["resources"][0]["digest"]
+
+    insert(make_payload("project", "1.0"))
+    insert(payload)
+
+    (primary,) = registry.database.claim_new_payloads("worker", lease=60)
+    (alias,) = registry.database.get_payload_aliases(primary.id_)
+
+    assert alias.digest is None
+    assert alias.state == State.coalesced
+
+
+def test_finished_resources_are_not_coalesced(app):
+    insert(make_payload("project", "1.0"))
+    (payload,) = registry.database.claim_new_payloads("worker", lease=60)
+    registry.database.update_payload(payload.id_, State.completed)
+    registry.database.release_payloads("worker")
+
+    insert(make_payload("project", "1.0"))
+
+    (payload,) = registry.database.claim_new_payloads("worker", lease=60)
+    assert payload.access_kind == AccessKind.public_and_tagged
+
+
+def test_build_results_expire_after_their_ttl(app, monkeypatch):
+    insert(make_payload("project", "1.0", digest="sha256:a"))
+    (payload,) = registry.database.claim_new_payloads("worker", lease=60)
+
+    monkeypatch.setattr(time, "time", lambda: 1000)
+    registry.database.record_build_result(payload, ttl=100, max_entries=10)
+
+    monkeypatch.setattr(time, "time", lambda: 1050)
+    assert registry.database.get_build_result("sha256:a", ttl=100)
+
+    monkeypatch.setattr(time, "time", lambda: 1200)
+    assert not registry.database.get_build_result("sha256:a", ttl=100)
+
+
+def test_rebuilt_results_are_remembered(app, monkeypatch):
+    insert(make_payload("project", "1.0", digest="sha256:a"))
+    (payload,) = registry.database.claim_new_payloads("worker", lease=60)
+
+    monkeypatch.setattr(time, "time", lambda: 1000)
+    registry.database.record_build_result(payload, ttl=100, max_entries=10)
+
+    monkeypatch.setattr(time, "time", lambda: 2000)
+    registry.database.record_build_result(payload, ttl=100, max_entries=10)
+
+    monkeypatch.setattr(time, "time", lambda: 2050)
+    assert registry.database.get_build_result("sha256:a", ttl=100)
+
+
+def test_build_results_are_limited_to_the_most_recently_used(app):
+    insert(*[make_payload("project", f"{i}.0", digest=f"sha256:{i}") for i in range(3)])
+
+    for payload in registry.database.claim_new_payloads("worker", lease=60):
+        registry.database.record_build_result(payload, ttl=3600, max_entries=2)
+
+    remembered = [registry.database.get_build_result(f"sha256:{i}", ttl=3600) for i in range(3)]
+    assert sum(remembered) == 2
+
+
+def test_counters_are_shared(app):
+    registry.database.incr_counter("example")
+    registry.database.incr_counter("example", 2)
+
+    assert registry.database.get_counters() == {"example": 3}
+
+
+def test_projects_are_claimed_in_weighted_round_robin_order(app):
+    insert(*[make_payload("busy", f"{i}.0") for i in range(6)])
+    insert(*[make_payload("quiet", f"{i}.0") for i in range(2)])
+    registry.database.set_project_weight("heavy", 2.0)
+    insert(*[make_payload("heavy", f"{i}.0") for i in range(4)])
+
+    claimed = registry.database.claim_new_payloads("worker", lease=60, limit=8)
+
+    assert collections.Counter(p.project for p in claimed) == {
+        "heavy": 4,
+        "busy": 2,
+        "quiet": 2,
+    }
+
+
+def test_jobs_in_flight_are_capped(app):
+    insert(*[make_payload("busy", f"{i}.0") for i in range(10)])
+
+    first = registry.database.claim_new_payloads("worker", lease=60, max_jobs=3)
+    submit(first)
+
+    assert len(first) == 3
+    assert registry.database.claim_new_payloads("worker", lease=60, max_jobs=3) == []
+
+    registry.database.release_payloads("worker")
+    insert(make_payload("late", "1.0"))
+    registry.database.update_payload(first[0].id_, State.completed)
+
+    claimed = registry.database.claim_new_payloads("worker", lease=60, max_jobs=3)
+    new = [p for p in claimed if p.cluster_id is None]
+
+    # The running jobs are still claimed to be checked on, and the one free
+    # slot goes to the project that has nothing running.
+    assert len(claimed) == 3
+    assert [p.project for p in new] == ["late"]
+
+
+def test_jobs_in_flight_are_capped_per_project(app):
+    insert(*[make_payload("busy", f"{i}.0") for i in range(5)])
+    insert(make_payload("quiet", "1.0"))
+
+    claimed = registry.database.claim_new_payloads("worker", lease=60, max_jobs_per_project=2)
+
+    assert collections.Counter(p.project for p in claimed) == {"busy": 2, "quiet": 1}
+
+
+def test_queue_depths_count_payloads_with_and_without_jobs(app):
+    insert(*[make_payload("busy", f"{i}.0") for i in range(3)])
+    insert(make_payload("quiet", "1.0"))
+    submit(
+        [p for p in registry.database.claim_new_payloads("worker", lease=60) if p.tag == "0.0"]
+    )
+
+    assert registry.database.get_queue_depths() == [("busy", 2, 1), ("quiet", 1, 0)]
@@ -1,4 +1,9 @@
+import concurrent.futures
+import json
+import threading
+
 import pytest
+import requests
 import time
 from config import (
     HARBOR_ADMIN_PASSWORD,
@@ -239,4 +244,79 @@ class TestHarborApi:
 
         response = robot_api.get_repositories(project_name=TEST_PROJECT_NAME)
 
-        assert response.status_code == 200
\ No newline at end of file
+        assert response.status_code == 200
+
+class FakePagedCollection:
+    """
+    Stands in for `HarborAPI._get` on a paginated collection of numbers.
+    """
+
+    def __init__(self, total: int, failing_page: int = None):
+        self.total = total
+        self.failing_page = failing_page
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, route, params=None, **kwargs):
+        with self.lock:
+            self.requests.append(dict(params))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+
+        time.sleep(0.01)
+
+        page, page_size = params["page"], params["page_size"]
+        response = requests.Response()
+        response.status_code = 500 if page == self.failing_page else 200
+        response.headers["x-total-count"] = str(self.total)
+        response._content = json.dumps(
+            list(range((page - 1) * page_size, min(page * page_size, self.total)))
+        ).encode()
+
+        with self.lock:
+            self.active -= 1
+
+        return response
+
+
+class TestPagination:
+    def test_pages_are_yielded_in_order(self, monkeypatch):
+        paged_api = HarborAPI("https://harbor.example.org/api/v2.0", page_size=10)
+        collection = FakePagedCollection(95)
+        monkeypatch.setattr(paged_api, "_get", collection)
+
+        assert list(paged_api.get_all_users()) == list(range(95))
+        assert len(collection.requests) == 10
+
+    def test_paging_parameters_cannot_be_overridden(self, monkeypatch):
+        paged_api = HarborAPI("https://harbor.example.org/api/v2.0", page_size=10)
+        collection = FakePagedCollection(25)
+        monkeypatch.setattr(paged_api, "_get", collection)
+
+        users = list(paged_api.get_all_users(params={"page": 2, "page_size": 5, "q": "x"}))
+
+        assert users == list(range(25))
+        assert [r["page"] for r in collection.requests] == [1, 2, 3, 4, 5]
+        assert all(r["page_size"] == 5 and r["q"] == "x" for r in collection.requests)
+
+    def test_failed_pages_raise(self, monkeypatch):
+        paged_api = HarborAPI("https://harbor.example.org/api/v2.0", page_size=10)
+        monkeypatch.setattr(paged_api, "_get", FakePagedCollection(50, failing_page=3))
+
+        with pytest.raises(requests.HTTPError):
+            list(paged_api.get_all_users())
+
+    def test_concurrent_pages_are_limited_to_the_pool_size(self, monkeypatch):
+        paged_api = HarborAPI(
+            "https://harbor.example.org/api/v2.0", page_size=1, max_workers=4, pool_maxsize=6
+        )
+        collection = FakePagedCollection(20)
+        monkeypatch.setattr(paged_api, "_get", collection)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: list(paged_api.get_all_users()), range(4)))
+
+        assert results == [list(range(20))] * 4
+        assert collection.max_active <= 6
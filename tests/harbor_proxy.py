@@ -0,0 +1,202 @@
+import io
+import time
+
+import flask
+import pytest
+import requests
+import requests.structures
+
+import registry.clients
+import registry.harbor_proxy
+from registry.harbor_proxy import CachedResponse, ResponseCache
+
+
+class FakeHarborAPI:
+    """
+    Stands in for `HarborAPI.get_path`, serving a body for each path.
+    """
+
+    def __init__(self):
+        self.bodies = {}
+        self.requests = []
+        self.status = None
+
+    def get_path(self, path, params=None, headers=None, timeout=None, stream=False):
+        self.requests.append((path, params, headers))
+
+        if self.status == 502:
+            raise requests.ConnectionError("Harbor is down")
+
+        body = self.bodies[path]
+        response = requests.Response()
+        response.status_code = self.status or 200
+        response.headers = requests.structures.CaseInsensitiveDict(
+            {"Content-Type": "application/json", "ETag": f'"{len(body)}"'}
+        )
+
+        if "Range" in (headers or {}):
+            start, end = map(int, headers["Range"].removeprefix("bytes=").split("-"))
+            response.status_code = 206
+            response.headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+            response.headers["Content-Length"] = str(end - start + 1)
+            body = body[start : end + 1]
+
+        response.raw = io.BytesIO(b"" if response.status_code == 304 else body)
+        return response
+
+
+@pytest.fixture
+def api(monkeypatch) -> FakeHarborAPI:
+    api = FakeHarborAPI()
+    monkeypatch.setattr(registry.clients, "get_harbor_api", lambda: api)
+    return api
+
+
+@pytest.fixture
+def app(api) -> flask.Flask:
+    app = flask.Flask(__name__)
+    app.config["HARBOR_PROXY_TTLS"] = [(r"^projects", 60)]
+
+    return app
+
+
+def get(app, path: str, **headers) -> flask.Response:
+    with app.test_request_context(f"/harbor/get/{path}", headers=headers):
+        response = registry.harbor_proxy.get(path.partition("?")[0])
+        return response
+
+
+def make_entry(body: bytes) -> CachedResponse:
+    return CachedResponse(200, body, {}, '"etag"', None, time.time())
+
+
+def test_fresh_responses_are_served_from_the_cache(app, api):
+    api.bodies["projects"] = b"[1, 2]"
+
+    first = get(app, "projects?page=1&page_size=10")
+    second = get(app, "projects?page_size=10&page=1")
+
+    assert first.get_data() == second.get_data() == b"[1, 2]"
+    assert len(api.requests) == 1
+
+
+def test_stale_responses_are_revalidated(app, api, monkeypatch):
+    api.bodies["projects"] = b"[1, 2]"
+    get(app, "projects")
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    api.status = 304
+
+    response = get(app, "projects")
+
+    assert response.get_data() == b"[1, 2]"
+    assert api.requests[-1][2]["If-None-Match"] == '"6"'
+
+
+def test_stale_responses_are_served_if_harbor_is_unavailable(app, api, monkeypatch):
+    api.bodies["projects"] = b"[1, 2]"
+    get(app, "projects")
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    api.status = 502
+
+    assert get(app, "projects").get_data() == b"[1, 2]"
+    assert get(app, "projects/other").status_code == 502
+
+
+def test_large_responses_are_streamed_without_being_cached(app, api):
+    app.config["HARBOR_PROXY_MAX_CACHED_SIZE"] = 10
+    api.bodies["projects"] = b"x" * 100
+
+    with app.test_request_context("/harbor/get/projects"):
+        response = registry.harbor_proxy.get("projects")
+
+        assert response.is_streamed
+        assert b"".join(response.response) == b"x" * 100
+
+    get(app, "projects")
+
+    assert len(api.requests) == 2
+
+
+def test_cached_responses_are_limited_by_size(app, api):
+    app.config["HARBOR_PROXY_CACHE_MAX_BYTES"] = 250
+    for name in ["a", "b", "c"]:
+        api.bodies[f"projects/{name}"] = name.encode() * 100
+
+    for name in ["a", "b", "c"]:
+        get(app, f"projects/{name}")
+
+    with app.app_context():
+        assert registry.harbor_proxy.get_response_cache().size == 200
+
+    get(app, "projects/c")
+    get(app, "projects/a")
+
+    assert [path for path, _, _ in api.requests] == [
+        "projects/a",
+        "projects/b",
+        "projects/c",
+        "projects/a",
+    ]
+
+
+def test_least_recently_used_responses_are_evicted_first():
+    response_cache = ResponseCache(max_bytes=20, max_age=60)
+    response_cache.set("a", make_entry(b"a" * 10))
+    response_cache.set("b", make_entry(b"b" * 10))
+
+    assert response_cache.get("a")
+
+    response_cache.set("c", make_entry(b"c" * 10))
+    response_cache.set("d", make_entry(b"d" * 30))
+
+    assert [bool(response_cache.get(key)) for key in "abcd"] == [True, False, True, False]
+    assert response_cache.size == 20
+
+
+def test_cached_responses_expire(monkeypatch):
+    response_cache = ResponseCache(max_bytes=20, max_age=60)
+    response_cache.set("a", make_entry(b"a"))
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 60)
+
+    assert response_cache.get("a") is None
+    assert response_cache.size == 0
+
+
+def test_ranges_are_streamed_without_being_cached(app, api):
+    api.bodies["projects"] = b"0123456789"
+
+    with app.test_request_context("/harbor/get/projects", headers={"Range": "bytes=2-5"}):
+        response = registry.harbor_proxy.get("projects")
+
+        assert response.is_streamed
+        assert response.status_code == 206
+        assert response.headers["Content-Range"] == "bytes 2-5/10"
+        assert b"".join(response.response) == b"2345"
+
+    assert api.requests[0][2]["Accept-Encoding"] == "identity"
+
+    assert get(app, "projects").get_data() == b"0123456789"
+    assert len(api.requests) == 2
+
+
+def test_streamed_responses_close_the_upstream_response(app, api, monkeypatch):
+    app.config["HARBOR_PROXY_TTLS"] = []
+    api.bodies["projects"] = b"x" * 100
+    closed = []
+    monkeypatch.setattr(requests.Response, "close", lambda self: closed.append(self))
+
+    with app.test_request_context("/harbor/get/projects"):
+        response = registry.harbor_proxy.get("projects")
+
+        assert response.is_streamed
+        assert response.headers["Content-Type"] == "application/json"
+        assert not closed
+
+        assert b"".join(response.response) == b"x" * 100
+        assert len(closed) == 1
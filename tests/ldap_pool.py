@@ -0,0 +1,116 @@
+import flask
+import ldap3.core.exceptions
+import ldap3.core.results
+import pytest
+
+import registry.ldap_pool
+from registry.ldap_pool import LDAPConnectionPool
+
+
+class FakeConnection:
+    """
+    Stands in for a bound `ldap3.Connection`.
+
+    Each search returns the next of the class's `results`, which is either
+    a list of entries or a failed result's code.
+    """
+
+    results: list = []
+    instances: list = []
+
+    def __init__(self, *args, **kwargs):
+        self.closed = False
+        self.searches = 0
+        self.entries = []
+        self.result = {}
+        FakeConnection.instances.append(self)
+
+    def search(self, *args, **kwargs) -> bool:
+        self.searches += 1
+        result = FakeConnection.results.pop(0)
+
+        if isinstance(result, list):
+            self.entries = result
+            self.result = {"result": ldap3.core.results.RESULT_SUCCESS}
+            return bool(result)
+
+        self.entries = []
+        self.result = {"result": result, "description": "failed"}
+        return False
+
+    def unbind(self) -> None:
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch) -> LDAPConnectionPool:
+    FakeConnection.results = []
+    FakeConnection.instances = []
+    monkeypatch.setattr(registry.ldap_pool.ldap3, "Connection", FakeConnection)
+
+    app = flask.Flask(__name__)
+
+    with app.app_context():
+        yield LDAPConnectionPool("ldaps://ldap.example.org", "cn=user", "password", size=2)
+
+
+def test_connections_are_reused(pool):
+    FakeConnection.results = [["entry"], ["entry"]]
+
+    assert pool.search("dc=example,dc=org", "(uid=1)") == ["entry"]
+    assert pool.search("dc=example,dc=org", "(uid=2)") == ["entry"]
+
+    assert len(FakeConnection.instances) == 1
+    assert FakeConnection.instances[0].searches == 2
+
+
+def test_searches_without_entries_succeed(pool):
+    FakeConnection.results = [[], ldap3.core.results.RESULT_NO_SUCH_OBJECT]
+
+    assert pool.search("dc=example,dc=org", "(uid=1)") == []
+    assert pool.search("dc=example,dc=org", "(uid=2)") == []
+
+    assert len(FakeConnection.instances) == 1
+
+
+def test_failed_searches_are_retried_with_a_new_connection(pool):
+    FakeConnection.results = [ldap3.core.results.RESULT_UNAVAILABLE, ["entry"]]
+
+    assert pool.search("dc=example,dc=org", "(uid=1)") == ["entry"]
+
+    first, second = FakeConnection.instances
+    assert first.closed
+    assert not second.closed
+
+
+def test_failed_retries_raise(pool):
+    FakeConnection.results = [ldap3.core.results.RESULT_BUSY] * 2
+
+    with pytest.raises(ldap3.core.exceptions.LDAPOperationResult):
+        pool.search("dc=example,dc=org", "(uid=1)")
+
+
+def test_connections_are_limited_to_the_pool_size(pool):
+    pool._checkout_timeout = 0.01
+
+    with pool.connection(), pool.connection():
+        with pytest.raises(TimeoutError):
+            pool._checkout()
+
+    with pool.connection():
+        pass
+
+    assert len(FakeConnection.instances) == 2
+
+
+def test_idle_connections_expire(pool):
+    pool._idle_timeout = -1
+
+    with pool.connection():
+        pass
+    with pool.connection():
+        pass
+
+    first, second = FakeConnection.instances
+    assert first.closed
+    assert not second.closed
@@ -0,0 +1,469 @@
+import enum
+import itertools
+import subprocess
+import time
+import types
+
+import flask
+import pytest
+
+import registry.database
+import registry.processing
+from registry.database import Source, State
+
+
+class JobStatus(enum.IntEnum):
+    IDLE = 1
+    RUNNING = 2
+    REMOVED = 3
+    COMPLETED = 4
+    HELD = 5
+
+
+class JobEventType(enum.Enum):
+    SUBMIT = 0
+    JOB_TERMINATED = 5
+    JOB_ABORTED = 9
+    JOB_HELD = 12
+
+
+class FakeJobEvent(dict):
+    def __init__(self, type_: JobEventType, cluster: int, **attrs):
+        super().__init__(attrs)
+        self.type = type_
+        self.cluster = cluster
+        self.proc = 0
+
+
+class FakeJobEventLog:
+    """
+    Stands in for `htcondor.JobEventLog`, whose offsets count events.
+    """
+
+    log: list = []
+
+    def __init__(self, path):
+        self._offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def set_offset(self, offset: int) -> None:
+        self._offset = offset
+
+    def get_offset(self) -> int:
+        return self._offset
+
+    def events(self, stop_after):
+        while self._offset < len(FakeJobEventLog.log):
+            self._offset += 1
+            yield FakeJobEventLog.log[self._offset - 1]
+
+
+class FakeSubmit(dict):
+    """
+    Stands in for `htcondor.Submit`.
+    """
+
+    def jobs(self, clusterid, itemdata=None) -> list:
+        return [{"ClusterId": clusterid, **item} for item in (itemdata or [{}])]
+
+
+class FakeSubmitResult:
+    def __init__(self, cluster_id: int, count: int):
+        self._cluster_id = cluster_id
+        self._count = count
+
+    def cluster(self) -> int:
+        return self._cluster_id
+
+    def clusterad(self) -> dict:
+        return {"ClusterId": self._cluster_id, "TotalSubmitProcs": self._count}
+
+
+class FakeSchedd:
+    """
+    Stands in for `htcondor.Schedd`, with a queue of job ads.
+    """
+
+    def __init__(self):
+        self.ads = []
+        self.queries = []
+        self.submitted = []
+        self.retrieved = []
+        self.removed = []
+        self._cluster_ids = itertools.count(100)
+
+    def query(self, constraint, projection) -> list:
+        self.queries.append(constraint)
+        if constraint == registry.processing.SOTERIA_JOBS_CONSTRAINT:
+            return list(self.ads)
+        return [
+            ad for ad in self.ads if registry.processing.get_job_constraint(ad) == constraint
+        ]
+
+    def submit(self, job, spool, itemdata=None) -> FakeSubmitResult:
+        items = list(itemdata) if itemdata else [{}]
+        self.submitted.append((job, items))
+        return FakeSubmitResult(next(self._cluster_ids), len(items))
+
+    def spool(self, jobs) -> None:
+        pass
+
+    def retrieve(self, constraint) -> None:
+        self.retrieved.append(constraint)
+
+    def act(self, action, constraint) -> None:
+        self.removed.append(constraint)
+
+
+def make_payload(tag: str, size: int = 2**20) -> dict:
+    return {
+        "type": "PUSH_ARTIFACT",
+        "event_data": {
+            "resources": [
+                {
+                    "resource_url": f"harbor.example.com/project/repo:{tag}",
+                    "tag": tag,
+                    "digest": f"sha256:{tag}",
+                    "size": size,
+                },
+            ],
+            "repository": {"namespace": "project", "name": "repo", "repo_type": "public"},
+        },
+    }
+
+
+def make_job_ad(payload, cluster_id: int, status: JobStatus, **attrs) -> dict:
+    return {
+        "ClusterId": cluster_id,
+        "ProcId": 0,
+        "JobStatus": status,
+        "SOTERIA_ID": payload.id_,
+        **attrs,
+    }
+
+
+def insert(*tags: str) -> list:
+    registry.database.insert_new_payloads([(make_payload(tag), Source.harbor) for tag in tags])
+    payloads = registry.database.claim_new_payloads("worker", lease=60)
+    return sorted(payloads, key=lambda payload: payload.tag)
+
+
+@pytest.fixture
+def schedd(monkeypatch) -> FakeSchedd:
+    schedd = FakeSchedd()
+    FakeJobEventLog.log = []
+    htcondor = types.SimpleNamespace(
+        Schedd=lambda: schedd,
+        Submit=FakeSubmit,
+        JobStatus=JobStatus,
+        JobEventType=JobEventType,
+        JobEventLog=FakeJobEventLog,
+        JobAction=types.SimpleNamespace(Remove="Remove"),
+    )
+    monkeypatch.setattr(registry.processing, "htcondor", htcondor)
+    return schedd
+
+
+@pytest.fixture
+def app(tmp_path, schedd) -> flask.Flask:
+    app = flask.Flask(__name__)
+    app.config["DATA_DIR"] = str(tmp_path)
+    app.config["WEBHOOKS_HARBOR_RESOURCE_REGEX"] = r".*"
+    registry.database.init(app)
+
+    with app.app_context():
+        yield app
+
+
+def test_schedd_is_queried_once_per_iteration(app, schedd):
+    first, second = insert("1.0", "2.0")
+    schedd.ads = [
+        make_job_ad(first, 3, JobStatus.COMPLETED),
+        make_job_ad(first, 1, JobStatus.HELD),
+        make_job_ad(second, 2, JobStatus.RUNNING),
+    ]
+
+    iteration = registry.processing.start_iteration()
+
+    assert iteration.jobs[first.id_]["ClusterId"] == 3
+    assert registry.processing.process(first, iteration) == State.completed
+    assert registry.processing.process(second, iteration) is None
+    assert len(schedd.queries) == 1
+    assert len(schedd.retrieved) == 1
+    assert not schedd.submitted
+
+
+def test_jobs_submitted_since_the_iteration_began_are_queried(app, schedd):
+    (payload,) = insert("1.0")
+    iteration = registry.processing.start_iteration()
+
+    registry.database.set_payload_jobs([(payload.id_, 7, 0)])
+    schedd.ads = [make_job_ad(payload, 7, JobStatus.RUNNING)]
+    payload = registry.database.get_payload(payload.id_)
+
+    assert registry.processing.process(payload, iteration) is None
+    assert len(schedd.queries) == 2
+    assert not schedd.submitted
+
+
+def test_batched_payloads_are_submitted_as_one_cluster(app, schedd):
+    app.config["HTCONDOR_BATCH_SUBMIT"] = True
+    payloads = insert("1.0", "2.0", "3.0")
+    iteration = registry.processing.start_iteration()
+
+    for payload in payloads:
+        assert registry.processing.process(payload, iteration) is None
+
+    assert not schedd.submitted
+    assert iteration.pending == payloads
+
+    registry.processing.finish_iteration(iteration)
+
+    ((job, items),) = schedd.submitted
+    assert job["arguments"] == "$(soteria_resource)"
+    assert [item["soteria_id"] for item in items] == [payload.id_ for payload in payloads]
+    jobs = [registry.database.get_payload(payload.id_) for payload in payloads]
+    assert [(job.cluster_id, job.proc_id) for job in jobs] == [(100, 0), (100, 1), (100, 2)]
+    assert iteration.submitted == 3
+    assert not iteration.pending
+
+
+def test_payloads_are_submitted_individually_by_default(app, schedd):
+    payloads = insert("1.0", "2.0")
+    iteration = registry.processing.start_iteration()
+
+    for payload in payloads:
+        assert registry.processing.process(payload, iteration) is None
+    registry.processing.finish_iteration(iteration)
+
+    assert len(schedd.submitted) == 2
+    assert iteration.submitted == 2
+    for payload in payloads:
+        assert registry.processing.get_submit_dir(payload).joinpath("run.sh").exists()
+
+
+@pytest.mark.parametrize(
+    "event, state",
+    [
+        (
+            FakeJobEvent(
+                JobEventType.JOB_TERMINATED, 1, TerminatedNormally=True, ReturnValue=0
+            ),
+            State.completed,
+        ),
+        (
+            FakeJobEvent(
+                JobEventType.JOB_TERMINATED, 1, TerminatedNormally=True, ReturnValue=1
+            ),
+            None,
+        ),
+        (FakeJobEvent(JobEventType.JOB_HELD, 1, HoldReasonCode=1), State.failed),
+        (FakeJobEvent(JobEventType.JOB_HELD, 1, HoldReasonCode=34), None),
+        (FakeJobEvent(JobEventType.JOB_ABORTED, 1), State.failed),
+        (FakeJobEvent(JobEventType.SUBMIT, 1), None),
+    ],
+)
+def test_job_events_imply_payload_states(app, event, state):
+    assert registry.processing.get_event_state(event) == state
+
+
+def test_job_event_log_is_read_incrementally(app, schedd, tmp_path):
+    first, second, third = insert("1.0", "2.0", "3.0")
+    registry.database.set_payload_jobs(
+        [(first.id_, 1, 0), (second.id_, 2, 0), (third.id_, 3, 0)]
+    )
+    (tmp_path / "events.log").write_text("x" * 100)
+    tracker = registry.processing.JobEventTracker(tmp_path / "events.log")
+
+    FakeJobEventLog.log = [
+        FakeJobEvent(JobEventType.SUBMIT, 1),
+        FakeJobEvent(JobEventType.JOB_TERMINATED, 1, TerminatedNormally=True, ReturnValue=0),
+        FakeJobEvent(JobEventType.JOB_HELD, 2, HoldReasonCode=1),
+        FakeJobEvent(JobEventType.JOB_ABORTED, 99),
+    ]
+
+    updates = tracker.read()
+    assert [(payload.id_, state) for payload, state in updates] == [
+        (first.id_, State.completed),
+        (second.id_, State.failed),
+    ]
+    assert len(schedd.retrieved) == 1
+
+    # Until the updates are committed, they are read again.
+    assert len(tracker.read()) == 2
+
+    tracker.commit()
+    FakeJobEventLog.log.append(FakeJobEvent(JobEventType.JOB_ABORTED, 3))
+
+    assert [(payload.id_, state) for payload, state in tracker.read()] == [
+        (third.id_, State.failed),
+    ]
+
+
+def test_rotated_job_event_log_is_read_from_the_start(app, tmp_path):
+    (payload,) = insert("1.0")
+    registry.database.set_payload_jobs([(payload.id_, 1, 0)])
+    registry.database.set_metadata(registry.processing.EVENT_LOG_OFFSET_KEY, "1000")
+    (tmp_path / "events.log").write_text("x" * 100)
+    tracker = registry.processing.JobEventTracker(tmp_path / "events.log")
+
+    FakeJobEventLog.log = [FakeJobEvent(JobEventType.JOB_ABORTED, 1)]
+
+    assert [payload.id_ for payload, _ in tracker.read()] == [payload.id_]
+
+
+def test_missing_job_event_log_has_no_events(app, tmp_path):
+    tracker = registry.processing.JobEventTracker(tmp_path / "events.log")
+
+    assert tracker.read() == []
+
+
+def get_build_result(digest: str) -> tuple:
+    return (
+        registry.database.get_db_conn()
+        .execute(
+            "SELECT payload_id, created_on FROM build_results WHERE digest = :digest",
+            {"digest": digest},
+        )
+        .fetchone()
+    )
+
+
+def test_completed_jobs_record_build_results(app, schedd):
+    (payload,) = insert("1.0")
+    schedd.ads = [make_job_ad(payload, 1, JobStatus.COMPLETED)]
+    registry.database.set_payload_jobs([(payload.id_, 1, 0)])
+    payload = registry.database.get_payload(payload.id_)
+
+    state = registry.processing.process(payload, registry.processing.start_iteration())
+    registry.processing.finalize(payload, state)
+
+    assert get_build_result(payload.digest)[0] == payload.id_
+
+
+def test_build_cache_hits_do_not_refresh_build_results(app, schedd, monkeypatch):
+    (first,) = insert("1.0")
+    registry.database.set_payload_jobs([(first.id_, 1, 0)])
+    monkeypatch.setattr(time, "time", lambda: 1000)
+    registry.processing.finalize(registry.database.get_payload(first.id_), State.completed)
+    registry.database.update_payload(first.id_, State.completed)
+    registry.database.release_payloads("worker")
+
+    monkeypatch.setattr(time, "time", lambda: 2000)
+    (second,) = insert("1.0")
+    state = registry.processing.process(second, registry.processing.start_iteration())
+    registry.processing.finalize(second, state)
+
+    assert state == State.completed
+    assert not schedd.submitted
+    assert get_build_result(second.digest) == (first.id_, 1000)
+
+
+def test_coalesced_payloads_do_not_record_build_results(app):
+    (payload,) = insert("1.0")
+    registry.database.insert_new_payloads([(make_payload("1.0"), Source.harbor)])
+    (alias,) = registry.database.get_payload_aliases(payload.id_)
+
+    registry.processing.finalize(alias, State.completed)
+
+    assert get_build_result(alias.digest) is None
+
+
+def test_job_scripts_expand_variables_in_the_cache_directory(app):
+    app.config["APPTAINER_CACHEDIR"] = "$_CONDOR_SCRATCH_DIR/apptainer cache"
+
+    script = registry.processing.get_job_script("'harbor.example.com/project/repo:1.0'")
+    export = script.splitlines()[1]
+    result = subprocess.run(
+        ["sh", "-c", f'{export}; echo "$APPTAINER_CACHEDIR"'],
+        env={"_CONDOR_SCRATCH_DIR": "/scratch"},
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+
+    assert export == 'export APPTAINER_CACHEDIR="$_CONDOR_SCRATCH_DIR/apptainer cache"'
+    assert result.stdout == "/scratch/apptainer cache\n"
+
+
+@pytest.mark.parametrize("cache_dir", ['/tmp/"cache"', "/tmp/`id`", "/tmp/cache\\"])
+def test_job_scripts_reject_unquotable_cache_directories(app, cache_dir):
+    app.config["APPTAINER_CACHEDIR"] = cache_dir
+
+    with pytest.raises(ValueError):
+        registry.processing.get_job_script("resource")
+
+
+@pytest.mark.parametrize(
+    "value, mebibytes",
+    [(512, 512), ("512", 512), ("4G", 4096), ("4GiB", 4096), ("1.5g", 1536), ("512K", 1)],
+)
+def test_sizes_are_parsed_as_mebibytes(value, mebibytes):
+    assert registry.processing.parse_size(value) == mebibytes
+
+
+@pytest.mark.parametrize(
+    "size, resources",
+    [
+        (2**29, (1, 2048, 10240)),
+        (3 * 2**30, (2, 4096, 30720)),
+        (8 * 2**30, (2, 4096, 51200)),
+    ],
+)
+def test_job_resources_are_chosen_by_image_size(app, size, resources):
+    registry.database.insert_new_payloads([(make_payload("1.0", size=size), Source.harbor)])
+    (payload,) = registry.database.claim_new_payloads("worker", lease=60)
+
+    registry.processing.set_job_resources(payload)
+
+    payload = registry.database.get_payload(payload.id_)
+    assert (payload.request_cpus, payload.request_memory, payload.request_disk) == resources
+
+
+def test_jobs_held_for_memory_are_resubmitted_with_more(app, schedd):
+    app.config["HTCONDOR_MAX_REQUEST_MEMORY"] = "6G"
+    (payload,) = insert("1.0")
+
+    for cluster_id, memory in [(1, 4096), (2, 6144)]:
+        registry.database.set_payload_jobs([(payload.id_, cluster_id, 0)])
+        schedd.ads = [make_job_ad(payload, cluster_id, JobStatus.HELD, HoldReasonCode=34)]
+        payload = registry.database.get_payload(payload.id_)
+
+        assert (
+            registry.processing.process(payload, registry.processing.start_iteration()) is None
+        )
+        assert registry.database.get_payload(payload.id_).request_memory == memory
+
+    assert len(schedd.removed) == 2
+    assert len(schedd.submitted) == 2
+
+    # At the limit, the held job fails its payload.
+    registry.database.set_payload_jobs([(payload.id_, 3, 0)])
+    schedd.ads = [make_job_ad(payload, 3, JobStatus.HELD, HoldReasonCode=34)]
+    payload = registry.database.get_payload(payload.id_)
+
+    assert (
+        registry.processing.process(payload, registry.processing.start_iteration())
+        == State.failed
+    )
+    assert len(schedd.removed) == 2
+
+
+def test_jobs_are_scheduled_by_project(app):
+    app.config["HTCONDOR_ACCOUNTING_GROUP"] = "group_soteria"
+    registry.database.set_project_weight("project", 4.0)
+    (small,) = insert("1.0")
+    registry.database.insert_new_payloads([(make_payload("2.0", size=2**32), Source.harbor)])
+    (large,) = registry.database.claim_new_payloads("worker", lease=60)
+
+    assert registry.processing.get_job_scheduling(small) == {
+        "priority": "30",
+        "accounting_group": "group_soteria",
+        "accounting_group_user": "project",
+    }
+    assert registry.processing.get_job_scheduling(large)["priority"] == "20"
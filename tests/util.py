@@ -1,3 +1,7 @@
+import json
+import time
+from unittest import mock
+
 import flask
 import pytest
 from config import (
@@ -11,6 +15,9 @@ from config import (
 )
 from pytest_mock import MockerFixture
 
+import registry.cache
+import registry.database
+import registry.ldap_pool
 from registry import util
 from registry.app import create_app
 from registry.comanage import COmanageAPI
@@ -193,3 +200,247 @@ class TestUtil:
 
                 # Clean up as we go
                 comanage_api.delete_group(cogroup["Id"])
+
+
+class FakeLDAPPool:
+    def __init__(self, attributes: dict):
+        self.attributes = attributes
+        self.searches = []
+
+    def search(self, base_dn, search_filter, attributes=None):
+        self.searches.append(search_filter)
+        return [mock.Mock(entry_attributes_as_dict=self.attributes)]
+
+
+class TestLDAPIdentity:
+    @pytest.fixture
+    def app(self) -> flask.Flask:
+        app = flask.Flask(__name__)
+        app.config["LDAP_BASE_DN"] = "dc=example,dc=org"
+
+        yield app
+
+    @pytest.fixture
+    def ldap_pool(self, monkeypatch) -> FakeLDAPPool:
+        pool = FakeLDAPPool(
+            {
+                "isMemberOf": ["SOTERIA", "CO:COU:SOTERIA-Collaborators:members:active"],
+                "eduPersonOrcid": ["https://orcid.org/0000-0000-0000-0000"],
+            }
+        )
+        monkeypatch.setattr(registry.ldap_pool, "get_ldap_pool", lambda: pool)
+
+        yield pool
+
+    def test_ldap_is_queried_once_per_request(self, app, ldap_pool):
+        environ = {"OIDC_CLAIM_sub": "http://cilogon.org/serverA/users/1"}
+
+        with app.test_request_context(environ_base=environ):
+            assert util.is_in_soteria_cou()
+            assert util.is_soteria_member()
+            assert not util.is_soteria_researcher()
+            assert util.get_orcid_id() == "https://orcid.org/0000-0000-0000-0000"
+
+        assert len(ldap_pool.searches) == 1
+
+        with app.test_request_context(environ_base=environ):
+            util.get_comanage_groups()
+
+        assert len(ldap_pool.searches) == 2
+
+    def test_ldap_is_not_queried_without_a_sub(self, app, ldap_pool):
+        with app.test_request_context():
+            assert util.get_comanage_groups() == []
+            assert util.get_orcid_id() is None
+
+        assert ldap_pool.searches == []
+
+
+class FakeHarborUsersAPI:
+    def __init__(self, users: list):
+        self.users = users
+        self.fetched = []
+
+    def get_all_users(self, params=None):
+        return sorted(self.users, key=lambda u: u["creation_time"], reverse=True)
+
+    def get_user(self, user_id):
+        self.fetched.append(user_id)
+        return next(u for u in self.users if u["user_id"] == user_id)
+
+
+def make_harbor_user(user_id: int, creation_time: str) -> dict:
+    return {
+        "user_id": user_id,
+        "username": f"user{user_id}",
+        "creation_time": creation_time,
+        "oidc_user_meta": {"subiss": f"subiss{user_id}"},
+    }
+
+
+class TestHarborUserIndex:
+    @pytest.fixture
+    def app(self, tmp_path) -> flask.Flask:
+        app = flask.Flask(__name__)
+        app.config["DATA_DIR"] = str(tmp_path)
+        app.config["CACHE_TYPE"] = "NullCache"
+        registry.database.init(app)
+        registry.cache.init(app)
+
+        with app.app_context():
+            yield app
+
+    @pytest.fixture
+    def api(self, monkeypatch) -> FakeHarborUsersAPI:
+        api = FakeHarborUsersAPI(
+            [
+                make_harbor_user(1, "2024-01-01T00:00:00.123Z"),
+                make_harbor_user(2, "2024-02-01T00:00:00.1Z"),
+            ]
+        )
+        monkeypatch.setattr(util, "get_admin_harbor_api", lambda: api)
+
+        yield api
+
+    def test_only_new_users_are_indexed(self, app, api):
+        assert util.refresh_harbor_user_index() == 2
+
+        api.users.append(make_harbor_user(3, "2024-03-01T00:00:00Z"))
+        api.fetched.clear()
+
+        # The newest previously indexed user is indexed again, since
+        # creation times are compared only to the second.
+        assert util.refresh_harbor_user_index() == 2
+        assert api.fetched == [3, 2]
+        assert registry.database.get_harbor_user_id("subiss3") == 3
+
+    def test_users_are_looked_up_in_the_index(self, app, api):
+        assert util.get_harbor_user_by_subiss("subiss1")["user_id"] == 1
+
+        api.fetched.clear()
+
+        assert util.get_harbor_user_by_subiss("subiss2")["user_id"] == 2
+        assert api.fetched == [2]
+        assert util.get_harbor_user_by_subiss("unknown") is None
+
+    def test_stale_index_entries_are_replaced(self, app, api):
+        util.refresh_harbor_user_index()
+        api.users[0]["oidc_user_meta"]["subiss"] = "moved"
+        api.users[1]["oidc_user_meta"]["subiss"] = "subiss1"
+
+        assert util.get_harbor_user_by_subiss("subiss1")["user_id"] == 2
+        assert registry.database.get_harbor_user_id("subiss1") == 2
+
+
+class FakeProjectsAPI:
+    def __init__(self, group_names: list):
+        self.group_names = group_names
+        self.requests = []
+
+    def get_groups(self, coperson_id):
+        return mock.Mock(json=lambda: {"CoGroups": [{"Name": n} for n in self.group_names]})
+
+    def get_project(self, name):
+        self.requests.append(name)
+        return mock.Mock(json=lambda: {"name": name})
+
+    def get_project_summary(self, name):
+        return mock.Mock(json=lambda: {"quota": {"hard": {"storage": 1}}})
+
+
+class TestGetHarborProjects:
+    @pytest.fixture
+    def app(self) -> flask.Flask:
+        app = flask.Flask(__name__)
+        app.config["CACHE_TYPE"] = "SimpleCache"
+        registry.cache.init(app)
+
+        with app.app_context():
+            yield app
+
+    @pytest.fixture
+    def api(self, monkeypatch) -> FakeProjectsAPI:
+        api = FakeProjectsAPI(
+            [
+                "soteria-zeta-owners",
+                "soteria-alpha-developers",
+                "soteria-beta-guests",
+                "unrelated",
+            ]
+        )
+        monkeypatch.setattr(util, "get_admin_comanage_api", lambda: api)
+        monkeypatch.setattr(util, "get_admin_harbor_api", lambda: api)
+        monkeypatch.setattr(util, "get_coperson_id", lambda: 1)
+
+        yield api
+
+    def test_projects_are_returned_in_order_with_quotas(self, app, api):
+        projects = util.get_harbor_projects(owner=True, developer=True)
+
+        assert [p["name"] for p in projects] == ["alpha", "zeta"]
+        assert all(p["quota"] == {"hard": {"storage": 1}} for p in projects)
+
+    def test_projects_are_cached_briefly(self, app, api):
+        util.get_harbor_projects(owner=True, developer=True, guest=True)
+        util.get_harbor_projects(owner=True, developer=True, guest=True)
+
+        assert sorted(api.requests) == ["alpha", "beta", "zeta"]
+
+        util.cache.delete_memoized(util.get_harbor_project_with_quota, "beta")
+        util.get_harbor_projects(guest=True)
+
+        assert sorted(api.requests) == ["alpha", "beta", "beta", "zeta"]
+
+    def test_items_are_mapped_concurrently_in_order(self, app):
+        app.config["HARBOR_API_MAX_WORKERS"] = 4
+
+        def get_name(item):
+            time.sleep(0.01 * (5 - item))
+            return f"{flask.current_app.name}-{item}"
+
+        assert util.map_concurrently(get_name, range(5)) == [
+            f"{app.name}-{i}" for i in range(5)
+        ]
+
+
+class TestJSONArrays:
+    @pytest.fixture
+    def app(self) -> flask.Flask:
+        app = flask.Flask(__name__)
+
+        with app.test_request_context():
+            yield app
+
+    @pytest.mark.parametrize("items", [[], [{"a": 1}], [1, "two", None, [3]]])
+    def test_items_are_serialized_as_an_array(self, items):
+        assert json.loads("".join(util.iter_json_array(iter(items)))) == items
+
+    def test_each_item_is_a_separate_chunk(self):
+        assert list(util.iter_json_array([])) == ["[]"]
+        assert list(util.iter_json_array([1])) == ["[1", "]"]
+        assert list(util.iter_json_array([1, 2])) == ["[1", ",2", "]"]
+
+    def test_items_are_streamed_as_they_are_produced(self, app):
+        produced = []
+
+        def generate():
+            for i in range(3):
+                produced.append(i)
+                yield i
+
+        response = util.stream_json_array(generate())
+
+        assert response.is_streamed
+        assert response.mimetype == "application/json"
+        assert produced == [0]
+
+        assert json.loads(response.get_data()) == [0, 1, 2]
+        assert produced == [0, 1, 2]
+
+    def test_errors_before_the_first_item_are_raised(self, app):
+        def generate():
+            raise RuntimeError("Harbor is unavailable")
+            yield
+
+        with pytest.raises(RuntimeError):
+            util.stream_json_array(generate())
@@ -0,0 +1,86 @@
+import logging
+import socket
+import stat
+
+import flask
+import pytest
+
+import registry.wakeup
+from registry.wakeup import Listener
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch) -> flask.Flask:
+    monkeypatch.setattr(registry.wakeup, "_warned", False)
+
+    app = flask.Flask(__name__)
+    app.config["DATA_DIR"] = str(tmp_path)
+
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def listener(app) -> Listener:
+    listener = Listener(registry.wakeup.get_socket_path(), settle=0)
+    yield listener
+    listener.close()
+
+
+def test_notifications_wake_up_the_listener(app, listener):
+    assert not listener.wait(0)
+
+    registry.wakeup.notify()
+
+    assert listener.wait(1)
+    assert not listener.wait(0)
+
+
+def test_bursts_of_notifications_wake_up_the_listener_once(app, listener):
+    for _ in range(5):
+        registry.wakeup.notify(app)
+
+    assert listener.wait(1)
+    assert not listener.wait(0)
+
+
+def test_socket_is_only_writable_by_the_owner_and_group(app, listener):
+    mode = registry.wakeup.get_socket_path().stat().st_mode
+
+    assert stat.S_ISSOCK(mode)
+    assert stat.S_IMODE(mode) == 0o660
+
+
+def test_stale_sockets_are_replaced(app):
+    path = registry.wakeup.get_socket_path()
+    path.parent.mkdir(parents=True)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as stale:
+        stale.bind(str(path))
+
+    listener = Listener(path, settle=0)
+    registry.wakeup.notify()
+
+    assert listener.wait(1)
+    listener.close()
+    assert not path.exists()
+
+
+def test_notifications_are_dropped_when_no_one_is_listening(app, caplog):
+    with caplog.at_level(logging.WARNING):
+        registry.wakeup.notify()
+
+    assert not caplog.records
+
+
+def test_other_failures_are_logged_once(app, caplog, monkeypatch):
+    def sendto(self, data, address):
+        raise PermissionError("denied")
+
+    monkeypatch.setattr(socket.socket, "sendto", sendto)
+
+    with caplog.at_level(logging.WARNING):
+        registry.wakeup.notify()
+        registry.wakeup.notify()
+
+    (record,) = caplog.records
+    assert record.getMessage().startswith("Failed to notify the polling loop")
@@ -0,0 +1,110 @@
+import logging
+
+import flask
+import pytest
+
+import registry.catalog
+import registry.database
+import registry.webhooks
+from registry.database import Source
+from registry.webhooks import PayloadWriter
+
+
+def make_payload(tag: str) -> dict:
+    return {
+        "type": "PUSH_ARTIFACT",
+        "event_data": {
+            "resources": [
+                {
+                    "resource_url": f"harbor.example.com/project/repo:{tag}",
+                    "tag": tag,
+                    "digest": f"sha256:{tag}",
+                },
+            ],
+            "repository": {"namespace": "project", "name": "repo", "repo_type": "public"},
+        },
+    }
+
+
+def get_tags() -> list:
+    rows = (
+        registry.database.get_db_conn()
+        .execute("SELECT tag FROM webhook_payloads ORDER BY tag")
+        .fetchall()
+    )
+    return [tag for (tag,) in rows]
+
+
+@pytest.fixture
+def app(tmp_path) -> flask.Flask:
+    app = flask.Flask(__name__)
+    app.config["DATA_DIR"] = str(tmp_path)
+    registry.database.init(app)
+    registry.catalog.init(app)
+
+    with app.app_context():
+        yield app
+
+
+def test_payloads_are_written_in_batches(app, monkeypatch):
+    batches = []
+    insert_new_payloads = registry.database.insert_new_payloads
+
+    def record_batch(payloads, app=None):
+        batches.append(len(payloads))
+        insert_new_payloads(payloads, app=app)
+
+    monkeypatch.setattr(registry.database, "insert_new_payloads", record_batch)
+
+    writer = PayloadWriter(app, batch_size=3, batch_delay=60)
+    for i in range(7):
+        writer.submit(make_payload(f"{i}.0"), Source.harbor)
+    writer.start()
+    writer.stop()
+
+    assert batches == [3, 3, 1]
+    assert get_tags() == [f"{i}.0" for i in range(7)]
+    assert registry.catalog.list_artifacts("project", "repo")[1] == 7
+
+
+def test_malformed_payloads_do_not_lose_their_batch(app, caplog):
+    writer = PayloadWriter(app, batch_size=10, batch_delay=60)
+    writer.submit(make_payload("1.0"), Source.harbor)
+    writer.submit({"type": "PUSH_ARTIFACT", "event_data": {}}, Source.harbor)
+    writer.submit(make_payload("2.0"), Source.harbor)
+    writer.start()
+
+    with caplog.at_level(logging.WARNING):
+        writer.stop()
+
+    assert get_tags() == ["1.0", "2.0"]
+    assert registry.catalog.list_artifacts("project", "repo")[1] == 2
+    assert "Skipping a webhook payload" in caplog.text
+
+
+def test_payloads_are_written_immediately_by_default(app):
+    with app.test_request_context():
+        registry.webhooks.ingest_payload(make_payload("1.0"), Source.harbor)
+
+    assert get_tags() == ["1.0"]
+
+
+def test_logged_payloads_are_truncated(app, caplog):
+    app.config["WEBHOOKS_LOG_MAX_CHARS"] = 20
+
+    with caplog.at_level(logging.INFO, logger=app.logger.name):
+        registry.webhooks.log_payload(make_payload("1.0"), Source.harbor)
+
+    (record,) = caplog.records
+    assert (
+        record.getMessage() == 'Webhook called from harbor: {"type":"PUSH_ARTIFA... (214 chars)'
+    )
+
+
+def test_payloads_are_not_logged_below_the_configured_level(app, caplog):
+    app.config["WEBHOOKS_LOG_LEVEL"] = "DEBUG"
+
+    with caplog.at_level(logging.INFO, logger=app.logger.name):
+        registry.webhooks.log_payload(make_payload("1.0"), Source.harbor)
+
+    assert not caplog.records